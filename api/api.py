@@ -1,14 +1,22 @@
 import os
 import threading
-from flask import jsonify, send_file
+from flask import jsonify, request, send_file
+from pymongo.errors import ConnectionFailure
 
-from api.common import app, db, manager, logger
+from api.common import app, db, manager, mongo, logger
+from api.config import Config
 from api.routes.users import users_bp
 from api.routes.services import services_bp
 from api.routes.stats import stats_bp
 from api.routes.notifications import notifications_bp
 from api.routes.config_export import config_export_bp
-from api.services.notification_service import background_notifications_check
+from api.routes.ciphers import ciphers_bp
+from api.routes.dashboard import dashboard_bp
+from api.routes.scheduler import scheduler_bp
+from api.services.scheduled_jobs import start_scheduler
+from api.services.user_query import ensure_user_indexes
+from api.services.versioning import invalidate
+from api.services.stats_service import background_stats_refresh
 
 
 @app.route('/')
@@ -26,6 +34,18 @@ app.register_blueprint(services_bp)
 app.register_blueprint(stats_bp)
 app.register_blueprint(notifications_bp)
 app.register_blueprint(config_export_bp)
+app.register_blueprint(ciphers_bp)
+app.register_blueprint(dashboard_bp)
+app.register_blueprint(scheduler_bp)
+
+
+@app.after_request
+def invalidate_versions(response):
+    # Запись через API: версии для ETag в этом воркере меняются сразу, не
+    # дожидаясь события change stream
+    if request.method not in ('GET', 'HEAD', 'OPTIONS') and response.status_code < 400:
+        invalidate('users', 'logs')
+    return response
 
 
 @app.errorhandler(404)
@@ -33,16 +53,36 @@ def not_found_error(error):
     return jsonify({'success': False, 'message': 'Resource not found'}), 404
 
 
+@app.errorhandler(ConnectionFailure)
+def database_unavailable(error):
+    logger.error(f'MongoDB unavailable: {error}')
+    return jsonify({'success': False, 'message': 'Database unavailable'}), 503
+
+
 @app.errorhandler(500)
 def internal_error(error):
     logger.error(f'Server Error: {error}')
     return jsonify({'success': False, 'message': 'Internal server error'}), 500
 
 
-if db is not None:
-    notification_thread = threading.Thread(target=background_notifications_check, daemon=True)
-    notification_thread.start()
-    logger.info('Background notifications thread started')
+def prepare_database():
+    """Ждет MongoDB в фоне и создает индексы: воркер стартует, не дожидаясь базы"""
+    mongo.wait_available()
+    try:
+        ensure_user_indexes(db)
+    except Exception as e:
+        logger.warning(f'Could not create user indexes: {e}')
+
+
+threading.Thread(target=prepare_database, daemon=True).start()
+
+# Периодические задачи выполняет один воркер — держатель аренды лидера
+if Config.SCHEDULER_ENABLED:
+    start_scheduler()
+
+stats_thread = threading.Thread(target=background_stats_refresh, daemon=True)
+stats_thread.start()
+logger.info('Background stats refresh thread started')
 
 
 if __name__ == '__main__':
@@ -50,7 +90,7 @@ if __name__ == '__main__':
     host = os.getenv('FLASK_HOST', '0.0.0.0')
 
     logger.info(f'Starting API server on {host}:{port}')
-    if manager is not None and db is not None:
+    if manager is not None:
         try:
             manager.initialize_admin()
             manager.sync_services()
@@ -1,13 +1,12 @@
-from flask import Flask
+from functools import wraps
+
+from flask import Flask, jsonify
 from flask_cors import CORS
-from pymongo import MongoClient
-from datetime import datetime
-from bson import ObjectId
-import json
 import logging
 
 from api.config_generator import ShadowsocksConfigManager
-from api.config import Config
+from api.database import db, mongo
+from api.serialization import MongoJSONProvider
 
 app = Flask(
     __name__,
@@ -15,30 +14,25 @@ app = Flask(
     static_url_path='/static',
     template_folder='../templates',
 )
+app.json = MongoJSONProvider(app)
 CORS(app)
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 
-class MongoJSONEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, ObjectId):
-            return str(obj)
-        if isinstance(obj, datetime):
-            return obj.isoformat()
-        return super().default(obj)
-
+# db — ленивая ссылка на базу из общего пула процесса (api/database.py):
+# импорт не ждет MongoDB, соединение открывается при первом запросе.
+# Менеджер тоже не подключается при создании, поэтому он есть всегда
+manager = ShadowsocksConfigManager()
 
-app.json_encoder = MongoJSONEncoder
 
-try:
-    manager = ShadowsocksConfigManager()
-    client = MongoClient(Config.MONGO_URI, serverSelectionTimeoutMS=5000, connectTimeoutMS=5000)
-    client.admin.command('ping')
-    db = client[Config.MONGO_DB]
-    logger.info("✓ Connected to MongoDB")
-except Exception as e:
-    logger.error(f"✗ MongoDB connection failed: {e}")
-    manager = None
-    db = None
+def requires_database(view):
+    """Сразу 503, если MongoDB недоступна по событиям топологии клиента,
+    вместо ожидания serverSelectionTimeout в обработчике"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if mongo.state == 'unavailable':
+            return jsonify({'success': False, 'message': 'Database unavailable'}), 503
+        return view(*args, **kwargs)
+    return wrapper
@@ -1,4 +1,5 @@
-from pymongo import MongoClient
+from pymongo import UpdateOne, DeleteOne
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 import json
 import os
 import logging
@@ -6,181 +7,88 @@ from datetime import datetime, timedelta
 from pathlib import Path
 from typing import List, Dict
 from api.config import Config
+from api.database import db
+from api.services.cipher_service import AEAD_METHODS, get_default_method
+from api.host_channel import get_host_channel, SYSTEMCTL_PATH
+from api.lease_manager import LeaseManager
+from api.services.user_query import build_user_filter
+import re
 import secrets
 import base64
-import subprocess
 import time
+from contextlib import nullcontext
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Имя пользователя попадает в пути файлов и текст unit-файла systemd
+USERNAME_PATTERN = re.compile(r'^[A-Za-z0-9_.-]{1,64}$')
+
+
 class HostSystemctlManager:
-    """Менеджер для работы с systemctl на хосте через chroot с поддержкой D-Bus"""
+    """Менеджер для работы с systemctl на хосте через постоянный канал команд"""
+    
+    @staticmethod
+    def run_on_host(argv, timeout=None):
+        """Выполняет произвольную команду на хосте"""
+        channel = get_host_channel()
+        caps = channel.detect_capabilities()
+        if not caps['host_mounted']:
+            return {
+                'success': False,
+                'error': f'{Config.HOST_ROOT} directory not mounted. Please mount host root with -v /:/host:ro',
+                'returncode': 1
+            }
+        
+        result = channel.run(argv, timeout)
+        response = {
+            'success': result['returncode'] == 0,
+            'stdout': result.get('stdout', '').strip(),
+            'stderr': result.get('stderr', '').strip(),
+            'returncode': result['returncode']
+        }
+        if result.get('error'):
+            response['error'] = result['error']
+        return response
     
     @staticmethod
     def systemctl(action, service_name=None):
-        """Выполняет systemctl команду на хосте через chroot"""
+        """Выполняет systemctl команду на хосте"""
         try:
-            # Проверяем, смонтирована ли корневая ФС хоста
-            if not os.path.exists('/host'):
-                logger.error("/host directory not mounted")
-                return {
-                    'success': False,
-                    'error': '/host directory not mounted. Please mount host root with -v /:/host:ro',
-                    'returncode': 1
-                }
-            
-            # Путь к systemctl на хосте
-            systemctl_path = '/usr/bin/systemctl'
-            
-            # Проверяем наличие D-Bus сокетов
-            dbus_socket_paths = [
-                '/run/systemd/private',
-                '/run/dbus/system_bus_socket',
-                '/var/run/dbus/system_bus_socket'
-            ]
-            
-            dbus_available = False
-            for socket_path in dbus_socket_paths:
-                check_cmd = ['chroot', '/host', 'test', '-e', socket_path]
-                check_result = subprocess.run(check_cmd, capture_output=True)
-                if check_result.returncode == 0:
-                    dbus_available = True
-                    logger.info(f"D-Bus socket found at: {socket_path}")
-                    break
-            
-            if not dbus_available:
-                logger.warning("No D-Bus sockets found, trying alternative methods")
-            
-            # Формируем команду
-            if action == 'daemon-reload':
-                cmd = ['chroot', '/host', systemctl_path, 'daemon-reload']
-            elif service_name:
-                cmd = ['chroot', '/host', systemctl_path, action, service_name]
-            else:
-                cmd = ['chroot', '/host', systemctl_path, action]
+            cmd = [SYSTEMCTL_PATH, action]
+            if service_name and action != 'daemon-reload':
+                cmd.append(service_name)
             
             logger.info(f"Executing on host: {' '.join(cmd)}")
+            result = HostSystemctlManager.run_on_host(cmd)
             
-            # Добавляем переменные окружения для D-Bus
-            env = os.environ.copy()
-            
-            # Пробуем разные возможные пути к D-Bus сокету
-            dbus_addresses = [
-                'unix:path=/host/run/systemd/private',
-                'unix:path=/host/run/dbus/system_bus_socket',
-                'unix:path=/host/var/run/dbus/system_bus_socket'
-            ]
-            
-            for addr in dbus_addresses:
-                if os.path.exists(addr.replace('/host', '')):
-                    env['DBUS_SYSTEM_BUS_ADDRESS'] = addr
-                    logger.info(f"Setting DBUS_SYSTEM_BUS_ADDRESS={addr}")
-                    break
-            
-            result = subprocess.run(
-                cmd,
-                capture_output=True,
-                text=True,
-                timeout=30,
-                env=env
-            )
-            
-            if result.returncode == 0:
+            if result['success']:
                 logger.info(f"Command successful: {action} {service_name if service_name else ''}")
-                return {
-                    'success': True,
-                    'stdout': result.stdout.strip(),
-                    'stderr': result.stderr.strip(),
-                    'returncode': result.returncode
-                }
-            else:
-                logger.warning(f"Command failed with code {result.returncode}: {result.stderr}")
-                
-                # Если ошибка связана с D-Bus, пробуем альтернативные методы
-                if "Failed to connect to bus" in result.stderr:
-                    logger.info("Trying alternative method 1: Using nsenter without D-Bus...")
-                    
-                    # Метод 1: nsenter (может работать без D-Bus в некоторых случаях)
-                    try:
-                        if action == 'daemon-reload':
-                            alt_cmd = ['nsenter', '-t', '1', '-m', '-u', '-n', '-i', 
-                                      'sh', '-c', 'systemctl daemon-reload']
-                        elif service_name:
-                            alt_cmd = ['nsenter', '-t', '1', '-m', '-u', '-n', '-i', 
-                                      'sh', '-c', f'systemctl {action} {service_name}']
-                        else:
-                            alt_cmd = ['nsenter', '-t', '1', '-m', '-u', '-n', '-i', 
-                                      'sh', '-c', f'systemctl {action}']
-                        
-                        logger.info(f"Trying nsenter: {' '.join(alt_cmd)}")
-                        alt_result = subprocess.run(
-                            alt_cmd,
-                            capture_output=True,
-                            text=True,
-                            timeout=30
-                        )
-                        
-                        if alt_result.returncode == 0:
-                            logger.info("nsenter method successful")
-                            return {
-                                'success': True,
-                                'stdout': alt_result.stdout.strip(),
-                                'stderr': alt_result.stderr.strip(),
-                                'returncode': alt_result.returncode
-                            }
-                    except Exception as e:
-                        logger.warning(f"nsenter method failed: {e}")
-                    
-                    logger.info("Trying alternative method 2: Direct service file manipulation...")
-                    
-                    # Метод 2: Прямая манипуляция службой через файлы
-                    if action in ['start', 'stop', 'restart']:
-                        try:
-                            if action == 'start':
-                                # Для запуска используем systemctl с --no-block
-                                start_cmd = ['chroot', '/host', systemctl_path, 'start', '--no-block', service_name]
-                                start_result = subprocess.run(start_cmd, capture_output=True, text=True, timeout=30)
-                                if start_result.returncode == 0:
-                                    return {
-                                        'success': True,
-                                        'stdout': start_result.stdout,
-                                        'stderr': start_result.stderr,
-                                        'returncode': 0
-                                    }
-                            elif action == 'stop':
-                                # Для остановки используем kill
-                                pid_cmd = ['chroot', '/host', 'pgrep', '-f', f'ss-server.*{service_name}']
-                                pid_result = subprocess.run(pid_cmd, capture_output=True, text=True)
-                                if pid_result.returncode == 0 and pid_result.stdout.strip():
-                                    pid = pid_result.stdout.strip().split('\n')[0]
-                                    kill_cmd = ['chroot', '/host', 'kill', pid]
-                                    subprocess.run(kill_cmd, capture_output=True)
-                                    return {'success': True, 'message': f'Sent kill signal to PID {pid}'}
-                        except Exception as e:
-                            logger.warning(f"Direct manipulation failed: {e}")
-                
-                return {
-                    'success': False,
-                    'stdout': result.stdout.strip(),
-                    'stderr': result.stderr.strip(),
-                    'returncode': result.returncode
-                }
+                return result
+            
+            logger.warning(f"Command failed with code {result['returncode']}: {result['stderr'] or result.get('error', '')}")
+            
+            # Если systemd недоступен через D-Bus, пробуем обойтись без него
+            if "Failed to connect to bus" in result['stderr'] and action in ['start', 'stop']:
+                logger.info("Trying alternative method: Direct service manipulation...")
+                try:
+                    if action == 'start':
+                        # Для запуска используем systemctl с --no-block
+                        start_result = HostSystemctlManager.run_on_host([SYSTEMCTL_PATH, 'start', '--no-block', service_name])
+                        if start_result['success']:
+                            return start_result
+                    elif action == 'stop':
+                        # Для остановки используем kill
+                        pid_result = HostSystemctlManager.run_on_host(['pgrep', '-f', f'ss-server.*{service_name}'])
+                        if pid_result['success'] and pid_result['stdout']:
+                            pid = pid_result['stdout'].split('\n')[0]
+                            HostSystemctlManager.run_on_host(['kill', pid])
+                            return {'success': True, 'message': f'Sent kill signal to PID {pid}'}
+                except Exception as e:
+                    logger.warning(f"Direct manipulation failed: {e}")
+            
+            return result
                 
-        except FileNotFoundError as e:
-            logger.error(f"Command not found: {e}")
-            return {
-                'success': False,
-                'error': f'Command not found: {e}',
-                'returncode': 127
-            }
-        except subprocess.TimeoutExpired:
-            logger.error("Command timed out")
-            return {
-                'success': False,
-                'error': 'Command timed out',
-                'returncode': 124
-            }
         except Exception as e:
             logger.error(f"Error executing command: {e}")
             import traceback
@@ -196,7 +104,7 @@ class HostSystemctlManager:
         """Проверяет статус службы на хосте"""
         try:
             # Проверяем существование файла службы
-            service_file = f"/host/etc/systemd/system/{service_name}"
+            service_file = f"{Config.HOST_ROOT}/etc/systemd/system/{service_name}"
             if not os.path.exists(service_file):
                 return {
                     'success': True,
@@ -216,12 +124,11 @@ class HostSystemctlManager:
             else:
                 config_pattern = f"config-{username}.json"
             
-            pgrep_cmd = ['chroot', '/host', 'pgrep', '-f', f'ss-server.*{config_pattern}']
-            pgrep_result = subprocess.run(pgrep_cmd, capture_output=True, text=True)
-            is_active = pgrep_result.returncode == 0
+            pgrep_result = HostSystemctlManager.run_on_host(['pgrep', '-f', f'ss-server.*{config_pattern}'])
+            is_active = pgrep_result['returncode'] == 0
             
             # Проверяем включенность через symlink
-            wants_dir = f"/host/etc/systemd/system/multi-user.target.wants/{service_name}"
+            wants_dir = f"{Config.HOST_ROOT}/etc/systemd/system/multi-user.target.wants/{service_name}"
             is_enabled = os.path.exists(wants_dir)
             
             # Получаем статус через systemctl если возможно
@@ -237,7 +144,7 @@ class HostSystemctlManager:
                 'enabled': is_enabled,
                 'status': 'active' if is_active else 'inactive',
                 'status_output': status_output,
-                'pid': pgrep_result.stdout.strip() if is_active else None
+                'pid': pgrep_result['stdout'] if is_active else None
             }
             
         except Exception as e:
@@ -249,7 +156,8 @@ class HostSystemctlManager:
 
 
 class ShadowsocksServiceManager:
-    def __init__(self):
+    def __init__(self, lease_manager=None):
+        self.lease_manager = lease_manager
         self.config_dir = Path("/etc/shadowsocks-libev")
         self.service_dir = Path("/etc/systemd/system")
         self.admin_service = "shadowsocks.service"
@@ -284,6 +192,29 @@ class ShadowsocksServiceManager:
             "mode": "tcp_and_udp"
         }
     
+    def admin_method(self) -> str:
+        """Метод общего конфига admin: ss-server обслуживает им все порты port_password.
+
+        Пока конфига нет — метод по умолчанию (с учетом бенчмарка шифров).
+        """
+        try:
+            with open(self.config_dir / "config.json", 'r') as f:
+                method = json.load(f).get('method')
+        except (OSError, ValueError):
+            method = None
+        return method or get_default_method()
+    
+    def _lease(self, resource):
+        """Аренда общего ресурса; без MongoDB работаем без блокировок"""
+        if self.lease_manager is None:
+            return nullcontext()
+        return self.lease_manager.hold(resource)
+    
+    def daemon_reload(self) -> Dict:
+        """Перезагружает конфигурацию systemd (одновременно только один воркер)"""
+        with self._lease('daemon-reload'):
+            return HostSystemctlManager.systemctl('daemon-reload')
+    
     def manage_service(self, service_name: str, action: str) -> Dict:
         """Управляет службой на хосте"""
         try:
@@ -312,7 +243,7 @@ class ShadowsocksServiceManager:
             # Если команда не удалась, пробуем перезагрузить systemd и повторить
             if not result['success'] and action in ['start', 'stop', 'restart']:
                 logger.warning(f"First attempt failed, reloading systemd and retrying...")
-                HostSystemctlManager.systemctl('daemon-reload')
+                self.daemon_reload()
                 time.sleep(2)
                 result = HostSystemctlManager.systemctl(action, service_name)
             
@@ -382,6 +313,7 @@ class ShadowsocksServiceManager:
             # Создаем конфиг для admin
             admin_config = self.admin_config.copy()
             admin_config["port_password"] = {str(admin_port): admin_password}
+            admin_config["method"] = self.admin_method()
             
             # Сохраняем конфиг admin
             admin_config_path = self.config_dir / "config.json"
@@ -419,7 +351,7 @@ WantedBy=multi-user.target
             logger.info(f"✓ Admin service created at {service_path}")
             
             # Перезагружаем systemd
-            HostSystemctlManager.systemctl('daemon-reload')
+            self.daemon_reload()
             time.sleep(2)
             
             # Включаем и запускаем службу
@@ -442,37 +374,36 @@ WantedBy=multi-user.target
             traceback.print_exc()
             return {"success": False, "error": str(e)}
     
-    def create_user_service(self, user_data: Dict) -> Dict:
-        """Создает службу для пользователя"""
-        try:
-            username = user_data.get('username')
-            port = user_data.get('port')
-            password = user_data.get('password')
-            method = user_data.get('method', Config.SS_METHOD)
-            
-            if not all([username, port, password]):
-                return {"success": False, "error": "Missing required user data"}
-            
-            logger.info(f"Creating service for user: {username}, port: {port}")
-            
-            # Создаем конфиг
-            user_config = self.single_user_template.copy()
-            user_config.update({
-                "server_port": port,
-                "password": password,
-                "method": method
-            })
-            
-            config_path = self.config_dir / f"config-{username}.json"
-            with open(config_path, 'w') as f:
-                json.dump(user_config, f, indent=2)
-            os.chmod(config_path, 0o644)
-            
-            # Создаем службу
-            service_name = f"shadowsocks-{username}.service"
-            service_path = self.service_dir / service_name
-            
-            service_content = f"""[Unit]
+    def write_user_service_files(self, user_data: Dict) -> str:
+        """Записывает конфиг и unit-файл пользователя, возвращает имя службы"""
+        username = user_data.get('username')
+        port = user_data.get('port')
+        password = user_data.get('password')
+        method = user_data.get('method', Config.SS_METHOD)
+        
+        if not all([username, port, password]):
+            raise ValueError("Missing required user data")
+        if not isinstance(username, str) or not USERNAME_PATTERN.fullmatch(username):
+            raise ValueError(f"Invalid username: {username!r}")
+        
+        # Создаем конфиг
+        user_config = self.single_user_template.copy()
+        user_config.update({
+            "server_port": port,
+            "password": password,
+            "method": method
+        })
+        
+        config_path = self.config_dir / f"config-{username}.json"
+        with open(config_path, 'w') as f:
+            json.dump(user_config, f, indent=2)
+        os.chmod(config_path, 0o644)
+        
+        # Создаем службу
+        service_name = f"shadowsocks-{username}.service"
+        service_path = self.service_dir / service_name
+        
+        service_content = f"""[Unit]
 Description=Shadowsocks Server for {username} (Port: {port})
 After=network.target
 
@@ -489,15 +420,30 @@ LimitNOFILE=32768
 [Install]
 WantedBy=multi-user.target
 """
+        
+        with open(service_path, 'w') as f:
+            f.write(service_content)
+        os.chmod(service_path, 0o644)
+        
+        return service_name
+    
+    def create_user_service(self, user_data: Dict) -> Dict:
+        """Создает службу для пользователя"""
+        try:
+            username = user_data.get('username')
+            port = user_data.get('port')
             
-            with open(service_path, 'w') as f:
-                f.write(service_content)
-            os.chmod(service_path, 0o644)
+            logger.info(f"Creating service for user: {username}, port: {port}")
+            
+            try:
+                service_name = self.write_user_service_files(user_data)
+            except ValueError as e:
+                return {"success": False, "error": str(e)}
             
             logger.info(f"✓ Created service: {service_name}")
             
             # Перезагружаем systemd
-            HostSystemctlManager.systemctl('daemon-reload')
+            self.daemon_reload()
             time.sleep(2)
             
             # Включаем и запускаем
@@ -519,8 +465,33 @@ WantedBy=multi-user.target
             traceback.print_exc()
             return {"success": False, "error": str(e)}
     
-    def delete_user_service(self, username: str) -> Dict:
-        """Удаляет службу пользователя"""
+    def enable_and_start_services(self, service_names: List[str], concurrency: int = None) -> Dict[str, Dict]:
+        """Включает службы пачками одной командой systemctl и запускает их параллельно"""
+        results = {name: {"service_enabled": False, "service_started": False} for name in service_names}
+        
+        # systemctl enable принимает несколько unit-ов сразу
+        for i in range(0, len(service_names), 100):
+            chunk = service_names[i:i + 100]
+            enable_result = HostSystemctlManager.run_on_host([SYSTEMCTL_PATH, 'enable'] + chunk, timeout=120)
+            for name in chunk:
+                results[name]["service_enabled"] = enable_result['success']
+        
+        def start(name):
+            return name, HostSystemctlManager.systemctl('start', name)
+        
+        with ThreadPoolExecutor(max_workers=concurrency or Config.BULK_CONCURRENCY) as pool:
+            for name, start_result in pool.map(start, service_names):
+                results[name]["service_started"] = start_result.get('success', False)
+                if not start_result.get('success'):
+                    results[name]["error"] = start_result.get('stderr') or start_result.get('error')
+        
+        return results
+    
+    def delete_user_service(self, username: str, reload: bool = True) -> Dict:
+        """Удаляет службу пользователя
+
+        reload=False пропускает daemon-reload — при пакетном удалении он делается один раз.
+        """
         try:
             service_name = f"shadowsocks-{username}.service"
             config_path = self.config_dir / f"config-{username}.json"
@@ -546,7 +517,8 @@ WantedBy=multi-user.target
                 logger.info(f"✓ Removed config file: {config_path}")
             
             # Перезагружаем systemd
-            HostSystemctlManager.systemctl('daemon-reload')
+            if reload:
+                self.daemon_reload()
             
             return {
                 "success": True,
@@ -559,32 +531,49 @@ WantedBy=multi-user.target
             logger.error(f"Error deleting user service: {e}")
             return {"success": False, "error": str(e)}
     
-    def update_admin_config(self, users: List[Dict]) -> Dict:
-        """Обновляет конфиг admin с портами всех пользователей"""
+    def update_admin_config(self, users: List[Dict], lease=None) -> Dict:
+        """Обновляет конфиг admin с портами всех пользователей
+
+        lease — аренда 'admin-config'; ее fencing-токен проверяется перед записью.
+        """
         try:
             admin_config_path = self.config_dir / "config.json"
             
             if not admin_config_path.exists():
                 config = self.admin_config.copy()
+                config["method"] = self.admin_method()
             else:
                 with open(admin_config_path, 'r') as f:
                     config = json.load(f)
             
-            # Собираем порты всех активных пользователей
+            # Собираем порты всех активных пользователей. Общий конфиг
+            # обслуживает все порты одним методом: пользователь с другим
+            # методом работает только через свою службу
             port_password = {}
+            skipped = []
             for user in users:
                 if user.get('enable', True):
                     port = user.get('port')
                     password = user.get('password')
                     if port and password:
+                        if user.get('method', Config.SS_METHOD) != config.get('method'):
+                            skipped.append(user.get('username'))
+                            continue
                         port_password[str(port)] = password
+            if skipped:
+                logger.warning(f"Users with a method other than {config.get('method')} are not in admin config: {', '.join(map(str, skipped))}")
             
             config["port_password"] = port_password
             
-            with open(admin_config_path, 'w') as f:
-                json.dump(config, f, indent=2)
+            if lease is not None:
+                lease.fence()
             
-            os.chmod(admin_config_path, 0o644)
+            # Пишем во временный файл и атомарно подменяем, чтобы ss-server не прочитал половину
+            tmp_path = admin_config_path.with_suffix('.json.tmp')
+            with open(tmp_path, 'w') as f:
+                json.dump(config, f, indent=2)
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, admin_config_path)
             
             logger.info(f"✓ Admin config updated with {len(port_password)} users")
             
@@ -592,6 +581,7 @@ WantedBy=multi-user.target
                 "success": True,
                 "port_count": len(port_password),
                 "ports": list(port_password.keys()),
+                "skipped_users": skipped,
                 "config_path": str(admin_config_path)
             }
             
@@ -614,89 +604,92 @@ WantedBy=multi-user.target
 
 class ShadowsocksConfigManager:
     def __init__(self):
-        try:
-            self.client = MongoClient(
-                Config.MONGO_URI,
-                serverSelectionTimeoutMS=5000
-            )
-            self.db = self.client[Config.MONGO_DB]
-            self.users_collection = self.db['users']
-            self.service_manager = ShadowsocksServiceManager()
-            logger.info("✓ Config manager initialized")
-        except Exception as e:
-            logger.error(f"✗ Config manager connection failed: {e}")
-            self.users_collection = None
-            self.service_manager = None
+        # Общий пул процесса вместо собственного клиента: база ленивая,
+        # конструктор не подключается к MongoDB
+        self.db = db
+        self.users_collection = self.db['users']
+        self.lease_manager = LeaseManager(self.db)
+        self.service_manager = ShadowsocksServiceManager(self.lease_manager)
+        logger.info("✓ Config manager initialized")
+    
+    def refresh_admin_config(self, reload_service=False) -> Dict:
+        """Пересобирает конфиг admin из активных пользователей под арендой 'admin-config'"""
+        with self.lease_manager.hold('admin-config') as lease:
+            users = list(self.users_collection.find({"enable": True}))
+            result = self.service_manager.update_admin_config(users, lease=lease)
+            if reload_service:
+                # Перезапускаем основной сервис для применения изменений
+                self.service_manager.manage_service(self.service_manager.admin_service, "reload")
+            return result
     
     def initialize_admin(self, admin_port=8388) -> Dict:
         """Инициализирует admin пользователя и службу"""
         try:
-            if self.users_collection is None:
-                return {"success": False, "error": "Database not connected"}
-            
-            # Проверяем, есть ли уже admin
-            existing_admin = self.users_collection.find_one({"username": "admin"})
-            
-            if existing_admin:
-                logger.info("✓ Admin user already exists")
+            # Создание admin и его конфига — под арендой, чтобы воркеры не делали это одновременно
+            with self.lease_manager.hold('admin-config'):
+                # Проверяем, есть ли уже admin
+                existing_admin = self.users_collection.find_one({"username": "admin"})
                 
-                # Проверяем, существует ли служба
-                status = self.service_manager.get_service_status(self.service_manager.admin_service)
-                if not status.get('exists'):
-                    logger.info("Admin service not found, creating...")
-                    # Создаем службу admin
-                    service_result = self.service_manager.setup_admin_service(
-                        admin_port=existing_admin.get('port', admin_port),
-                        admin_password=existing_admin.get('password')
-                    )
+                if existing_admin:
+                    logger.info("✓ Admin user already exists")
                     
-                    if service_result['success']:
-                        logger.info("✓ Admin service created")
+                    # Проверяем, существует ли служба
+                    status = self.service_manager.get_service_status(self.service_manager.admin_service)
+                    if not status.get('exists'):
+                        logger.info("Admin service not found, creating...")
+                        # Создаем службу admin
+                        service_result = self.service_manager.setup_admin_service(
+                            admin_port=existing_admin.get('port', admin_port),
+                            admin_password=existing_admin.get('password')
+                        )
+                        
+                        if service_result['success']:
+                            logger.info("✓ Admin service created")
+                    
+                    return {
+                        "success": True,
+                        "message": "Admin already exists",
+                        "admin_port": existing_admin.get('port'),
+                        "exists": True,
+                        "service_exists": status.get('exists', False)
+                    }
+                
+                # Создаем admin пользователя
+                admin_password = secrets.token_urlsafe(12)
+                
+                admin_user = {
+                    "username": "admin",
+                    "email": "admin@localhost",
+                    "port": admin_port,
+                    "password": admin_password,
+                    "method": self.service_manager.admin_method(),
+                    "enable": True,
+                    "traffic_limit": 100 * 1024**3,
+                    "traffic_used": 0,
+                    "expires_at": None,
+                    "created_at": datetime.utcnow(),
+                    "updated_at": datetime.utcnow(),
+                    "role": "admin"
+                }
+                
+                result = self.users_collection.insert_one(admin_user)
+                admin_id = str(result.inserted_id)
+                
+                # Настраиваем службу admin
+                service_result = self.service_manager.setup_admin_service(
+                    admin_port=admin_port,
+                    admin_password=admin_password
+                )
                 
                 return {
                     "success": True,
-                    "message": "Admin already exists",
-                    "admin_port": existing_admin.get('port'),
-                    "exists": True,
-                    "service_exists": status.get('exists', False)
+                    "admin_id": admin_id,
+                    "admin_port": admin_port,
+                    "admin_password": admin_password,
+                    "service_created": service_result.get('success', False),
+                    "service_name": self.service_manager.admin_service
                 }
-            
-            # Создаем admin пользователя
-            admin_password = secrets.token_urlsafe(12)
-            
-            admin_user = {
-                "username": "admin",
-                "email": "admin@localhost",
-                "port": admin_port,
-                "password": admin_password,
-                "method": Config.SS_METHOD,
-                "enable": True,
-                "traffic_limit": 100 * 1024**3,
-                "traffic_used": 0,
-                "expires_at": None,
-                "created_at": datetime.utcnow(),
-                "updated_at": datetime.utcnow(),
-                "role": "admin"
-            }
-            
-            result = self.users_collection.insert_one(admin_user)
-            admin_id = str(result.inserted_id)
-            
-            # Настраиваем службу admin
-            service_result = self.service_manager.setup_admin_service(
-                admin_port=admin_port,
-                admin_password=admin_password
-            )
-            
-            return {
-                "success": True,
-                "admin_id": admin_id,
-                "admin_port": admin_port,
-                "admin_password": admin_password,
-                "service_created": service_result.get('success', False),
-                "service_name": self.service_manager.admin_service
-            }
-            
+                
         except Exception as e:
             logger.error(f"Error initializing admin: {e}")
             import traceback
@@ -706,54 +699,60 @@ class ShadowsocksConfigManager:
     def add_user(self, username, email=None, traffic_limit_gb=10, duration_days=30, method=None):
         """Добавляет нового пользователя"""
         try:
-            if self.users_collection is None:
-                return {"success": False, "error": "Database not connected"}
-            
-            # Проверяем существование пользователя
-            existing_user = self.users_collection.find_one({"username": username})
-            if existing_user:
-                return {"success": False, "error": f"User '{username}' already exists"}
-            
-            # Генерируем порт
-            used_ports = [u.get('port') for u in self.users_collection.find({}, {'port': 1})]
-            port = Config.SS_PORT_RANGE_START
-            
-            while port <= Config.SS_PORT_RANGE_END:
-                if port not in used_ports:
-                    break
-                port += 1
-            
-            if port > Config.SS_PORT_RANGE_END:
-                return {"success": False, "error": "No available ports"}
-            
-            # Генерируем пароль
-            password = secrets.token_urlsafe(12)
-            
-            # Создаем пользователя
-            user = {
-                "username": username,
-                "email": email or "",
-                "port": port,
-                "password": password,
-                "method": method or Config.SS_METHOD,
-                "enable": True,
-                "traffic_limit": traffic_limit_gb * 1024**3,
-                "traffic_used": 0,
-                "expires_at": datetime.utcnow() + timedelta(days=duration_days),
-                "created_at": datetime.utcnow(),
-                "updated_at": datetime.utcnow(),
-                "role": "user"
-            }
-            
-            result = self.users_collection.insert_one(user)
-            user_id = str(result.inserted_id)
+            if not isinstance(username, str) or not USERNAME_PATTERN.fullmatch(username):
+                return {"success": False, "error": "Username may contain only letters, digits, '_', '.' and '-' (up to 64)"}
+            
+            if method and method not in AEAD_METHODS:
+                return {"success": False, "error": f"Invalid method. Must be one of: {', '.join(AEAD_METHODS)}"}
+            
+            # Проверка имени, выбор порта и вставка идут под арендой 'ports',
+            # иначе два воркера могут выдать один и тот же порт
+            with self.lease_manager.hold('ports'):
+                # Проверяем существование пользователя
+                existing_user = self.users_collection.find_one({"username": username})
+                if existing_user:
+                    return {"success": False, "error": f"User '{username}' already exists"}
+                
+                # Генерируем порт
+                used_ports = [u.get('port') for u in self.users_collection.find({}, {'port': 1})]
+                port = Config.SS_PORT_RANGE_START
+                
+                while port <= Config.SS_PORT_RANGE_END:
+                    if port not in used_ports:
+                        break
+                    port += 1
+                
+                if port > Config.SS_PORT_RANGE_END:
+                    return {"success": False, "error": "No available ports"}
+                
+                # Генерируем пароль
+                password = secrets.token_urlsafe(12)
+                
+                # Создаем пользователя
+                user = {
+                    "username": username,
+                    "email": email or "",
+                    "port": port,
+                    "password": password,
+                    "method": method or self.service_manager.admin_method(),
+                    "enable": True,
+                    "traffic_limit": traffic_limit_gb * 1024**3,
+                    "traffic_used": 0,
+                    "expires_at": datetime.utcnow() + timedelta(days=duration_days),
+                    "created_at": datetime.utcnow(),
+                    "updated_at": datetime.utcnow(),
+                    "role": "user"
+                }
+                
+                result = self.users_collection.insert_one(user)
+                user_id = str(result.inserted_id)
             
             # Создаем службу для пользователя
-            service_result = self.service_manager.create_user_service(user)
+            with self.lease_manager.hold(f"user:{user_id}"):
+                service_result = self.service_manager.create_user_service(user)
             
             # Обновляем основной конфиг admin
-            users = list(self.users_collection.find({"enable": True}))
-            self.service_manager.update_admin_config(users)
+            admin_result = self.refresh_admin_config()
             
             # Создаем конфигурационные строки
             config_string = f"{user['method']}:{password}@{Config.SS_SERVER_IP}:{port}"
@@ -771,7 +770,9 @@ class ShadowsocksConfigManager:
                 "ss_url": ss_url,
                 "expires_at": user['expires_at'].isoformat(),
                 "service_created": service_result.get('success', False),
-                "service_name": service_result.get('service_name', f"shadowsocks-{username}.service")
+                "service_name": service_result.get('service_name', f"shadowsocks-{username}.service"),
+                # Пользователи с методом, отличным от метода admin, в общий конфиг не попадают
+                "admin_config_skipped": admin_result.get('skipped_users', [])
             }
             
         except Exception as e:
@@ -783,64 +784,97 @@ class ShadowsocksConfigManager:
     def toggle_user_service(self, user_id, enable=True):
         """Включает/выключает службу пользователя"""
         try:
-            if self.users_collection is None:
-                return {"success": False, "error": "Database not connected"}
-            
             from bson import ObjectId
             
             logger.info(f"Toggle service for user_id: {user_id}, enable: {enable}")
             
-            user = self.users_collection.find_one({"_id": ObjectId(user_id)})
-            if not user:
-                return {"success": False, "error": "User not found"}
-            
-            username = user.get('username')
-            if username == 'admin':
-                service_name = self.service_manager.admin_service
-            else:
-                service_name = f"shadowsocks-{username}.service"
-            
-            if enable:
-                result = self.service_manager.manage_service(service_name, "start")
-                self.users_collection.update_one(
-                    {"_id": ObjectId(user_id)},
-                    {"$set": {"enable": True, "updated_at": datetime.utcnow()}}
-                )
-                action = "started"
-            else:
-                result = self.service_manager.manage_service(service_name, "stop")
-                self.users_collection.update_one(
-                    {"_id": ObjectId(user_id)},
-                    {"$set": {"enable": False, "updated_at": datetime.utcnow()}}
-                )
-                action = "stopped"
-            
-            if result.get('success'):
-                # Обновляем основной конфиг
-                users = list(self.users_collection.find({"enable": True}))
-                self.service_manager.update_admin_config(users)
+            with self.lease_manager.hold(f"user:{user_id}"):
+                user = self.users_collection.find_one({"_id": ObjectId(user_id)})
+                if not user:
+                    return {"success": False, "error": "User not found"}
                 
-                # Перезапускаем основной сервис для применения изменений
-                self.service_manager.manage_service(self.service_manager.admin_service, "reload")
+                username = user.get('username')
+                if username == 'admin':
+                    service_name = self.service_manager.admin_service
+                else:
+                    service_name = f"shadowsocks-{username}.service"
                 
-                return {
-                    "success": True,
-                    "message": f"Service {action}",
-                    "username": username,
-                    "service": service_name
-                }
-            else:
-                return {
-                    "success": False,
-                    "error": result.get('error', f'Failed to {action} service')
-                }
+                if enable:
+                    result = self.service_manager.manage_service(service_name, "start")
+                    self.users_collection.update_one(
+                        {"_id": ObjectId(user_id)},
+                        {"$set": {"enable": True, "updated_at": datetime.utcnow()}}
+                    )
+                    action = "started"
+                else:
+                    result = self.service_manager.manage_service(service_name, "stop")
+                    self.users_collection.update_one(
+                        {"_id": ObjectId(user_id)},
+                        {"$set": {"enable": False, "updated_at": datetime.utcnow()}}
+                    )
+                    action = "stopped"
                 
+                if result.get('success'):
+                    # Обновляем основной конфиг и перезагружаем основной сервис
+                    self.refresh_admin_config(reload_service=True)
+                    
+                    return {
+                        "success": True,
+                        "message": f"Service {action}",
+                        "username": username,
+                        "service": service_name
+                    }
+                else:
+                    return {
+                        "success": False,
+                        "error": result.get('error', f'Failed to {action} service')
+                    }
+                    
         except Exception as e:
             logger.error(f"Error toggling user service: {e}")
             import traceback
             traceback.print_exc()
             return {"success": False, "error": str(e)}
     
+    def expire_users(self, user_ids, now=None):
+        """Отключает пользователей, срок которых истек: останавливает службы и убирает порты из конфига admin.
+
+        Срок перепроверяется под арендой пользователя: продление, пришедшее
+        после постановки в очередь, отменяет отключение. Возвращает
+        отключенных пользователей.
+        """
+        from bson import ObjectId
+
+        now = now or datetime.utcnow()
+        expired = []
+        for user_id in user_ids:
+            try:
+                with self.lease_manager.hold(f"user:{user_id}"):
+                    user = self.users_collection.find_one({
+                        "_id": ObjectId(user_id),
+                        "enable": True,
+                        "expires_at": {"$lte": now},
+                        "username": {"$ne": "admin"},
+                    })
+                    if not user:
+                        continue
+                    service_name = f"shadowsocks-{user['username']}.service"
+                    result = self.service_manager.manage_service(service_name, "stop")
+                    if not result.get('success'):
+                        logger.error(f"Failed to stop expired service {service_name}: {result.get('error')}")
+                    self.users_collection.update_one(
+                        {"_id": user["_id"]},
+                        {"$set": {"enable": False, "notified_expired": True, "updated_at": datetime.utcnow()}}
+                    )
+                    expired.append(user)
+            except Exception as e:
+                logger.error(f"Error expiring user {user_id}: {e}")
+
+        if expired:
+            # Один раз на всех истекших одновременно
+            self.refresh_admin_config(reload_service=True)
+        return expired
+
     def get_all_services_status(self):
         """Получает статус всех служб"""
         try:
@@ -878,40 +912,37 @@ class ShadowsocksConfigManager:
     def delete_user(self, user_id):
         """Удаляет пользователя"""
         try:
-            if self.users_collection is None:
-                return {"success": False, "error": "Database not connected"}
-            
             from bson import ObjectId
             
-            user = self.users_collection.find_one({"_id": ObjectId(user_id)})
-            if not user:
-                return {"success": False, "error": "User not found"}
-            
-            username = user.get('username')
-            
-            # Удаляем службу (кроме admin)
-            service_removed = False
-            if username and username != 'admin':
-                service_result = self.service_manager.delete_user_service(username)
-                service_removed = service_result.get('service_removed', False)
-            
-            # Удаляем из БД
-            result = self.users_collection.delete_one({"_id": ObjectId(user_id)})
-            
-            if result.deleted_count > 0:
-                # Обновляем основной конфиг
-                users = list(self.users_collection.find({"enable": True}))
-                self.service_manager.update_admin_config(users)
+            with self.lease_manager.hold(f"user:{user_id}"):
+                user = self.users_collection.find_one({"_id": ObjectId(user_id)})
+                if not user:
+                    return {"success": False, "error": "User not found"}
                 
-                return {
-                    "success": True,
-                    "message": f"User {username} deleted",
-                    "username": username,
-                    "service_removed": service_removed
-                }
-            else:
-                return {"success": False, "error": "User not found"}
+                username = user.get('username')
                 
+                # Удаляем службу (кроме admin)
+                service_removed = False
+                if username and username != 'admin':
+                    service_result = self.service_manager.delete_user_service(username)
+                    service_removed = service_result.get('service_removed', False)
+                
+                # Удаляем из БД
+                result = self.users_collection.delete_one({"_id": ObjectId(user_id)})
+                
+                if result.deleted_count > 0:
+                    # Обновляем основной конфиг
+                    self.refresh_admin_config()
+                    
+                    return {
+                        "success": True,
+                        "message": f"User {username} deleted",
+                        "username": username,
+                        "service_removed": service_removed
+                    }
+                else:
+                    return {"success": False, "error": "User not found"}
+                    
         except Exception as e:
             logger.error(f"Error deleting user: {e}")
             return {"success": False, "error": str(e)}
@@ -919,15 +950,14 @@ class ShadowsocksConfigManager:
     def reset_user_traffic(self, user_id):
         """Сбрасывает трафик пользователя"""
         try:
-            if self.users_collection is None:
-                return {"success": False, "error": "Database not connected"}
-            
             from bson import ObjectId
             
-            result = self.users_collection.update_one(
-                {"_id": ObjectId(user_id)},
-                {"$set": {"traffic_used": 0, "updated_at": datetime.utcnow()}}
-            )
+            with self.lease_manager.hold(f"user:{user_id}"):
+                result = self.users_collection.update_one(
+                    {"_id": ObjectId(user_id)},
+                    # Новый расчетный период: пороги предупреждений срабатывают заново
+                    {"$set": {"traffic_used": 0, "traffic_alert_level": 0, "updated_at": datetime.utcnow()}, "$inc": {"traffic_period": 1}}
+                )
             
             if result.modified_count > 0:
                 return {"success": True, "message": "Traffic reset"}
@@ -941,33 +971,31 @@ class ShadowsocksConfigManager:
     def extend_user_expiration(self, user_id, additional_days):
         """Продлевает срок пользователя"""
         try:
-            if self.users_collection is None:
-                return {"success": False, "error": "Database not connected"}
-            
             from bson import ObjectId
             
-            user = self.users_collection.find_one({"_id": ObjectId(user_id)})
-            if not user:
-                return {"success": False, "error": "User not found"}
-            
-            current_expires = user.get('expires_at')
-            if current_expires:
-                if isinstance(current_expires, str):
-                    current_expires = datetime.fromisoformat(current_expires.replace('Z', '+00:00'))
-                new_expires = current_expires + timedelta(days=additional_days)
-            else:
-                new_expires = datetime.utcnow() + timedelta(days=additional_days)
-            
-            result = self.users_collection.update_one(
-                {"_id": ObjectId(user_id)},
-                {"$set": {"expires_at": new_expires, "updated_at": datetime.utcnow()}}
-            )
-            
-            if result.modified_count > 0:
-                return {"success": True, "message": "User extended"}
-            else:
-                return {"success": False, "error": "User not found"}
+            with self.lease_manager.hold(f"user:{user_id}"):
+                user = self.users_collection.find_one({"_id": ObjectId(user_id)})
+                if not user:
+                    return {"success": False, "error": "User not found"}
+                
+                current_expires = user.get('expires_at')
+                if current_expires:
+                    if isinstance(current_expires, str):
+                        current_expires = datetime.fromisoformat(current_expires.replace('Z', '+00:00'))
+                    new_expires = current_expires + timedelta(days=additional_days)
+                else:
+                    new_expires = datetime.utcnow() + timedelta(days=additional_days)
+                
+                result = self.users_collection.update_one(
+                    {"_id": ObjectId(user_id)},
+                    {"$set": {"expires_at": new_expires, "updated_at": datetime.utcnow()}}
+                )
                 
+                if result.modified_count > 0:
+                    return {"success": True, "message": "User extended"}
+                else:
+                    return {"success": False, "error": "User not found"}
+                    
         except Exception as e:
             logger.error(f"Error extending user: {e}")
             return {"success": False, "error": str(e)}
@@ -987,26 +1015,27 @@ class ShadowsocksConfigManager:
                     else:
                         service_name = f"shadowsocks-{username}.service"
                     
-                    # Проверяем существование службы
-                    status = self.service_manager.get_service_status(service_name)
-                    
-                    if not status.get('exists'):
-                        logger.info(f"Creating service for {username}...")
-                        service_result = self.service_manager.create_user_service(user)
+                    with self.lease_manager.hold(f"user:{user['_id']}"):
+                        # Проверяем существование службы
+                        status = self.service_manager.get_service_status(service_name)
                         
-                        if service_result['success']:
-                            created_count += 1
-                        else:
-                            errors.append(f"Failed to create service for {username}: {service_result.get('error')}")
+                        if not status.get('exists'):
+                            logger.info(f"Creating service for {username}...")
+                            service_result = self.service_manager.create_user_service(user)
+                            
+                            if service_result['success']:
+                                created_count += 1
+                            else:
+                                errors.append(f"Failed to create service for {username}: {service_result.get('error')}")
             
             # Обновляем основной конфиг
-            active_users = list(self.users_collection.find({"enable": True}))
-            self.service_manager.update_admin_config(active_users)
+            admin_result = self.refresh_admin_config()
             
             return {
                 "success": True,
                 "services_created": created_count,
                 "total_users": len(users),
+                "admin_config_skipped": admin_result.get('skipped_users', []),
                 "errors": errors if errors else None
             }
             
@@ -1039,6 +1068,303 @@ class ShadowsocksConfigManager:
             logger.error(f"Error restarting all services: {e}")
             return {"success": False, "error": str(e)}
 
+    
+    BULK_OPERATIONS = ['extend', 'reset_traffic', 'enable', 'disable', 'delete']
+    # Операции, которые меняют службы и конфиг admin
+    BULK_SERVICE_OPERATIONS = ['enable', 'disable', 'delete']
+    
+    def bulk_users(self, operation, user_ids=None, filters=None, additional_days=30):
+        """Пакетная операция над пользователями.
+
+        Генератор: сначала start с числом пользователей, затем результат по
+        каждому пользователю, как только записана его пачка, в конце — сводку.
+        Службы обрабатываются с ограниченным параллелизмом, изменения в БД
+        пишутся bulk_write пачками по BULK_WRITE_CHUNK. Конфиг admin
+        пересобирается один раз — и тогда, когда клиент закрыл поток раньше
+        времени.
+        """
+        from bson import ObjectId
+        
+        if operation not in self.BULK_OPERATIONS:
+            yield {"type": "error", "success": False, "error": f"Unknown operation: {operation}"}
+            return
+        
+        if user_ids is not None:
+            query = {"_id": {"$in": [ObjectId(user_id) for user_id in user_ids]}}
+        else:
+            query = build_user_filter(filters)
+        # admin не отключаем и не удаляем пакетно
+        if operation in ('disable', 'delete'):
+            query = {"$and": [query, {"username": {"$ne": "admin"}}]}
+        
+        users = list(self.users_collection.find(query, {"username": 1, "port": 1, "enable": 1, "expires_at": 1}))
+        succeeded = 0
+        changed = []
+        now = datetime.utcnow()
+        yield {"type": "start", "operation": operation, "total": len(users)}
+        
+        def commit(batch):
+            applied = [user for user, error in batch if error is None]
+            changed.extend(applied)
+            return self._bulk_write(operation, applied, now, additional_days)
+        
+        batches = self._bulk_batches(operation, users, commit)
+        try:
+            for batch, write_errors in batches:
+                for user, error in batch:
+                    user_id = str(user["_id"])
+                    error = error or write_errors.get(user_id)
+                    if error is None:
+                        succeeded += 1
+                    yield {
+                        "type": "item",
+                        "id": user_id,
+                        "username": user.get('username'),
+                        "success": error is None,
+                        "error": error
+                    }
+        finally:
+            # Дожидаемся уже начатых служб и пишем их в БД, даже если поток закрыт
+            batches.close()
+            if operation in self.BULK_SERVICE_OPERATIONS and changed:
+                # Один раз на всю пачку
+                self.refresh_admin_config(reload_service=operation != 'delete')
+        
+        yield {
+            "type": "summary",
+            "operation": operation,
+            "total": len(users),
+            "succeeded": succeeded,
+            "failed": len(users) - succeeded
+        }
+    
+    def _bulk_write(self, operation, users, now, additional_days):
+        """Пишет изменения пачки одним bulk_write; возвращает ошибки по id"""
+        write_errors = {}
+        if operation == 'extend':
+            days = int(additional_days)
+            requests, targets = [], []
+            for u in users:
+                expires_at = u.get('expires_at')
+                if isinstance(expires_at, str):
+                    # Старые записи хранят срок строкой ISO: $add по строке упал бы
+                    try:
+                        expires_at = datetime.fromisoformat(expires_at.replace('Z', '+00:00')).replace(tzinfo=None)
+                    except ValueError:
+                        write_errors[str(u["_id"])] = f"Invalid expires_at: {u['expires_at']!r}"
+                        continue
+                    update = {"$set": {"expires_at": expires_at + timedelta(days=days), "updated_at": now}}
+                else:
+                    update = [{"$set": {
+                        "expires_at": {"$add": [{"$ifNull": ["$expires_at", now]}, days * 24 * 3600 * 1000]},
+                        "updated_at": now,
+                    }}]
+                requests.append(UpdateOne({"_id": u["_id"]}, update))
+                targets.append(u)
+        elif operation == 'reset_traffic':
+            requests = [UpdateOne({"_id": u["_id"]}, {
+                "$set": {"traffic_used": 0, "traffic_alert_level": 0, "updated_at": now},
+                "$inc": {"traffic_period": 1},
+            }) for u in users]
+            targets = users
+        elif operation in ('enable', 'disable'):
+            requests = [UpdateOne({"_id": u["_id"]}, {"$set": {"enable": operation == 'enable', "updated_at": now}}) for u in users]
+            targets = users
+        else:
+            requests = [DeleteOne({"_id": u["_id"]}) for u in users]
+            targets = users
+        
+        if requests:
+            try:
+                self.users_collection.bulk_write(requests, ordered=False)
+            except Exception as e:
+                details = getattr(e, 'details', None) or {}
+                for err in details.get('writeErrors', []):
+                    write_errors[str(targets[err['index']]["_id"])] = err.get('errmsg', 'Write failed')
+                if not details:
+                    write_errors.update({str(u["_id"]): str(e) for u in targets})
+        return write_errors
+    
+    def _bulk_batches(self, operation, users, commit):
+        """Отдает пачки (пользователь, ошибка службы) по BULK_WRITE_CHUNK штук.
+
+        Пачка набирается по мере готовности служб и записывается в БД одним
+        bulk_write (commit) до того, как уйти дальше: на всю операцию —
+        len(users) / BULK_WRITE_CHUNK записей. При закрытии генератора не
+        начатые операции отменяются, а выполненные все равно записываются,
+        чтобы службы и БД не разошлись.
+        """
+        chunk = Config.BULK_WRITE_CHUNK
+        if operation not in self.BULK_SERVICE_OPERATIONS:
+            for start in range(0, len(users), chunk):
+                batch = [(user, None) for user in users[start:start + chunk]]
+                yield batch, commit(batch)
+            return
+        
+        def apply(user):
+            username = user.get('username')
+            service_name = self.service_manager.admin_service if username == 'admin' else f"shadowsocks-{username}.service"
+            with self.lease_manager.hold(f"user:{user['_id']}"):
+                if operation == 'enable':
+                    return self.service_manager.manage_service(service_name, "start")
+                if operation == 'disable':
+                    return self.service_manager.manage_service(service_name, "stop")
+                return self.service_manager.delete_user_service(username, reload=False)
+        
+        def error_of(future):
+            try:
+                result = future.result()
+            except Exception as e:
+                result = {"success": False, "error": str(e)}
+            return None if result.get('success') else result.get('error') or f"Failed to {operation} service"
+        
+        pool = ThreadPoolExecutor(max_workers=Config.BULK_CONCURRENCY)
+        pending = {pool.submit(apply, user): user for user in users}
+        ready = []
+        try:
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                ready.extend((pending.pop(future), error_of(future)) for future in done)
+                if len(ready) >= chunk or not pending:
+                    batch, ready = ready, []
+                    yield batch, commit(batch)
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+            leftover = ready + [(user, error_of(future)) for future, user in pending.items() if not future.cancelled()]
+            if leftover:
+                commit(leftover)
+            if operation == 'delete' and users:
+                self.service_manager.daemon_reload()
+
+    
+    def import_users(self, records: List[Dict]) -> Dict:
+        """Массовое создание пользователей.
+
+        Порты выделяются за один проход, пользователи вставляются одним insert_many,
+        затем пишутся все конфиги и unit-файлы, один daemon-reload и запуск служб
+        с ограниченным параллелизмом. Конфиг admin пересобирается один раз.
+        """
+        from pymongo.errors import BulkWriteError
+        
+        errors = []
+        now = datetime.utcnow()
+        
+        with self.lease_manager.hold('ports'):
+            names = [r['username'].strip() for r in records if isinstance(r, dict) and isinstance(r.get('username'), str)]
+            existing = {u['username'] for u in self.users_collection.find({"username": {"$in": names}}, {"username": 1})}
+            used_ports = {u.get('port') for u in self.users_collection.find({}, {'port': 1})}
+            free_ports = (p for p in range(Config.SS_PORT_RANGE_START, Config.SS_PORT_RANGE_END + 1) if p not in used_ports)
+            
+            default_method = self.service_manager.admin_method()
+            users = []
+            seen = set()
+            for row, record in enumerate(records, start=1):
+                if not isinstance(record, dict):
+                    errors.append({"row": row, "error": "Row must be an object"})
+                    continue
+                username = record.get('username') or ''
+                if not isinstance(username, str):
+                    errors.append({"row": row, "error": "Username must be a string"})
+                    continue
+                username = username.strip()
+                if not username:
+                    errors.append({"row": row, "error": "Username is required"})
+                    continue
+                invalid = [field for field in ('email', 'method', 'password') if not isinstance(record.get(field) or '', str)]
+                if invalid:
+                    errors.append({"row": row, "username": username, "error": f"Invalid {', '.join(invalid)}: must be a string"})
+                    continue
+                if not USERNAME_PATTERN.fullmatch(username):
+                    errors.append({"row": row, "username": username, "error": "Username may contain only letters, digits, '_', '.' and '-' (up to 64)"})
+                    continue
+                if record.get('method') and record['method'] not in AEAD_METHODS:
+                    errors.append({"row": row, "username": username, "error": f"Invalid method. Must be one of: {', '.join(AEAD_METHODS)}"})
+                    continue
+                if username in existing or username in seen:
+                    errors.append({"row": row, "username": username, "error": f"User '{username}' already exists"})
+                    continue
+                try:
+                    traffic_limit_gb = float(record.get('traffic_limit_gb') or 10)
+                    duration_days = int(record.get('duration_days') or 30)
+                except (TypeError, ValueError):
+                    errors.append({"row": row, "username": username, "error": "Invalid traffic_limit_gb or duration_days"})
+                    continue
+                port = next(free_ports, None)
+                if port is None:
+                    errors.append({"row": row, "username": username, "error": "No available ports"})
+                    continue
+                seen.add(username)
+                
+                users.append({
+                    "username": username,
+                    "email": record.get('email') or "",
+                    "port": port,
+                    "password": record.get('password') or secrets.token_urlsafe(12),
+                    "method": record.get('method') or default_method,
+                    "enable": True,
+                    "traffic_limit": int(traffic_limit_gb * 1024**3),
+                    "traffic_used": 0,
+                    "expires_at": now + timedelta(days=duration_days),
+                    "created_at": now,
+                    "updated_at": now,
+                    "role": "user"
+                })
+            
+            if users:
+                try:
+                    self.users_collection.insert_many(users, ordered=False)
+                except BulkWriteError as e:
+                    failed = {err['index']: err.get('errmsg', 'Insert failed') for err in e.details.get('writeErrors', [])}
+                    for index, message in failed.items():
+                        errors.append({"username": users[index]['username'], "error": message})
+                    users = [u for i, u in enumerate(users) if i not in failed]
+        
+        # Файлы конфигов и unit-ов
+        service_names = []
+        for user in users:
+            try:
+                service_names.append(self.service_manager.write_user_service_files(user))
+            except Exception as e:
+                errors.append({"username": user['username'], "error": f"Service files: {e}"})
+        
+        service_results = {}
+        if service_names:
+            self.service_manager.daemon_reload()
+            service_results = self.service_manager.enable_and_start_services(service_names)
+        
+        admin_skipped = []
+        if users:
+            admin_skipped = self.refresh_admin_config().get('skipped_users', [])
+        
+        created = []
+        for user in users:
+            service_name = f"shadowsocks-{user['username']}.service"
+            config = get_user_config_string(user)
+            created.append({
+                "id": str(user['_id']),
+                "username": user['username'],
+                "email": user['email'],
+                "port": user['port'],
+                "password": user['password'],
+                "method": user['method'],
+                "expires_at": user['expires_at'].isoformat(),
+                "duration_days": (user['expires_at'] - user['created_at']).days,
+                "ss_url": config.get('ss_url'),
+                "service_name": service_name,
+                **service_results.get(service_name, {"service_enabled": False, "service_started": False})
+            })
+        
+        logger.info(f"✓ Imported {len(created)} users, {len(errors)} errors")
+        
+        return {
+            "success": True,
+            "created": created,
+            "created_count": len(created),
+            "admin_config_skipped": admin_skipped,
+            "errors": errors,
+            "error_count": len(errors)
+        }
+
 
 # Утилитарные функции
 def get_user_config_string(user):
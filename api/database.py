@@ -0,0 +1,172 @@
+import logging
+import os
+import threading
+import time
+
+from pymongo import MongoClient
+from pymongo.database import Database
+from pymongo.monitoring import TopologyListener
+
+from api.config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class _AvailabilityListener(TopologyListener):
+    """Следит за доступностью primary по событиям топологии, без своих запросов"""
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def opened(self, event):
+        self.connection._set_state('connecting')
+
+    def description_changed(self, event):
+        description = event.new_description
+        if description.has_writable_server():
+            self.connection._set_state('connected')
+        elif any(server.error for server in description.server_descriptions().values()):
+            self.connection._set_state('unavailable')
+
+    def closed(self, event):
+        pass
+
+
+class MongoConnection:
+    """Один пул соединений MongoDB на процесс.
+
+    Клиент создается при первом обращении и заново после fork: клиент,
+    открытый до fork в gunicorn, в воркере использовать нельзя. Подключение
+    тоже ленивое (connect=False), поэтому импорт не ждет MongoDB, а состояние
+    (idle, connecting, connected, unavailable) видно без запросов к серверу.
+    """
+
+    def __init__(self, uri=None, db_name=None):
+        self.uri = uri or Config.MONGO_URI
+        self.db_name = db_name or Config.MONGO_DB
+        self.state = 'idle'
+        self.last_error = None
+        self._client = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _set_state(self, state):
+        if state != self.state:
+            if state == 'connected':
+                logger.info("✓ Connected to MongoDB")
+            elif state == 'unavailable':
+                logger.error("✗ MongoDB is unavailable")
+            self.state = state
+
+    def client(self):
+        if self._client is not None and self._pid == os.getpid():
+            return self._client
+        with self._lock:
+            if self._client is None or self._pid != os.getpid():
+                # Клиент родителя не закрываем: его сокеты принадлежат родителю
+                self.state = 'idle'
+                self._client = MongoClient(
+                    self.uri,
+                    connect=False,
+                    maxPoolSize=Config.MONGO_MAX_POOL_SIZE,
+                    minPoolSize=Config.MONGO_MIN_POOL_SIZE,
+                    maxIdleTimeMS=Config.MONGO_MAX_IDLE_TIME_MS,
+                    serverSelectionTimeoutMS=Config.MONGO_SERVER_SELECTION_TIMEOUT_MS,
+                    connectTimeoutMS=Config.MONGO_CONNECT_TIMEOUT_MS,
+                    waitQueueTimeoutMS=Config.MONGO_WAIT_QUEUE_TIMEOUT_MS,
+                    event_listeners=[_AvailabilityListener(self)],
+                )
+                self._pid = os.getpid()
+            return self._client
+
+    def database(self):
+        return self.client()[self.db_name]
+
+    @property
+    def available(self):
+        """Есть доступный primary по последним сведениям клиента (без запросов)"""
+        return self.state == 'connected'
+
+    def ping(self):
+        """Явная проверка соединения; возвращает задержку в мс или бросает исключение"""
+        started = time.monotonic()
+        try:
+            self.client().admin.command('ping')
+        except Exception as e:
+            self.last_error = str(e)
+            raise
+        self.last_error = None
+        self._set_state('connected')
+        return round((time.monotonic() - started) * 1000, 1)
+
+    def wait_available(self, retry_interval=5):
+        """Блокирует до первого успешного ping; для фонового старта процесса"""
+        while True:
+            try:
+                return self.ping()
+            except Exception as e:
+                logger.warning(f"Waiting for MongoDB: {e}")
+                time.sleep(retry_interval)
+
+    def close(self):
+        with self._lock:
+            if self._client is not None and self._pid == os.getpid():
+                self._client.close()
+            self._client = None
+            self.state = 'idle'
+
+
+class LazyCollection:
+    """Коллекция, которая берется из клиента текущего процесса при каждом обращении.
+
+    Ссылку можно хранить в атрибутах (users_collection, LeaseManager.leases)
+    и пережить fork: после него запросы пойдут через новый пул.
+    """
+
+    def __init__(self, connection, name):
+        self._connection = connection
+        self._name = name
+        self._collection = None
+        self._client = None
+
+    def _resolve(self):
+        client = self._connection.client()
+        if self._client is not client:
+            self._collection = client[self._connection.db_name][self._name]
+            self._client = client
+        return self._collection
+
+    def __getattr__(self, name):
+        return getattr(self._resolve(), name)
+
+    def __getitem__(self, name):
+        return LazyCollection(self._connection, f'{self._name}.{name}')
+
+    def __repr__(self):
+        return f'LazyCollection({self._connection.db_name}.{self._name})'
+
+
+class LazyDatabase:
+    """База данных текущего процесса: db.users, db['users'], db.command(...)"""
+
+    def __init__(self, connection):
+        self._connection = connection
+        self._collections = {}
+
+    def __getattr__(self, name):
+        if name.startswith('_') or hasattr(Database, name):
+            return getattr(self._connection.database(), name)
+        return self[name]
+
+    def __getitem__(self, name):
+        collection = self._collections.get(name)
+        if collection is None:
+            collection = self._collections.setdefault(name, LazyCollection(self._connection, name))
+        return collection
+
+    def __repr__(self):
+        return f'LazyDatabase({self._connection.db_name})'
+
+
+mongo = MongoConnection()
+db = LazyDatabase(mongo)
@@ -2,12 +2,14 @@ import multiprocessing
 import os
 
 bind = "0.0.0.0:5000"
-workers = multiprocessing.cpu_count() * 2 + 1
-worker_class = "sync"
+workers = int(os.getenv('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+# gevent: долгие SSE потоки обслуживаются кооперативно и не занимают воркер целиком
+worker_class = "gevent"
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', 2000))
 timeout = 120
 keepalive = 5
-max_requests = 1000
-max_requests_jitter = 50
+# max_requests не задаем: перезапуск воркера рвет все его SSE потоки и
+# отдает лидерство планировщика на новые выборы
 accesslog = "/var/log/gunicorn-access.log"
 errorlog = "/var/log/gunicorn-error.log"
 loglevel = "info"
\ No newline at end of file
@@ -0,0 +1,226 @@
+import atexit
+import itertools
+import logging
+import os
+import subprocess
+import sys
+import threading
+from pathlib import Path
+
+from api.config import Config
+from api.host_helper import read_frame, write_frame
+
+logger = logging.getLogger(__name__)
+
+# Пути D-Bus сокетов внутри ФС хоста
+DBUS_SOCKET_PATHS = [
+    '/run/systemd/private',
+    '/run/dbus/system_bus_socket',
+    '/var/run/dbus/system_bus_socket',
+]
+
+SYSTEMCTL_PATH = '/usr/bin/systemctl'
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+
+
+class HostChannel:
+    """Постоянный канал команд на хост.
+
+    Один процесс-помощник (api/host_helper.py) запускается в окружении хоста,
+    дальше каждая команда — это кадр в его stdin и кадр ответа из stdout.
+    Возможности хоста (D-Bus, рабочий способ входа) определяются один раз.
+    """
+
+    def __init__(self, host_root=None, workers=None, timeout=None):
+        self.host_root = host_root or Config.HOST_ROOT
+        self.workers = workers or Config.HOST_CHANNEL_WORKERS
+        self.timeout = timeout or Config.HOST_COMMAND_TIMEOUT
+        self.capabilities = None
+        self._process = None
+        self._pending = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.workers)
+
+    def detect_capabilities(self):
+        """Определяет возможности хоста и способ выполнения команд (один раз).
+
+        Определение запускает помощника, поэтому идет под self._lock: два
+        одновременных первых вызова не запустят двух помощников.
+        """
+        if self.capabilities is not None:
+            return self.capabilities
+        with self._lock:
+            return self._detect_capabilities()
+
+    def _detect_capabilities(self):
+        # Вызывается под self._lock
+        if self.capabilities is not None:
+            return self.capabilities
+
+        caps = {
+            'host_mounted': os.path.isdir(self.host_root),
+            'systemctl': os.path.exists(self.host_root + SYSTEMCTL_PATH),
+            'dbus_socket': None,
+            'exec_method': None,
+        }
+        for socket_path in DBUS_SOCKET_PATHS:
+            if os.path.exists(self.host_root + socket_path):
+                caps['dbus_socket'] = socket_path
+                logger.info(f"D-Bus socket found at: {socket_path}")
+                break
+        if caps['dbus_socket'] is None:
+            logger.warning("No D-Bus sockets found on host")
+
+        if caps['host_mounted']:
+            for method in ('chroot', 'nsenter'):
+                if not self._start_helper(method, caps['dbus_socket']):
+                    continue
+                probe = self._request(self._process, [SYSTEMCTL_PATH, 'show', '--property=Version'], 10)
+                if probe['returncode'] == 0 or 'Failed to connect to bus' not in probe['stderr']:
+                    caps['exec_method'] = method
+                    break
+                logger.info(f"systemctl via {method} cannot reach the bus, trying next method")
+                self._stop_helper()
+            else:
+                # Ни один способ не достучался до systemd — оставляем chroot, если он вообще запускается
+                if self._start_helper('chroot', caps['dbus_socket']):
+                    caps['exec_method'] = 'chroot'
+        else:
+            logger.error(f"{self.host_root} directory not mounted")
+
+        logger.info(f"Host capabilities: {caps}")
+        self.capabilities = caps
+        return caps
+
+    def _start_helper(self, method, dbus_socket=None):
+        cmd = [
+            sys.executable, '-m', 'api.host_helper',
+            '--method', method,
+            '--host-root', self.host_root,
+            '--workers', str(self.workers),
+        ]
+        if dbus_socket and dbus_socket != '/run/systemd/private':
+            cmd += ['--dbus-address', f'unix:path={dbus_socket}']
+        try:
+            process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, cwd=str(PROJECT_ROOT))
+        except OSError as e:
+            logger.warning(f"Could not start host helper ({method}): {e}")
+            return False
+
+        ready = read_frame(process.stdout)
+        if not ready or not ready.get('ready'):
+            logger.warning(f"Host helper ({method}) failed: {(ready or {}).get('error', 'exited')}")
+            process.kill()
+            process.wait()
+            return False
+
+        self._process = process
+        threading.Thread(target=self._read_responses, args=(process,), daemon=True).start()
+        logger.info(f"Host helper started via {method} (pid {process.pid})")
+        return True
+
+    def _stop_helper(self):
+        process, self._process = self._process, None
+        if process is not None and process.poll() is None:
+            process.stdin.close()
+            try:
+                process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    def _read_responses(self, process):
+        while True:
+            try:
+                response = read_frame(process.stdout)
+            except Exception as e:
+                logger.error(f"Host helper protocol error: {e}")
+                response = None
+            if response is None:
+                break
+            slot = self._pending.pop(response.get('id'), None)
+            if slot is not None:
+                slot['response'] = response
+                slot['event'].set()
+
+        logger.warning("Host helper exited")
+        for request_id in [rid for rid, slot in list(self._pending.items()) if slot['process'] is process]:
+            slot = self._pending.pop(request_id, None)
+            if slot is not None:
+                slot['response'] = {'returncode': 1, 'stdout': '', 'stderr': '', 'error': 'Host helper exited'}
+                slot['event'].set()
+        with self._lock:
+            if self._process is process:
+                self._process = None
+
+    def _ensure_running(self):
+        with self._lock:
+            caps = self._detect_capabilities()
+            if self._process is None and caps['exec_method']:
+                self._start_helper(caps['exec_method'], caps['dbus_socket'])
+            return self._process
+
+    def _request(self, process, argv, timeout):
+        """Отправляет запрос процессу, который вернул _ensure_running.
+
+        self._process заново не читается: поток чтения мог уже обнулить его.
+        """
+        if process is None or process.poll() is not None:
+            return {'returncode': 1, 'stdout': '', 'stderr': '', 'error': 'Host helper unavailable'}
+        request_id = next(self._ids)
+        slot = {'event': threading.Event(), 'response': None, 'process': process}
+        self._pending[request_id] = slot
+        try:
+            with self._write_lock:
+                write_frame(process.stdin, {'id': request_id, 'argv': argv, 'timeout': timeout})
+        except (OSError, ValueError) as e:
+            self._pending.pop(request_id, None)
+            return {'returncode': 1, 'stdout': '', 'stderr': '', 'error': f'Host helper unavailable: {e}'}
+
+        if not slot['event'].wait(timeout + 5):
+            self._pending.pop(request_id, None)
+            return {'returncode': 124, 'stdout': '', 'stderr': '', 'error': 'Command timed out'}
+        return slot['response']
+
+    def run(self, argv, timeout=None):
+        """Выполняет команду на хосте и возвращает returncode/stdout/stderr"""
+        timeout = timeout or self.timeout
+        if not self._slots.acquire(timeout=timeout):
+            return {'returncode': 124, 'stdout': '', 'stderr': '', 'error': 'Host channel is busy'}
+        try:
+            process = self._ensure_running()
+            if process is None:
+                return {'returncode': 1, 'stdout': '', 'stderr': '', 'error': 'Host channel is not available'}
+            return self._request(process, list(argv), timeout)
+        finally:
+            self._slots.release()
+
+    def is_available(self):
+        return self._process is not None and self._process.poll() is None
+
+    def close(self):
+        with self._lock:
+            self._stop_helper()
+
+
+_channel = None
+_channel_pid = None
+_channel_lock = threading.Lock()
+
+
+def get_host_channel():
+    """Канал текущего процесса; после fork (gunicorn) создается заново"""
+    global _channel, _channel_pid
+    with _channel_lock:
+        if _channel is None or _channel_pid != os.getpid():
+            _channel = HostChannel()
+            _channel_pid = os.getpid()
+        return _channel
+
+
+@atexit.register
+def _close_channel():
+    if _channel is not None and _channel_pid == os.getpid():
+        _channel.close()
@@ -0,0 +1,132 @@
+"""Долгоживущий помощник для выполнения команд на хосте.
+
+Запускается один раз, входит в окружение хоста (chroot в /host или setns в
+пространства имен PID 1) и дальше выполняет команды, приходящие по stdin.
+Кадры протокола: 4 байта длины (big-endian) + JSON.
+
+Запрос:  {"id": 1, "argv": ["systemctl", "status", "x"], "timeout": 30}
+Ответ:   {"id": 1, "returncode": 0, "stdout": "...", "stderr": "..."}
+
+Модуль использует только стандартную библиотеку: после chroot код проекта
+уже недоступен.
+"""
+import argparse
+import ctypes
+import json
+import os
+import struct
+import subprocess
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+HEADER = struct.Struct('>I')
+
+# mnt последним: после него пути /proc/1/ns уже разрешаются в ФС хоста
+NAMESPACES = ['ipc', 'uts', 'net', 'mnt']
+
+
+def write_frame(stream, message):
+    data = json.dumps(message).encode('utf-8')
+    stream.write(HEADER.pack(len(data)) + data)
+    stream.flush()
+
+
+def read_frame(stream):
+    header = stream.read(HEADER.size)
+    if len(header) < HEADER.size:
+        return None
+    (length,) = HEADER.unpack(header)
+    data = stream.read(length)
+    if len(data) < length:
+        return None
+    return json.loads(data.decode('utf-8'))
+
+
+def enter_host(method, host_root):
+    """Переходит в окружение хоста. Должно вызываться до запуска потоков"""
+    if method == 'chroot':
+        os.chroot(host_root)
+    elif method == 'nsenter':
+        libc = ctypes.CDLL(None, use_errno=True)
+        for ns in NAMESPACES:
+            fd = os.open(f'/proc/1/ns/{ns}', os.O_RDONLY)
+            try:
+                if libc.setns(fd, 0) != 0:
+                    errno = ctypes.get_errno()
+                    raise OSError(errno, f'setns({ns}) failed: {os.strerror(errno)}')
+            finally:
+                os.close(fd)
+    else:
+        raise ValueError(f'Unknown exec method: {method}')
+    os.chdir('/')
+
+
+def run_command(request, env):
+    try:
+        result = subprocess.run(
+            request['argv'],
+            capture_output=True,
+            timeout=request.get('timeout') or 30,
+            env=env,
+        )
+        return {
+            'id': request['id'],
+            'returncode': result.returncode,
+            'stdout': result.stdout.decode('utf-8', 'replace'),
+            'stderr': result.stderr.decode('utf-8', 'replace'),
+        }
+    except subprocess.TimeoutExpired:
+        return {'id': request['id'], 'returncode': 124, 'stdout': '', 'stderr': '', 'error': 'Command timed out'}
+    except FileNotFoundError as e:
+        return {'id': request['id'], 'returncode': 127, 'stdout': '', 'stderr': '', 'error': f'Command not found: {e}'}
+    except Exception as e:
+        return {'id': request['id'], 'returncode': 1, 'stdout': '', 'stderr': '', 'error': str(e)}
+
+
+def serve(stdin, stdout, workers, env):
+    write_lock = threading.Lock()
+
+    def handle(request):
+        response = run_command(request, env)
+        with write_lock:
+            write_frame(stdout, response)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while True:
+            request = read_frame(stdin)
+            if request is None:
+                break
+            pool.submit(handle, request)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Host command helper')
+    parser.add_argument('--method', choices=['chroot', 'nsenter'], required=True)
+    parser.add_argument('--host-root', default='/host')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--dbus-address', default='')
+    args = parser.parse_args()
+
+    stdin = sys.stdin.buffer
+    stdout = sys.stdout.buffer
+    # Все, что команды или сам процесс пишут в stdout мимо протокола, уходит в stderr
+    sys.stdout = sys.stderr
+
+    try:
+        enter_host(args.method, args.host_root)
+    except Exception as e:
+        write_frame(stdout, {'id': 0, 'ready': False, 'error': str(e)})
+        return 1
+
+    env = {'PATH': '/usr/local/sbin:/usr/local/bin:/usr/sbin:/usr/bin:/sbin:/bin', 'LANG': 'C.UTF-8'}
+    if args.dbus_address:
+        env['DBUS_SYSTEM_BUS_ADDRESS'] = args.dbus_address
+
+    write_frame(stdout, {'id': 0, 'ready': True, 'method': args.method})
+    serve(stdin, stdout, args.workers, env)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
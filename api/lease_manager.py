@@ -0,0 +1,203 @@
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from api.config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class LeaseError(Exception):
+    """Не удалось получить или удержать аренду ресурса"""
+
+
+# Порядок вложенных аренд (по префиксу ресурса до ':'): внутри аренды можно
+# брать только ресурс дальше по списку. Остальные ресурсы порядком не связаны
+LEASE_ORDER = ['ports', 'user', 'admin-config', 'daemon-reload']
+
+
+def _lease_rank(resource):
+    prefix = resource.split(':', 1)[0]
+    return LEASE_ORDER.index(prefix) if prefix in LEASE_ORDER else None
+
+
+class Lease:
+    """Удерживаемая аренда ресурса с fencing-токеном"""
+
+    def __init__(self, manager, resource, owner, token, ttl):
+        self.manager = manager
+        self.resource = resource
+        self.owner = owner
+        self.token = token
+        self.ttl = ttl
+        self.lost = False
+        self._stop = threading.Event()
+        self._heartbeat = None
+
+    def start_heartbeat(self):
+        self._heartbeat = threading.Thread(target=self._renew_loop, daemon=True)
+        self._heartbeat.start()
+
+    def _renew_loop(self):
+        while not self._stop.wait(self.ttl / 3):
+            try:
+                renewed = self.manager.renew(self)
+            except Exception as e:
+                logger.warning(f"Could not renew lease {self.resource}: {e}")
+                continue
+            if not renewed:
+                logger.error(f"Lease {self.resource} (token {self.token}) was lost")
+                self.lost = True
+                return
+
+    def fence(self):
+        """Проверяет, что токен не устарел, перед записью в общий ресурс"""
+        if self.lost:
+            raise LeaseError(f"Lease {self.resource} was lost")
+        self.manager.fence(self.resource, self.token)
+
+    def release(self):
+        self._stop.set()
+        self.manager.release(self)
+
+
+class LeaseManager:
+    """Аренды ресурсов в MongoDB с TTL и fencing-токенами.
+
+    Операции над одним ресурсом (пользователь, admin config, daemon-reload)
+    выполняются последовательно во всех воркерах и на всех узлах, над разными
+    ресурсами — параллельно.
+    """
+
+    def __init__(self, db, ttl=None, wait_timeout=None):
+        self.leases = db['leases']
+        self.tokens = db['lease_tokens']
+        self.fences = db['lease_fences']
+        self.ttl = ttl or Config.LEASE_TTL
+        self.wait_timeout = wait_timeout or Config.LEASE_WAIT_TIMEOUT
+        self.node = f"{socket.gethostname()}:{os.getpid()}"
+        self._indexes_ready = False
+        # Аренды, которые держит текущий поток через hold
+        self._local = threading.local()
+
+    def _ensure_indexes(self):
+        # Индекс создается при первой аренде, чтобы не ждать MongoDB при импорте
+        if self._indexes_ready:
+            return
+        try:
+            # Просроченные аренды удаляются самой MongoDB
+            self.leases.create_index('expires_at', expireAfterSeconds=0)
+            self._indexes_ready = True
+        except Exception as e:
+            logger.warning(f"Could not create lease TTL index: {e}")
+
+    def _next_token(self, resource):
+        doc = self.tokens.find_one_and_update(
+            {'_id': resource},
+            {'$inc': {'token': 1}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        return doc['token']
+
+    def try_acquire(self, resource, ttl=None):
+        """Одна попытка получить аренду; возвращает Lease или None"""
+        self._ensure_indexes()
+        ttl = ttl or self.ttl
+        owner = f"{self.node}:{uuid.uuid4().hex}"
+        token = self._next_token(resource)
+        now = datetime.utcnow()
+        try:
+            self.leases.find_one_and_update(
+                {'_id': resource, 'expires_at': {'$lte': now}},
+                {'$set': {
+                    'owner': owner,
+                    'token': token,
+                    'acquired_at': now,
+                    'expires_at': now + timedelta(seconds=ttl),
+                }},
+                upsert=True,
+            )
+        except DuplicateKeyError:
+            # Аренда существует и еще не истекла
+            return None
+        return Lease(self, resource, owner, token, ttl)
+
+    def acquire(self, resource, ttl=None, wait_timeout=None):
+        """Ждет аренду не дольше wait_timeout секунд"""
+        wait_timeout = self.wait_timeout if wait_timeout is None else wait_timeout
+        deadline = time.monotonic() + wait_timeout
+        delay = 0.05
+        while True:
+            lease = self.try_acquire(resource, ttl)
+            if lease is not None:
+                lease.start_heartbeat()
+                return lease
+            if time.monotonic() >= deadline:
+                raise LeaseError(f"Resource {resource} is busy, try again later")
+            time.sleep(delay)
+            delay = min(delay * 2, 1.0)
+
+    def renew(self, lease):
+        result = self.leases.update_one(
+            {'_id': lease.resource, 'owner': lease.owner},
+            {'$set': {'expires_at': datetime.utcnow() + timedelta(seconds=lease.ttl)}},
+        )
+        return result.matched_count > 0
+
+    def release(self, lease):
+        self.leases.delete_one({'_id': lease.resource, 'owner': lease.owner})
+
+    def fence(self, resource, token):
+        """Пропускает запись только с токеном не меньше последнего записавшего"""
+        try:
+            self.fences.update_one(
+                {'_id': resource, 'token': {'$lte': token}},
+                {'$set': {'token': token, 'updated_at': datetime.utcnow()}},
+                upsert=True,
+            )
+        except DuplicateKeyError:
+            raise LeaseError(f"Stale fencing token {token} for {resource}")
+
+    @contextmanager
+    def hold(self, resource, ttl=None, wait_timeout=None):
+        """Удерживает аренду ресурса на время блока with.
+
+        Аренда не реентерабельна: повторный hold того же ресурса в том же
+        потоке ждал бы сам себя до истечения TTL, поэтому сразу падает с
+        LeaseError. Вложенные аренды берутся в порядке LEASE_ORDER
+        (ports -> user:* -> admin-config -> daemon-reload), нарушение
+        порядка — тоже LeaseError.
+        """
+        held = self._held()
+        if resource in held:
+            raise LeaseError(f"Lease {resource} is already held by this thread")
+        rank = _lease_rank(resource)
+        if rank is not None:
+            for other in held:
+                other_rank = _lease_rank(other)
+                if other_rank is not None and other_rank >= rank:
+                    raise LeaseError(f"Lease order violation: {resource} requested while holding {other} (order: {' -> '.join(LEASE_ORDER)})")
+        lease = self.acquire(resource, ttl, wait_timeout)
+        held.append(resource)
+        try:
+            yield lease
+        finally:
+            held.remove(resource)
+            try:
+                lease.release()
+            except Exception as e:
+                logger.warning(f"Could not release lease {resource}: {e}")
+
+    def _held(self):
+        if not hasattr(self._local, 'resources'):
+            self._local.resources = []
+        return self._local.resources
@@ -0,0 +1,43 @@
+from flask import Blueprint, jsonify, request
+
+from api.common import manager
+from api.services.cipher_service import AEAD_METHODS, MAX_BENCHMARK_DURATION, get_benchmark, load_cached_benchmark, get_default_method
+
+ciphers_bp = Blueprint('ciphers', __name__)
+
+
+def _default_method():
+    # Новые пользователи получают метод общего конфига admin
+    if manager is not None and manager.service_manager is not None:
+        return manager.service_manager.admin_method()
+    return get_default_method()
+
+
+@ciphers_bp.route('/api/ciphers', methods=['GET'])
+def list_ciphers():
+    return jsonify({'success': True, 'methods': list(AEAD_METHODS), 'default_method': _default_method()})
+
+
+@ciphers_bp.route('/api/ciphers/benchmark', methods=['GET'])
+def cipher_benchmark():
+    benchmark = load_cached_benchmark()
+    if benchmark is None:
+        return jsonify({'success': False, 'message': 'Benchmark has not been run yet', 'default_method': _default_method()}), 404
+    return jsonify({'success': True, 'benchmark': benchmark, 'default_method': _default_method()})
+
+
+@ciphers_bp.route('/api/ciphers/benchmark', methods=['POST'])
+def run_cipher_benchmark():
+    duration = (request.get_json(silent=True) or {}).get('duration')
+    if duration is not None:
+        try:
+            duration = float(duration)
+        except (TypeError, ValueError):
+            return jsonify({'success': False, 'message': 'duration must be a number'}), 400
+        if not 0 < duration <= MAX_BENCHMARK_DURATION:
+            return jsonify({'success': False, 'message': f'duration must be between 0 and {MAX_BENCHMARK_DURATION} seconds'}), 400
+    try:
+        benchmark = get_benchmark(refresh=True, duration=duration)
+    except RuntimeError as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+    return jsonify({'success': True, 'benchmark': benchmark, 'default_method': _default_method()})
@@ -1,18 +1,21 @@
 import base64
+from datetime import datetime
 from io import BytesIO
-from flask import Blueprint, jsonify, send_file
+from flask import Blueprint, Response, jsonify, request, send_file, stream_with_context
 from bson import ObjectId
+from bson.errors import InvalidId
 
 from api.common import db
 from api.config import Config
+from api.services.export_service import EXPORT_FORMATS, stream_json, stream_ndjson, stream_zip
+from api.services.subscription_service import SUBSCRIPTION_FORMATS, get_subscription, issue_subscription_token, subscription_url
+from api.services.user_query import filters_from_args
 
 config_export_bp = Blueprint('config_export', __name__)
 
 
 @config_export_bp.route('/api/users/<user_id>/download', methods=['GET'])
 def download_config(user_id):
-    if db is None:
-        return jsonify({'success': False, 'message': 'Database not connected'}), 500
     user = db.users.find_one({'_id': ObjectId(user_id)})
     if not user:
         return jsonify({'success': False, 'message': 'User not found'}), 404
@@ -31,3 +34,59 @@ method={user['method']}
     buffer = BytesIO(content.encode('utf-8'))
     buffer.seek(0)
     return send_file(buffer, as_attachment=True, download_name=f"shadowsocks_{user.get('username', user_id)}.conf", mimetype='text/plain')
+
+
+@config_export_bp.route('/api/export/configs', methods=['GET'])
+def export_configs():
+    """Потоковая выгрузка конфигураций: ?format=ndjson|json|zip и фильтры build_user_filter"""
+    fmt = request.args.get('format', 'zip')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'success': False, 'message': f'Invalid format. Must be one of: {", ".join(EXPORT_FORMATS)}'}), 400
+    try:
+        filters = filters_from_args(request.args)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+
+    filename = f"shadowsocks-configs-{datetime.utcnow().strftime('%Y-%m-%d')}"
+    if fmt == 'ndjson':
+        body, mimetype, filename = stream_ndjson(filters), 'application/x-ndjson', filename + '.ndjson'
+    elif fmt == 'json':
+        body, mimetype, filename = stream_json(filters), 'application/json', filename + '.json'
+    else:
+        body, mimetype, filename = stream_zip(filters), 'application/zip', filename + '.zip'
+    return Response(stream_with_context(body), mimetype=mimetype, headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+
+@config_export_bp.route('/api/sub/<token>', methods=['GET'])
+def subscription(token):
+    """Подписка SIP008 (по умолчанию) или ?format=base64 со списком ss:// ссылок"""
+    fmt = request.args.get('format', 'sip008')
+    if fmt not in SUBSCRIPTION_FORMATS:
+        return jsonify({'success': False, 'message': f'Invalid format. Must be one of: {", ".join(SUBSCRIPTION_FORMATS)}'}), 400
+    entry = get_subscription(token)
+    if entry is None:
+        return jsonify({'success': False, 'message': 'Subscription not found'}), 404
+
+    etag = entry['etags'][fmt]
+    headers = {
+        'ETag': f'"{etag}"',
+        'Cache-Control': f'private, max-age={Config.SUBSCRIPTION_MAX_AGE}',
+    }
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers=headers)
+    mimetype = 'application/json' if fmt == 'sip008' else 'text/plain'
+    return Response(entry['bodies'][fmt], mimetype=mimetype, headers=headers)
+
+
+@config_export_bp.route('/api/users/<user_id>/subscription', methods=['POST'])
+def issue_subscription(user_id):
+    """Выдает токен подписки; {"rotate": true} заменяет старый"""
+    try:
+        ObjectId(user_id)
+    except InvalidId:
+        return jsonify({'success': False, 'message': 'Invalid user id'}), 400
+    rotate = bool((request.get_json(silent=True) or {}).get('rotate'))
+    token = issue_subscription_token(user_id, rotate=rotate)
+    if token is None:
+        return jsonify({'success': False, 'message': 'User not found'}), 404
+    return jsonify({'success': True, 'token': token, 'url': subscription_url(token, request.host_url)})
@@ -0,0 +1,13 @@
+from flask import Blueprint, jsonify
+
+from api.services.dashboard_service import build_dashboard, dashboard_version
+from api.services.versioning import conditional
+
+dashboard_bp = Blueprint('dashboard', __name__)
+
+
+@dashboard_bp.route('/api/dashboard', methods=['GET'])
+@conditional(dashboard_version)
+def dashboard():
+    """Начальные данные дашборда: статистика, пользователи, службы, история трафика и журнал"""
+    return jsonify({'success': True, **build_dashboard()})
@@ -0,0 +1,18 @@
+from flask import Blueprint, jsonify, request
+
+from api.services.scheduler import get_job_status, get_scheduler
+
+scheduler_bp = Blueprint('scheduler', __name__)
+
+
+@scheduler_bp.route('/api/scheduler/jobs', methods=['GET'])
+def scheduler_jobs():
+    """Периодические задачи: срок следующего запуска, последние прогоны и текущий лидер"""
+    try:
+        runs = int(request.args.get('runs', 10))
+    except ValueError:
+        runs = 0
+    if runs < 1:
+        return jsonify({'success': False, 'message': 'runs must be a positive integer'}), 400
+    runs = min(runs, 100)
+    return jsonify({'success': True, 'is_leader': get_scheduler().is_leader, **get_job_status(runs)})
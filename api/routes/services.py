@@ -1,56 +1,55 @@
+import re
 from flask import Blueprint, jsonify, request
 from bson import ObjectId
-import subprocess
 
-from api.common import manager, db
+from api.common import db, manager, requires_database
+from api.config_generator import HostSystemctlManager
+from api.services.service_state import ACTION_TARGETS, WAIT_STATES, get_unit_state, parse_wait_timeout, wait_for_state
+from api.services.stats_service import get_services_status, snapshot_version
+from api.services.versioning import conditional
 
 services_bp = Blueprint('services', __name__)
 
+SERVICE_NAME_RE = re.compile(r'^[A-Za-z0-9][A-Za-z0-9@._-]*\.service$')
+
 
 @services_bp.route('/api/admin/initialize', methods=['POST'])
+@requires_database
 def initialize_admin():
-    if manager is None:
-        return jsonify({'success': False, 'message': 'Manager not initialized'}), 500
     return jsonify(manager.initialize_admin())
 
 
 @services_bp.route('/api/services/status', methods=['GET'])
+@conditional(lambda: None if request.args.get('fresh') == 'true' else snapshot_version(['services']))
 def services_status():
-    if manager is None:
-        return jsonify({'success': False, 'message': 'Manager not initialized'}), 500
-    return jsonify(manager.get_all_services_status())
+    """Статус служб из фонового снимка; ?fresh=true — опросить systemd сейчас"""
+    return jsonify(get_services_status(fresh=request.args.get('fresh') == 'true'))
 
 
 @services_bp.route('/api/services/restart-all', methods=['POST'])
 def restart_all():
-    if manager is None:
-        return jsonify({'success': False, 'message': 'Manager not initialized'}), 500
     return jsonify(manager.restart_all_services())
 
 
 @services_bp.route('/api/services/reload-all', methods=['POST'])
 def reload_all():
-    if manager is None:
-        return jsonify({'success': False, 'message': 'Manager not initialized'}), 500
     services = manager.service_manager.list_all_services()
     results = []
     for service in services:
-        result = subprocess.run(['systemctl', 'reload', service], capture_output=True, text=True)
-        results.append({'service': service, 'success': result.returncode == 0, 'output': result.stdout.strip(), 'error': result.stderr.strip()})
+        result = HostSystemctlManager.systemctl('reload', service)
+        results.append({'service': service, 'success': result['success'], 'output': result.get('stdout', ''), 'error': result.get('stderr') or result.get('error', '')})
     return jsonify({'success': True, 'services_reloaded': len([r for r in results if r['success']]), 'total_services': len(services), 'results': results})
 
 
 @services_bp.route('/api/services/sync', methods=['POST'])
+@requires_database
 def sync_services():
-    if manager is None:
-        return jsonify({'success': False, 'message': 'Manager not initialized'}), 500
     return jsonify(manager.sync_services())
 
 
 @services_bp.route('/api/users/<user_id>/service/toggle', methods=['POST'])
+@requires_database
 def toggle_service(user_id):
-    if manager is None:
-        return jsonify({'success': False, 'message': 'Manager not initialized'}), 500
     enable = (request.json or {}).get('enable', True)
     result = manager.toggle_user_service(user_id, enable)
     # Всегда возвращаем 200, чтобы фронтенд мог показать сообщение об ошибке
@@ -58,9 +57,8 @@ def toggle_service(user_id):
 
 
 @services_bp.route('/api/users/<user_id>/service/restart', methods=['POST'])
+@requires_database
 def restart_user_service(user_id):
-    if manager is None or db is None:
-        return jsonify({'success': False, 'message': 'Manager not initialized'}), 500
     user = db.users.find_one({'_id': ObjectId(user_id)})
     if not user:
         return jsonify({'success': False, 'message': 'User not found'}), 404
@@ -72,10 +70,11 @@ def restart_user_service(user_id):
 
 @services_bp.route('/api/service/control', methods=['POST'])
 def control_service():
-    """Универсальный эндпоинт для управления службами (start, stop, restart, enable, disable, reload, status)"""
-    if manager is None:
-        return jsonify({'success': False, 'message': 'Manager not initialized'}), 500
-    
+    """Универсальный эндпоинт для управления службами (start, stop, restart, enable, disable, reload, status).
+
+    С "wait": true ответ приходит, когда служба достигла нужного состояния
+    (или истек "timeout"), и содержит его в поле state.
+    """
     data = request.json or {}
     service_name = data.get('service')
     action = data.get('action')
@@ -91,10 +90,46 @@ def control_service():
     if action not in valid_actions:
         return jsonify({'success': False, 'message': f'Invalid action. Must be one of: {", ".join(valid_actions)}'}), 400
     
+    wait = bool(data.get('wait')) and action in ACTION_TARGETS
+    if wait:
+        try:
+            timeout = parse_wait_timeout(data.get('timeout'))
+        except (TypeError, ValueError):
+            return jsonify({'success': False, 'message': 'Invalid timeout'}), 400
+    
     # Выполняем действие
     if action == 'status':
         result = manager.service_manager.get_service_status(service_name)
     else:
         result = manager.service_manager.manage_service(service_name, action)
     
+    if wait and result.get('success'):
+        state, reached = wait_for_state(service_name, ACTION_TARGETS[action], timeout)
+        result.update(state=state, reached=reached, success=reached)
+        if not reached:
+            current = state.get('active_state') or state.get('error')
+            result['message'] = f"Service {service_name} did not reach {'/'.join(sorted(ACTION_TARGETS[action]))} within {timeout:g}s (now {current})"
+    
     return jsonify(result)
+
+
+@services_bp.route('/api/service/<service_name>/state', methods=['GET'])
+def service_state(service_name):
+    """Состояние службы; ?wait_for=active|inactive|failed|enabled|disabled&timeout= — ждать его (long-poll)"""
+    if not SERVICE_NAME_RE.match(service_name):
+        return jsonify({'success': False, 'message': 'Invalid service name'}), 400
+    
+    wait_for = request.args.get('wait_for')
+    if not wait_for:
+        state = get_unit_state(service_name)
+        return jsonify({'success': state['success'], 'state': state}), (200 if state['success'] else 502)
+    
+    targets = set(wait_for.split(','))
+    if not targets <= WAIT_STATES:
+        return jsonify({'success': False, 'message': f'Invalid wait_for. Must be one of: {", ".join(sorted(WAIT_STATES))}'}), 400
+    try:
+        timeout = parse_wait_timeout(request.args.get('timeout'))
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Invalid timeout'}), 400
+    state, reached = wait_for_state(service_name, targets, timeout)
+    return jsonify({'success': state['success'], 'reached': reached, 'state': state}), (200 if state['success'] else 502)
@@ -1,74 +1,155 @@
-from datetime import datetime
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, Response, jsonify, request, stream_with_context
 from bson import ObjectId
+from bson.errors import InvalidId
 
-from api.common import db, manager
+from api.common import db, manager, requires_database
+from api.config_generator import USERNAME_PATTERN
 from api.config import Config
-from api.services.email_service import send_welcome_email
+from api.services.cipher_service import AEAD_METHODS
+from api.serialization import dumps
+from api.services.email_service import enqueue_email
+from api.services.import_service import import_users, detect_format
+from api.services.jobs import track_job
+from api.services.subscription_service import subscription_url
+from api.services.user_query import build_user_filter, filters_from_args, list_users_page
+from api.services.versioning import collection_version, conditional, time_bucket
 
 users_bp = Blueprint('users', __name__)
 
 
+def _users_version():
+    version = collection_version('users')
+    # days_remaining меняется со временем и без записи в БД
+    return None if version is None else f"{version}:{time_bucket(60)}"
+
+
 @users_bp.route('/api/users', methods=['GET'])
+@conditional(_users_version)
 def get_users():
-    if db is None:
-        return jsonify({'success': False, 'message': 'Database not connected'}), 500
-    users = list(db.users.find({}, {'password': 0}))
-    for user in users:
-        expires_at = user.get('expires_at')
-        if isinstance(expires_at, datetime):
-            user['days_remaining'] = max(0, (expires_at - datetime.utcnow()).days)
-            user['expires_at'] = expires_at.isoformat()
-        user['traffic_used_gb'] = round(user.get('traffic_used', 0) / 1024**3, 2)
-        user['traffic_limit_gb'] = round(user.get('traffic_limit', 0) / 1024**3, 2)
-        user['traffic_percent'] = round((user['traffic_used_gb'] / user['traffic_limit_gb']) * 100, 1) if user['traffic_limit_gb'] > 0 else 0
-        user['is_active'] = user.get('enable', True)
-        if user.get('username'):
-            user['service_name'] = f"shadowsocks-{user['username']}.service"
-        user['_id'] = str(user['_id'])
-    return jsonify({'success': True, 'users': users})
+    """Страница пользователей: ?limit=&cursor=&sort=&order=&fields=&count= и фильтры build_user_filter"""
+    fields = request.args.get('fields')
+    try:
+        page = list_users_page(
+            db,
+            filters=filters_from_args(request.args),
+            sort=request.args.get('sort', 'created'),
+            order=request.args.get('order', 'asc'),
+            limit=request.args.get('limit', type=int),
+            cursor=request.args.get('cursor'),
+            fields=[f.strip() for f in fields.split(',') if f.strip()] if fields else None,
+            with_total=request.args.get('count', 'false').lower() == 'true',
+        )
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    return jsonify({'success': True, **page})
 
 
 @users_bp.route('/api/users', methods=['POST'])
+@requires_database
 def add_user():
-    if manager is None:
-        return jsonify({'success': False, 'message': 'Manager not initialized'}), 500
     data = request.json or {}
     if not data.get('username'):
         return jsonify({'success': False, 'message': 'Username is required'}), 400
+    if not isinstance(data['username'], str) or not USERNAME_PATTERN.fullmatch(data['username']):
+        return jsonify({'success': False, 'message': "Username may contain only letters, digits, '_', '.' and '-' (up to 64)"}), 400
+    if data.get('method') and data['method'] not in AEAD_METHODS:
+        return jsonify({'success': False, 'message': f"Invalid method. Must be one of: {', '.join(AEAD_METHODS)}"}), 400
 
     result = manager.add_user(
         username=data.get('username'),
         email=data.get('email', ''),
         traffic_limit_gb=data.get('traffic_limit_gb', 10),
         duration_days=data.get('duration_days', 30),
-        method=data.get('method', Config.SS_METHOD),
+        method=data.get('method'),
     )
     if result.get('success') and data.get('email'):
-        send_welcome_email(data['email'], data['username'], Config.SS_SERVER_IP, result.get('port'), result.get('password'), result.get('method'), data.get('duration_days', 30))
+        enqueue_email(db, 'welcome', data['email'], username=data['username'], server=Config.SS_SERVER_IP, port=result.get('port'), password=result.get('password'), method=result.get('method'), expires_days=data.get('duration_days', 30))
+    return jsonify(result), (200 if result.get('success') else 500)
+
+
+@users_bp.route('/api/users/bulk', methods=['POST'])
+@requires_database
+def bulk_users():
+    """Пакетная операция: {"operation": "extend|reset_traffic|enable|disable|delete", "ids": [...] | "filter": {...}}"""
+    data = request.json or {}
+    operation = data.get('operation')
+    user_ids = data.get('ids')
+    filters = data.get('filter')
+
+    if operation not in manager.BULK_OPERATIONS:
+        return jsonify({'success': False, 'message': f'Invalid operation. Must be one of: {", ".join(manager.BULK_OPERATIONS)}'}), 400
+    if user_ids is None and not filters:
+        return jsonify({'success': False, 'message': 'Either ids or filter is required'}), 400
+    if user_ids is not None:
+        try:
+            [ObjectId(user_id) for user_id in user_ids]
+        except (InvalidId, TypeError):
+            return jsonify({'success': False, 'message': 'Invalid user id in ids'}), 400
+    else:
+        # Ошибка фильтра внутри потока оборвала бы уже начатый ответ 200
+        if not isinstance(filters, dict):
+            return jsonify({'success': False, 'message': 'filter must be an object'}), 400
+        try:
+            build_user_filter(filters)
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+    additional_days = data.get('additional_days', 30)
+    if operation == 'extend' and (isinstance(additional_days, bool) or not isinstance(additional_days, int) or additional_days <= 0):
+        return jsonify({'success': False, 'message': 'additional_days must be a positive integer'}), 400
+
+    items = track_job(f'bulk_{operation}', manager.bulk_users(operation, user_ids=user_ids, filters=filters, additional_days=additional_days))
+
+    def generate():
+        try:
+            for item in items:
+                yield dumps(item) + '\n'
+        finally:
+            items.close()
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+@users_bp.route('/api/users/import', methods=['POST'])
+@requires_database
+def import_users_route():
+    """Импорт пользователей из CSV или NDJSON (тело запроса или файл в поле file)"""
+    upload = request.files.get('file')
+    if upload is not None:
+        try:
+            text = upload.read().decode('utf-8-sig')
+        except UnicodeDecodeError:
+            return jsonify({'success': False, 'message': 'File must be UTF-8 encoded'}), 400
+        fmt = request.args.get('format') or detect_format(upload.mimetype, upload.filename)
+    else:
+        text = request.get_data(as_text=True)
+        fmt = request.args.get('format') or detect_format(request.content_type)
+    if fmt is None:
+        return jsonify({'success': False, 'message': 'Unknown format, use text/csv, application/x-ndjson or ?format='}), 400
+    send_emails = request.args.get('send_emails', 'true').lower() == 'true'
+    try:
+        result = import_users(text, fmt, send_emails=send_emails)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
     return jsonify(result), (200 if result.get('success') else 500)
 
 
 @users_bp.route('/api/users/<user_id>', methods=['DELETE'])
+@requires_database
 def delete_user(user_id):
-    if manager is None:
-        return jsonify({'success': False, 'message': 'Manager not initialized'}), 500
     result = manager.delete_user(user_id)
     return jsonify(result), (200 if result.get('success') else 404)
 
 
 @users_bp.route('/api/users/<user_id>/reset-traffic', methods=['POST'])
+@requires_database
 def reset_traffic(user_id):
-    if manager is None:
-        return jsonify({'success': False, 'message': 'Manager not initialized'}), 500
     result = manager.reset_user_traffic(user_id)
     return jsonify(result), (200 if result.get('success') else 404)
 
 
 @users_bp.route('/api/users/<user_id>/extend', methods=['POST'])
+@requires_database
 def extend_user(user_id):
-    if manager is None:
-        return jsonify({'success': False, 'message': 'Manager not initialized'}), 500
     additional_days = (request.json or {}).get('additional_days', 30)
     result = manager.extend_user_expiration(user_id, additional_days)
     return jsonify(result), (200 if result.get('success') else 404)
@@ -77,8 +158,6 @@ def extend_user(user_id):
 @users_bp.route('/api/users/<user_id>/config', methods=['GET'])
 def get_user_config(user_id):
     import base64
-    if db is None:
-        return jsonify({'success': False, 'message': 'Database not connected'}), 500
     user = db.users.find_one({'_id': ObjectId(user_id)})
     if not user:
         return jsonify({'success': False, 'message': 'User not found'}), 404
@@ -91,4 +170,5 @@ def get_user_config(user_id):
         'method': user['method'],
         'ss_url': f'ss://{encoded}',
         'ss_url_with_comment': f"ss://{encoded}#{user.get('username', 'user')}",
+        'subscription_url': subscription_url(user['subscription_token'], request.host_url) if user.get('subscription_token') else None,
     }})
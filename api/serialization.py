@@ -0,0 +1,143 @@
+"""Сериализация ответов API.
+
+Если установлен orjson, используется он (C-реализация), иначе стандартный
+json. ObjectId, datetime и Decimal обрабатываются в обоих вариантах
+одинаково: строка, ISO 8601 и число.
+"""
+import argparse
+import json
+import time
+from datetime import date, datetime
+from decimal import Decimal
+
+from bson import Decimal128, ObjectId
+from flask.json.provider import JSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Сколько элементов сериализуется за один кусок при потоковой выдаче
+STREAM_CHUNK_SIZE = 500
+
+
+def _default(obj):
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    if isinstance(obj, Decimal128):
+        return float(obj.to_decimal())
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+if orjson is not None:
+    # Даты orjson пишет сам, в том же формате, что и datetime.isoformat()
+    _ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+    def dumps_bytes(obj):
+        return orjson.dumps(obj, default=_default, option=_ORJSON_OPTIONS)
+
+    def loads(data):
+        return orjson.loads(data)
+else:
+    def dumps_bytes(obj):
+        return json.dumps(obj, default=_default, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+    def loads(data):
+        return json.loads(data)
+
+
+def dumps(obj):
+    return dumps_bytes(obj).decode('utf-8')
+
+
+def iter_json_array(items, chunk_size=STREAM_CHUNK_SIZE):
+    """JSON-массив по частям: в памяти не больше chunk_size элементов"""
+    yield b'['
+    first = True
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            yield (b'' if first else b',') + dumps_bytes(chunk)[1:-1]
+            first = False
+            chunk = []
+    if chunk:
+        yield (b'' if first else b',') + dumps_bytes(chunk)[1:-1]
+    yield b']'
+
+
+class MongoJSONProvider(JSONProvider):
+    """JSON-провайдер Flask: jsonify во всех маршрутах идет через dumps_bytes"""
+
+    def dumps(self, obj, **kwargs):
+        return dumps(obj)
+
+    def loads(self, s, **kwargs):
+        return loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps_bytes(obj), mimetype='application/json')
+
+
+def _sample_users(count):
+    now = datetime.utcnow()
+    return [{
+        '_id': ObjectId(),
+        'username': f'user{i}',
+        'email': f'user{i}@example.com',
+        'port': 8388 + i,
+        'method': 'aes-256-gcm',
+        'enable': i % 7 != 0,
+        'role': 'user',
+        'traffic_limit': 10 * 1024**3,
+        'traffic_used': i * 1024**2,
+        'expires_at': now,
+        'created_at': now,
+        'updated_at': now,
+        'days_remaining': 30,
+        'traffic_used_gb': round(i / 1024, 2),
+        'traffic_limit_gb': 10.0,
+        'traffic_percent': round(i / 102.4, 1),
+        'is_active': True,
+        'service_name': f'shadowsocks-user{i}.service',
+        'balance': Decimal('12.50'),
+    } for i in range(count)]
+
+
+def benchmark(count=10000, rounds=20):
+    """Сравнивает стандартный json и текущий сериализатор на ответе /api/users"""
+    payload = {'success': True, 'users': _sample_users(count), 'next_cursor': None}
+    results = {}
+
+    started = time.perf_counter()
+    for _ in range(rounds):
+        size = len(json.dumps(payload, default=_default).encode('utf-8'))
+    results['json'] = (time.perf_counter() - started) / rounds
+
+    started = time.perf_counter()
+    for _ in range(rounds):
+        size = len(dumps_bytes(payload))
+    results['orjson' if orjson is not None else 'json (fallback)'] = (time.perf_counter() - started) / rounds
+
+    return count, size, results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark API response serialization')
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--rounds', type=int, default=20)
+    args = parser.parse_args()
+
+    count, size, results = benchmark(args.users, args.rounds)
+    print(f"/api/users payload: {count} users, {size / 1024:.0f} KiB")
+    baseline = results['json']
+    for name, seconds in results.items():
+        print(f"  {name:16} {seconds * 1000:8.2f} ms  x{baseline / seconds:.1f}")
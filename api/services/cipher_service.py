@@ -0,0 +1,240 @@
+import argparse
+import json
+import logging
+import os
+import re
+import secrets
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+from api.config import Config
+
+logger = logging.getLogger(__name__)
+
+try:
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM, ChaCha20Poly1305
+except ImportError:
+    AESGCM = None
+    ChaCha20Poly1305 = None
+
+# AEAD-методы shadowsocks-libev: размер ключа и имя шифра в openssl
+AEAD_METHODS = {
+    'aes-128-gcm': {'key_size': 16, 'openssl': 'aes-128-gcm'},
+    'aes-192-gcm': {'key_size': 24, 'openssl': 'aes-192-gcm'},
+    'aes-256-gcm': {'key_size': 32, 'openssl': 'aes-256-gcm'},
+    'chacha20-ietf-poly1305': {'key_size': 32, 'openssl': 'chacha20-poly1305'},
+}
+
+# aes-192-gcm поддерживают не все клиенты, поэтому по умолчанию его не выбираем
+RECOMMENDABLE_METHODS = ['aes-128-gcm', 'aes-256-gcm', 'chacha20-ietf-poly1305']
+
+# Максимальный размер полезной нагрузки одного чанка в AEAD-протоколе shadowsocks
+CHUNK_SIZE = 0x3FFF
+
+# Верхняя граница длительности замера одного метода и направления (секунды):
+# прогон занимает 2 * len(AEAD_METHODS) таких отрезков
+MAX_BENCHMARK_DURATION = 3
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent.parent
+
+_cached_result = None
+
+
+def get_cpu_info():
+    """Возвращает модель CPU и наличие AES-NI"""
+    model = 'unknown'
+    flags = set()
+    try:
+        with open('/proc/cpuinfo', 'r') as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                key = key.strip()
+                if key == 'model name' and model == 'unknown':
+                    model = value.strip()
+                elif key in ('flags', 'Features') and not flags:
+                    flags = set(value.split())
+    except OSError:
+        pass
+    return {'model': model, 'aes_ni': 'aes' in flags, 'cpu_count': os.cpu_count()}
+
+
+def _benchmark_cryptography(method, duration):
+    key = secrets.token_bytes(AEAD_METHODS[method]['key_size'])
+    cipher = ChaCha20Poly1305(key) if method.startswith('chacha20') else AESGCM(key)
+    payload = secrets.token_bytes(CHUNK_SIZE)
+
+    processed = 0
+    counter = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < duration:
+        cipher.encrypt(counter.to_bytes(12, 'little'), payload, None)
+        counter += 1
+        processed += CHUNK_SIZE
+    encrypt_rate = processed / (time.perf_counter() - started)
+
+    nonce = bytes(12)
+    ciphertext = cipher.encrypt(nonce, payload, None)
+    processed = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < duration:
+        cipher.decrypt(nonce, ciphertext, None)
+        processed += CHUNK_SIZE
+    decrypt_rate = processed / (time.perf_counter() - started)
+
+    return encrypt_rate, decrypt_rate
+
+
+def _openssl_speed(cipher_name, duration, decrypt=False):
+    cmd = ['openssl', 'speed', '-evp', cipher_name, '-seconds', str(max(1, int(round(duration)))), '-bytes', str(CHUNK_SIZE)]
+    if decrypt:
+        cmd.insert(2, '-decrypt')
+    result = subprocess.run(cmd, capture_output=True, text=True, timeout=60)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip() or f'openssl speed failed for {cipher_name}')
+    # Последняя строка вида "AES-128-GCM    2973629.80k" (в 1000 байт/с)
+    match = re.search(r'([\d.]+)k\s*$', result.stdout.strip())
+    if not match:
+        raise RuntimeError(f'Unexpected openssl speed output for {cipher_name}')
+    return float(match.group(1)) * 1000
+
+
+def _benchmark_openssl(method, duration):
+    cipher_name = AEAD_METHODS[method]['openssl']
+    return _openssl_speed(cipher_name, duration), _openssl_speed(cipher_name, duration, decrypt=True)
+
+
+def get_backend():
+    """Определяет, чем измерять шифры: cryptography (OpenSSL в процессе) или openssl speed"""
+    return 'cryptography' if AESGCM is not None else 'openssl'
+
+
+def run_benchmark(duration=None):
+    """Измеряет скорость шифрования/расшифровки AEAD-методов и сохраняет результат в кэш"""
+    global _cached_result
+
+    duration = duration or Config.CIPHER_BENCHMARK_DURATION
+    backend = get_backend()
+    benchmark = _benchmark_cryptography if backend == 'cryptography' else _benchmark_openssl
+
+    methods = {}
+    for method in AEAD_METHODS:
+        try:
+            encrypt_rate, decrypt_rate = benchmark(method, duration)
+            methods[method] = {
+                'encrypt_mbps': round(encrypt_rate / 1024**2, 1),
+                'decrypt_mbps': round(decrypt_rate / 1024**2, 1),
+            }
+            logger.info(f"Cipher {method}: encrypt {methods[method]['encrypt_mbps']} MB/s, decrypt {methods[method]['decrypt_mbps']} MB/s")
+        except Exception as e:
+            logger.warning(f"Cipher benchmark failed for {method}: {e}")
+            methods[method] = {'error': str(e)}
+
+    result = {
+        'cpu': get_cpu_info(),
+        'backend': backend,
+        'chunk_size': CHUNK_SIZE,
+        'duration': duration,
+        'methods': methods,
+        'recommended_method': _pick_fastest(methods),
+        'measured_at': datetime.utcnow().isoformat(),
+    }
+
+    _save_cache(result)
+    _cached_result = result
+    return result
+
+
+def _pick_fastest(methods):
+    candidates = [
+        (min(stats['encrypt_mbps'], stats['decrypt_mbps']), method)
+        for method, stats in methods.items()
+        if method in RECOMMENDABLE_METHODS and 'error' not in stats
+    ]
+    return max(candidates)[1] if candidates else None
+
+
+def _save_cache(result):
+    try:
+        cache_path = Path(Config.CIPHER_BENCHMARK_CACHE)
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = cache_path.with_suffix(f'.{os.getpid()}.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(result, f, indent=2)
+        os.replace(tmp_path, cache_path)
+    except Exception as e:
+        logger.warning(f"Could not save cipher benchmark cache: {e}")
+
+
+def load_cached_benchmark():
+    """Возвращает сохраненный результат, если он снят на этом же CPU"""
+    global _cached_result
+
+    if _cached_result is not None:
+        return _cached_result
+
+    try:
+        with open(Config.CIPHER_BENCHMARK_CACHE, 'r') as f:
+            result = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    cpu = get_cpu_info()
+    cached_cpu = result.get('cpu', {})
+    if cached_cpu.get('model') != cpu['model'] or cached_cpu.get('aes_ni') != cpu['aes_ni']:
+        logger.info("Cipher benchmark cache was measured on a different CPU, ignoring it")
+        return None
+
+    _cached_result = result
+    return result
+
+
+def run_benchmark_process(duration=None):
+    """Запускает бенчмарк отдельным процессом, чтобы не занимать CPU воркера,
+    и дожидается результата (subprocess в gevent-воркере не блокирует
+    остальные запросы).
+    """
+    global _cached_result
+
+    cmd = [sys.executable, '-m', 'api.services.cipher_service']
+    if duration:
+        cmd += ['--duration', str(duration)]
+
+    completed = subprocess.run(cmd, cwd=str(PROJECT_ROOT), capture_output=True, text=True)
+    if completed.returncode != 0:
+        raise RuntimeError(f"Cipher benchmark failed: {completed.stderr.strip()[-500:]}")
+    _cached_result = json.loads(completed.stdout)
+    return _cached_result
+
+
+def get_benchmark(refresh=False, duration=None):
+    if not refresh:
+        cached = load_cached_benchmark()
+        if cached is not None:
+            return cached
+    return run_benchmark_process(duration)
+
+
+def get_default_method():
+    """Метод по умолчанию для новых пользователей"""
+    if Config.SS_METHOD_AUTO:
+        cached = load_cached_benchmark()
+        if cached and cached.get('recommended_method'):
+            return cached['recommended_method']
+    return Config.SS_METHOD
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark Shadowsocks AEAD ciphers on this CPU')
+    parser.add_argument('--duration', type=float, default=Config.CIPHER_BENCHMARK_DURATION, help='seconds per method and direction')
+    parser.add_argument('--cached', action='store_true', help='print the cached result instead of measuring')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    result = load_cached_benchmark() if args.cached else run_benchmark(args.duration)
+    if result is None:
+        print('No cached benchmark for this CPU')
+    else:
+        print(json.dumps(result, indent=2))
@@ -0,0 +1,54 @@
+from api.common import db, mongo, logger
+from api.services.notification_service import get_notification_history
+from api.services.stats_service import get_services_status, get_stats_snapshot, read_components, snapshot_version
+from api.services.traffic_service import get_history
+from api.services.user_query import list_users_page
+from api.services.versioning import collection_version, time_bucket
+
+# Первый экран: первая страница пользователей, история за неделю и 10 событий
+DASHBOARD_USERS_LIMIT = 500
+DASHBOARD_HISTORY_DAYS = 7
+DASHBOARD_ACTIVITY_LIMIT = 10
+
+
+def dashboard_version():
+    """Версия для ETag: снимок статистики, пользователи и журнал; None, если что-то не отслеживается"""
+    parts = [snapshot_version(), collection_version('users'), collection_version('logs')]
+    if any(part is None for part in parts):
+        return None
+    # days_remaining меняется со временем и без записи в БД
+    return '|'.join(parts + [time_bucket(60)])
+
+
+def build_dashboard(users_limit=DASHBOARD_USERS_LIMIT, history_days=DASHBOARD_HISTORY_DAYS, activity_limit=DASHBOARD_ACTIVITY_LIMIT):
+    """Все данные первого экрана за один запрос.
+
+    Снимок статистики читается один раз: из него же берутся статус служб
+    и итоги трафика, без повторного обхода служб systemd. Пользователи —
+    одна страница из того же конвейера, что и /api/users; остальные
+    страницы клиент дочитывает по next_cursor.
+    """
+    components = read_components()
+    dashboard = {
+        'stats': get_stats_snapshot(components),
+        'services': get_services_status(components=components),
+        'users': {'users': [], 'next_cursor': None},
+        'traffic_history': [],
+        'activity': [],
+    }
+    if mongo.state == 'unavailable':
+        # Каждая секция ждала бы выбора сервера отдельно
+        return dashboard
+
+    sections = {
+        'users': lambda: list_users_page(db, limit=users_limit),
+        'traffic_history': lambda: get_history(history_days),
+        'activity': lambda: get_notification_history(activity_limit),
+    }
+    for name, build in sections.items():
+        # Ошибка одной секции не должна ломать весь экран
+        try:
+            dashboard[name] = build()
+        except Exception as e:
+            logger.error(f"Error building dashboard section {name}: {e}")
+    return dashboard
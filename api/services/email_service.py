@@ -1,7 +1,10 @@
 import smtplib
+from datetime import datetime, timedelta
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 
+from pymongo import ReturnDocument
+
 from api.config import Config
 
 
@@ -55,3 +58,92 @@ def send_traffic_warning_email(email, username, usage_percent, traffic_used_gb,
 def send_expired_email(email, username):
     html = f"<p>User <b>{username}</b> is expired and disabled automatically.</p>"
     return _send_email(email, 'Shadowsocks user expired', html)
+
+
+# Очередь писем в MongoDB: отправка идет в фоне, а не внутри запроса
+EMAIL_TEMPLATES = {
+    'welcome': send_welcome_email,
+    'expiration': send_expiration_email,
+    'traffic_warning': send_traffic_warning_email,
+    'expired': send_expired_email,
+}
+
+
+def enqueue_email(db, template, email, **params):
+    if not email or template not in EMAIL_TEMPLATES:
+        return None
+    return db.email_queue.insert_one({
+        'template': template,
+        'email': email,
+        'params': params,
+        'status': 'pending',
+        'attempts': 0,
+        'created_at': datetime.utcnow(),
+    }).inserted_id
+
+
+def enqueue_emails(db, jobs):
+    """jobs: список (template, email, params)"""
+    now = datetime.utcnow()
+    docs = [{
+        'template': template,
+        'email': email,
+        'params': params,
+        'status': 'pending',
+        'attempts': 0,
+        'created_at': now,
+    } for template, email, params in jobs if email and template in EMAIL_TEMPLATES]
+    if docs:
+        db.email_queue.insert_many(docs)
+    return len(docs)
+
+
+def process_email_queue(db, limit=50, max_attempts=3):
+    """Отправляет до limit писем; каждое письмо забирает ровно один воркер.
+
+    Неудачная попытка откладывает письмо на EMAIL_RETRY_DELAY * 2^(попытка-1)
+    секунд (next_attempt_at), после max_attempts оно помечается failed.
+    """
+    sent = 0
+    for _ in range(limit):
+        now = datetime.utcnow()
+        # Письма, зависшие в 'sending' (воркер упал), забираем повторно
+        job = db.email_queue.find_one_and_update(
+            {'$or': [
+                {'status': 'pending', 'next_attempt_at': None},
+                {'status': 'pending', 'next_attempt_at': {'$lte': now}},
+                {'status': 'sending', 'locked_at': {'$lt': now - timedelta(minutes=10)}},
+            ]},
+            {'$set': {'status': 'sending', 'locked_at': now}, '$inc': {'attempts': 1}},
+            sort=[('created_at', 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+        if job is None:
+            break
+        try:
+            delivered = EMAIL_TEMPLATES[job['template']](job['email'], **job['params'])
+        except Exception as e:
+            if job['attempts'] >= max_attempts:
+                update = {'status': 'failed', 'error': str(e)}
+            else:
+                delay = Config.EMAIL_RETRY_DELAY * 2 ** (job['attempts'] - 1)
+                update = {'status': 'pending', 'error': str(e), 'next_attempt_at': datetime.utcnow() + timedelta(seconds=delay)}
+            db.email_queue.update_one({'_id': job['_id']}, {'$set': update})
+            continue
+        if not delivered:
+            # SMTP не настроен: повтор ничего не изменит
+            db.email_queue.update_one({'_id': job['_id']}, {'$set': {'status': 'failed', 'error': 'SMTP is not configured'}})
+            continue
+        db.email_queue.update_one({'_id': job['_id']}, {'$set': {'status': 'sent', 'sent_at': datetime.utcnow()}})
+        sent += 1
+    return sent
+
+
+def drain_email_queue(db, limit=50):
+    """Отправляет письма пачками по limit, пока очередь не опустеет; возвращает число отправленных"""
+    total = 0
+    while True:
+        sent = process_email_queue(db, limit)
+        total += sent
+        if sent < limit:
+            return total
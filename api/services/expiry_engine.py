@@ -0,0 +1,162 @@
+import heapq
+import threading
+import time
+from datetime import datetime
+
+from bson import ObjectId
+
+from api.common import db, manager, logger
+from api.config import Config
+from api.services.health_service import beat
+from api.services.live_updates import get_live_updates
+from api.services.notification_service import notify_expired
+
+# Максимальный сон между проверками: заодно отметка для /api/health/ready
+EXPIRY_MAX_SLEEP = 60
+
+
+class ExpiryEngine:
+    """Отключение пользователей точно в момент истечения срока.
+
+    Сроки включенных пользователей лежат в min-куче (expires_at, user_id);
+    поток спит до ближайшего срока и отключает всех, чей срок наступил.
+    Создание, продление, отключение и удаление приходят событиями живых
+    обновлений и меняют кучу точечно: устаревшие записи кучи не удаляются,
+    а пропускаются по словарю deadlines. Полная загрузка — только при
+    получении лидерства, событии resync и раз в EXPIRY_RESYNC_INTERVAL.
+
+    Работает только в воркере — лидере планировщика, чтобы пользователя
+    отключал ровно один процесс.
+    """
+
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        self.deadlines = {}
+        self._heap = []
+        self._loaded_at = None
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def start(self):
+        with self._cond:
+            if self._thread is None:
+                live = get_live_updates()
+                live.add_listener(self._on_event)
+                live.start()
+                self._thread = threading.Thread(target=self._loop, daemon=True)
+                self._thread.start()
+
+    def schedule(self, user_id, expires_at):
+        with self._cond:
+            if self.deadlines.get(user_id) == expires_at:
+                return
+            self.deadlines[user_id] = expires_at
+            heapq.heappush(self._heap, (expires_at, user_id))
+            # Будим поток, только если срок раньше того, до которого он спит
+            if self._heap[0][1] == user_id:
+                self._cond.notify()
+
+    def unschedule(self, user_id):
+        with self._cond:
+            self.deadlines.pop(user_id, None)
+
+    def reload(self):
+        with self._cond:
+            self._loaded_at = None
+            self._cond.notify()
+
+    def _load(self):
+        users = db.users.find(
+            {'enable': True, 'expires_at': {'$type': 'date'}, 'username': {'$ne': 'admin'}},
+            {'expires_at': 1},
+        )
+        deadlines = {str(user['_id']): user['expires_at'] for user in users}
+        with self._cond:
+            self.deadlines = deadlines
+            self._heap = [(expires_at, user_id) for user_id, expires_at in deadlines.items()]
+            heapq.heapify(self._heap)
+            self._loaded_at = time.monotonic()
+        logger.info(f"Expiry engine tracking {len(deadlines)} users")
+
+    def _on_event(self, event):
+        if self._loaded_at is None:
+            return
+        if event['type'] == 'resync':
+            self.reload()
+        elif event['type'] == 'user_deleted':
+            self.unschedule(event['id'])
+        elif event['type'] in ('user_added', 'user_updated'):
+            fields = event.get('fields', {})
+            if 'enable' not in fields and 'expires_at' not in fields:
+                return
+            if fields.get('enable') is False:
+                self.unschedule(event['id'])
+                return
+            expires_at = fields.get('expires_at')
+            if 'enable' in fields and 'expires_at' not in fields:
+                # Пользователя включили: срок есть только в документе
+                user = db.users.find_one({'_id': ObjectId(event['id']), 'enable': True}, {'expires_at': 1})
+                expires_at = user.get('expires_at') if user else None
+            if isinstance(expires_at, datetime):
+                self.schedule(event['id'], expires_at)
+            else:
+                self.unschedule(event['id'])
+
+    def _due(self, now):
+        """Снимает с кучи наступившие сроки; возвращает id и секунды до следующего срока"""
+        due = []
+        while self._heap:
+            expires_at, user_id = self._heap[0]
+            if self.deadlines.get(user_id) != expires_at:
+                heapq.heappop(self._heap)
+                continue
+            if expires_at > now:
+                return due, (expires_at - now).total_seconds()
+            heapq.heappop(self._heap)
+            del self.deadlines[user_id]
+            due.append(user_id)
+        return due, None
+
+    def _loop(self):
+        while True:
+            try:
+                if not self.scheduler.is_leader:
+                    with self._cond:
+                        self.deadlines, self._heap, self._loaded_at = {}, [], None
+                    time.sleep(self.scheduler.ttl / 2)
+                    continue
+                if self._loaded_at is None or time.monotonic() - self._loaded_at > Config.EXPIRY_RESYNC_INTERVAL:
+                    self._load()
+
+                with self._cond:
+                    due, wait = self._due(datetime.utcnow())
+                    if not due:
+                        self._cond.wait(min(wait if wait is not None else EXPIRY_MAX_SLEEP, EXPIRY_MAX_SLEEP))
+                if due:
+                    self._expire(due)
+                beat('expiry')
+            except Exception as e:
+                logger.error(f"Expiry engine error: {e}")
+                time.sleep(5)
+
+    def _expire(self, user_ids):
+        now = datetime.utcnow()
+        self.scheduler.leader.fence()
+        expired = manager.expire_users(user_ids, now)
+        if expired:
+            logger.info(f"Expired users: {', '.join(user['username'] for user in expired)}")
+            notify_expired(expired, now)
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def start_expiry_engine(scheduler):
+    """Запускает движок сроков рядом с планировщиком воркера"""
+    global _engine
+    with _engine_lock:
+        if _engine is None or _engine.scheduler is not scheduler:
+            _engine = ExpiryEngine(scheduler)
+        _engine.start()
+        return _engine
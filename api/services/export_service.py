@@ -0,0 +1,157 @@
+import base64
+import re
+import zipfile
+from datetime import datetime
+
+from api.common import db
+from api.config import Config
+from api.serialization import dumps, iter_json_array
+from api.services.user_query import build_user_filter
+
+EXPORT_FORMATS = ['ndjson', 'json', 'zip']
+
+EXPORT_PROJECTION = {
+    'username': 1, 'email': 1, 'port': 1, 'password': 1, 'method': 1, 'enable': 1,
+    'expires_at': 1, 'traffic_used': 1, 'traffic_limit': 1,
+}
+
+CURSOR_BATCH_SIZE = 500
+
+
+def _iter_users(filters):
+    """Один курсор по пользователям с конфигурацией; документы не накапливаются"""
+    query = build_user_filter(filters)
+    query['password'] = {'$exists': True}
+    query['port'] = {'$exists': True}
+    return db.users.find(query, EXPORT_PROJECTION).sort('_id', 1).batch_size(CURSOR_BATCH_SIZE)
+
+
+def _safe_name(username):
+    return re.sub(r'[^A-Za-z0-9._-]', '_', username or 'user')
+
+
+def sip008_server(user):
+    return {
+        'id': str(user['_id']),
+        'remarks': user.get('username', 'user'),
+        'server': Config.SS_SERVER_IP,
+        'server_port': user['port'],
+        'password': user['password'],
+        'method': user['method'],
+    }
+
+
+def export_record(user):
+    """Конфигурация пользователя: ss:// URI, запись SIP008 и сроки"""
+    config_string = f"{user['method']}:{user['password']}@{Config.SS_SERVER_IP}:{user['port']}"
+    ss_url = f"ss://{base64.b64encode(config_string.encode()).decode()}"
+    return {
+        'id': str(user['_id']),
+        'username': user.get('username'),
+        'email': user.get('email', ''),
+        'enable': user.get('enable', True),
+        'server': Config.SS_SERVER_IP,
+        'port': user['port'],
+        'password': user['password'],
+        'method': user['method'],
+        'ss_url': ss_url,
+        'ss_url_with_comment': f"{ss_url}#{user.get('username', 'user')}",
+        'sip008': sip008_server(user),
+        'expires_at': user.get('expires_at'),
+        'traffic_used_gb': round(user.get('traffic_used', 0) / 1024**3, 2),
+        'traffic_limit_gb': round(user.get('traffic_limit', 0) / 1024**3, 2),
+    }
+
+
+def conf_file(record):
+    expires_at = record['expires_at'].isoformat() if isinstance(record['expires_at'], datetime) else (record['expires_at'] or 'Never')
+    return f"""# Shadowsocks Configuration for {record['username']}
+# Expires: {expires_at}
+# Traffic: {record['traffic_used_gb']} / {record['traffic_limit_gb']} GB
+
+server={record['server']}
+server_port={record['port']}
+password={record['password']}
+method={record['method']}
+timeout=300
+mode=tcp_and_udp
+
+# Quick import URL: {record['ss_url_with_comment']}
+"""
+
+
+def stream_ndjson(filters=None):
+    """Одна строка JSON на пользователя"""
+    for user in _iter_users(filters):
+        yield dumps(export_record(user)) + '\n'
+
+
+def stream_json(filters=None):
+    """Один JSON-массив, сериализуемый кусками"""
+    return iter_json_array(export_record(user) for user in _iter_users(filters))
+
+
+class _StreamSink:
+    """Поток без перемотки для zipfile: записанные байты забираются через drain().
+
+    Без seek/tell zipfile пишет data descriptor после каждого файла, поэтому
+    архив можно отдавать по частям, не держа его целиком в памяти.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def write(self, data):
+        self._buffer.extend(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+
+def stream_zip(filters=None):
+    """ZIP: README, .conf на пользователя, файл ss:// ссылок и общий SIP008 JSON.
+
+    Каждый общий файл пишется отдельным проходом курсора, чтобы не копить
+    ссылки всех пользователей в памяти.
+    """
+    return (chunk for chunk in _zip_parts(filters) if chunk)
+
+
+def _zip_parts(filters):
+    sink = _StreamSink()
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('README.txt', f"""Shadowsocks Configurations Export
+Generated: {datetime.utcnow().isoformat()}
+Server: {Config.SS_SERVER_IP}
+
+configs/<username>.conf  - configuration for Shadowsocks clients
+shadowsocks-urls.txt     - ss:// import links
+sip008.json              - SIP008 online configuration with all servers
+""")
+        yield sink.drain()
+
+        for user in _iter_users(filters):
+            record = export_record(user)
+            archive.writestr(f"configs/{_safe_name(record['username'])}.conf", conf_file(record))
+            yield sink.drain()
+
+        with archive.open('shadowsocks-urls.txt', 'w') as entry:
+            entry.write(b"# Shadowsocks URLs for all users\n\n")
+            for user in _iter_users(filters):
+                record = export_record(user)
+                entry.write(f"{record['username']}: {record['ss_url_with_comment']}\n".encode('utf-8'))
+                yield sink.drain()
+
+        with archive.open('sip008.json', 'w') as entry:
+            entry.write(b'{"version": 1, "servers": [')
+            for index, user in enumerate(_iter_users(filters)):
+                entry.write(((', ' if index else '') + dumps(sip008_server(user))).encode('utf-8'))
+                yield sink.drain()
+            entry.write(b']}')
+    yield sink.drain()
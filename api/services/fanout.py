@@ -0,0 +1,72 @@
+import queue
+import threading
+
+from api.common import logger
+from api.config import Config
+
+
+class Subscriber:
+    """Клиент потока с ограниченной очередью сообщений"""
+
+    def __init__(self, queue_size):
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.dropped = False
+
+
+class FanOut:
+    """Рассылка сообщений подписчикам через ограниченные очереди.
+
+    Подписчик, который не успевает забирать сообщения, отключается: в его
+    очередь кладется None, а публикующий поток не блокируется.
+    """
+
+    def __init__(self, queue_size=None, max_subscribers=None):
+        self.queue_size = queue_size or Config.TRAFFIC_STREAM_QUEUE
+        self.max_subscribers = max_subscribers or Config.MAX_STREAMS
+        self.subscribers = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self, initial=(), subscriber=None):
+        """Новый подписчик или None, если достигнут лимит потоков.
+
+        initial — первые сообщения подписчика; если это функция, она
+        вызывается под блокировкой, атомарно с публикациями.
+        subscriber — уже существующий подписчик другой рассылки: так
+        несколько рассылок пишут в одну очередь (один поток клиента).
+        """
+        subscriber = subscriber or Subscriber(self.queue_size)
+        with self._lock:
+            if len(self.subscribers) >= self.max_subscribers:
+                return None
+            for message in (initial() if callable(initial) else initial):
+                subscriber.queue.put_nowait(message)
+            self.subscribers.add(subscriber)
+            self._on_subscribe()
+        return subscriber
+
+    def _on_subscribe(self):
+        """Вызывается под блокировкой после добавления подписчика"""
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self.subscribers.discard(subscriber)
+
+    def publish(self, message):
+        with self._lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.queue.put_nowait(message)
+            except queue.Full:
+                self._drop(subscriber)
+
+    def _drop(self, subscriber):
+        logger.warning(f"Dropping slow {type(self).__name__} client")
+        self.unsubscribe(subscriber)
+        subscriber.dropped = True
+        while True:
+            try:
+                subscriber.queue.get_nowait()
+            except queue.Empty:
+                break
+        subscriber.queue.put_nowait(None)
@@ -0,0 +1,162 @@
+import os
+import threading
+import time
+from datetime import datetime
+
+from api.common import db, mongo, logger
+from api.config import Config
+from api.host_channel import get_host_channel
+
+# Ожидаемый интервал фоновых задач (секунды): задача считается зависшей,
+# если ее отметка старше HEALTH_STALE_FACTOR интервалов. Задачи планировщика
+# отмечаются после каждого успешного прогона, движок сроков — не реже минуты
+HEARTBEAT_INTERVALS = {
+    'stats_refresh': 1,
+    'traffic_monitor': 30,
+    'email_queue': Config.EMAIL_QUEUE_INTERVAL,
+    'notification_outbox': Config.NOTIFICATION_OUTBOX_INTERVAL,
+    'expiry': 60,
+    'notifications': Config.NOTIFICATIONS_INTERVAL,
+}
+HEALTH_STALE_FACTOR = 3
+# Отметки пишутся в Mongo не чаще раза в HEARTBEAT_WRITE_INTERVAL секунд
+HEARTBEAT_WRITE_INTERVAL = 10
+
+_started_at = time.monotonic()
+_beats_written = {}
+_beats_lock = threading.Lock()
+
+
+def beat(name):
+    """Отметка фоновой задачи: задача жива и закончила очередной проход"""
+    now = time.monotonic()
+    with _beats_lock:
+        if now - _beats_written.get(name, float('-inf')) < HEARTBEAT_WRITE_INTERVAL:
+            return
+        _beats_written[name] = now
+    try:
+        db.heartbeats.update_one(
+            {'_id': name},
+            {'$set': {'updated_at': datetime.utcnow(), 'pid': os.getpid()}},
+            upsert=True,
+        )
+    except Exception as e:
+        logger.warning(f"Could not record heartbeat {name}: {e}")
+
+
+def liveness():
+    """Процесс отвечает на запросы; без обращений к Mongo и хосту"""
+    return {'status': 'alive', 'pid': os.getpid(), 'uptime': round(time.monotonic() - _started_at, 1)}
+
+
+def _probe_mongo():
+    try:
+        latency = mongo.ping()
+    except Exception as e:
+        return {'status': 'fail', 'state': mongo.state, 'error': str(e)}
+    return {'status': 'ok', 'state': mongo.state, 'latency_ms': latency}
+
+
+def _probe_host():
+    # Только сохраненное состояние канала: detect_capabilities запустил бы
+    # помощника и systemctl, а проверка не должна гонять команды на хост
+    channel = get_host_channel()
+    caps = channel.capabilities
+    if caps is None:
+        return {'status': 'unknown', 'error': 'Host channel has not been used yet'}
+    if not caps['host_mounted']:
+        return {'status': 'fail', 'error': f'{Config.HOST_ROOT} is not mounted'}
+    if not channel.is_available():
+        return {'status': 'fail', 'error': 'Host helper is not running', 'exec_method': caps['exec_method']}
+    return {'status': 'ok', 'exec_method': caps['exec_method']}
+
+
+def _probe_heartbeats():
+    if not mongo.available:
+        return {name: {'status': 'unknown'} for name in HEARTBEAT_INTERVALS}
+    now = datetime.utcnow()
+    beats = {doc['_id']: doc for doc in db.heartbeats.find({'_id': {'$in': list(HEARTBEAT_INTERVALS)}})}
+    result = {}
+    for name, interval in HEARTBEAT_INTERVALS.items():
+        doc = beats.get(name)
+        if doc is None:
+            result[name] = {'status': 'unknown'}
+            continue
+        age = (now - doc['updated_at']).total_seconds()
+        # Отметки пишутся с прореживанием: порог не меньше нескольких интервалов записи
+        stale_after = HEALTH_STALE_FACTOR * max(interval, HEARTBEAT_WRITE_INTERVAL)
+        result[name] = {'status': 'ok' if age <= stale_after else 'stale', 'age': round(age, 1), 'pid': doc.get('pid')}
+    return result
+
+
+class HealthMonitor:
+    """Кэш проверок готовности, обновляемый фоновым потоком.
+
+    Запрос /api/health/ready только читает последний результат, поэтому
+    балансировщик может опрашивать его хоть каждую секунду: к Mongo
+    обращается один поток раз в HEALTH_PROBE_INTERVAL секунд, а канал
+    хоста проверяется только по сохраненному состоянию.
+    """
+
+    def __init__(self, interval=None):
+        self.interval = interval or Config.HEALTH_PROBE_INTERVAL
+        self._result = None
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def _run_probes(self):
+        checks = {}
+        for name, probe in (('mongodb', _probe_mongo), ('host', _probe_host), ('jobs', _probe_heartbeats)):
+            try:
+                checks[name] = probe()
+            except Exception as e:
+                checks[name] = {'status': 'fail', 'error': str(e)}
+        jobs = checks['jobs']
+        if 'status' in jobs:
+            # Отметки не прочитались: у каждой задачи результат самой проверки
+            jobs = checks['jobs'] = {name: dict(jobs) for name in HEARTBEAT_INTERVALS}
+        checks['traffic_monitor'] = jobs.pop('traffic_monitor')
+
+        # Без Mongo панель не работает; остальное лишь ухудшает работу
+        ready = checks['mongodb']['status'] == 'ok'
+        degraded = (
+            checks['host']['status'] == 'fail'
+            or checks['traffic_monitor']['status'] == 'stale'
+            or any(job['status'] == 'stale' for job in jobs.values())
+        )
+        status = 'ready' if ready and not degraded else 'degraded' if ready else 'not_ready'
+        return {'status': status, 'ready': ready, 'checks': checks, 'checked_at': datetime.utcnow(), '_monotonic': time.monotonic()}
+
+    def _loop(self):
+        while True:
+            result = self._run_probes()
+            with self._lock:
+                self._result = result
+            time.sleep(self.interval)
+
+    def get(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, daemon=True)
+                self._thread.start()
+            if self._result is None:
+                # Запрос никогда не ждет проверок: до первого результата — starting
+                return {'status': 'starting', 'ready': False, 'checks': {}}
+            result = dict(self._result)
+        result['age'] = round(time.monotonic() - result.pop('_monotonic'), 1)
+        return result
+
+
+_monitor = None
+_monitor_pid = None
+_monitor_lock = threading.Lock()
+
+
+def readiness():
+    """Последний результат проверок готовности; монитор свой в каждом процессе"""
+    global _monitor, _monitor_pid
+    with _monitor_lock:
+        if _monitor is None or _monitor_pid != os.getpid():
+            _monitor = HealthMonitor()
+            _monitor_pid = os.getpid()
+    return _monitor.get()
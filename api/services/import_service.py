@@ -0,0 +1,76 @@
+import argparse
+import csv
+import io
+import json
+import sys
+
+from api.common import db, manager, logger
+from api.config import Config
+from api.services.email_service import enqueue_emails
+
+IMPORT_FIELDS = ['username', 'email', 'traffic_limit_gb', 'duration_days', 'method', 'password']
+
+
+def parse_records(text, fmt):
+    """Разбирает CSV (с заголовком) или NDJSON в список словарей"""
+    if fmt == 'csv':
+        reader = csv.DictReader(io.StringIO(text))
+        return [{k.strip(): (v or '').strip() for k, v in row.items() if k and k.strip() in IMPORT_FIELDS} for row in reader]
+    if fmt == 'ndjson':
+        records = []
+        for number, line in enumerate(text.splitlines(), start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                raise ValueError(f'Line {number}: {e}')
+            # Строку не-объект не отбрасываем: import_users вернет по ней ошибку строки
+            records.append({k: v for k, v in record.items() if k in IMPORT_FIELDS} if isinstance(record, dict) else record)
+        return records
+    raise ValueError(f'Unsupported format: {fmt}')
+
+
+def detect_format(content_type, filename=None):
+    content_type = (content_type or '').lower()
+    filename = (filename or '').lower()
+    if 'csv' in content_type or filename.endswith('.csv'):
+        return 'csv'
+    if 'ndjson' in content_type or 'jsonl' in content_type or filename.endswith(('.ndjson', '.jsonl')):
+        return 'ndjson'
+    return None
+
+
+def import_users(text, fmt, send_emails=True):
+    result = manager.import_users(parse_records(text, fmt))
+
+    if send_emails and result.get('success'):
+        queued = enqueue_emails(db, [('welcome', user['email'], {
+            'username': user['username'],
+            'server': Config.SS_SERVER_IP,
+            'port': user['port'],
+            'password': user['password'],
+            'method': user['method'],
+            'expires_days': user['duration_days'],
+        }) for user in result['created'] if user.get('email')])
+        result['emails_queued'] = queued
+        logger.info(f'Queued {queued} welcome emails')
+
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Import Shadowsocks users from CSV or NDJSON')
+    parser.add_argument('path', help='file to import, "-" for stdin')
+    parser.add_argument('--format', choices=['csv', 'ndjson'], help='defaults to the file extension')
+    parser.add_argument('--no-email', action='store_true', help='do not queue welcome emails')
+    args = parser.parse_args()
+
+    fmt = args.format or detect_format(None, args.path)
+    if fmt is None:
+        parser.error('Cannot detect format, pass --format')
+
+    text = sys.stdin.read() if args.path == '-' else open(args.path, encoding='utf-8').read()
+    result = import_users(text, fmt, send_emails=not args.no_email)
+    print(json.dumps(result, indent=2, default=str))
+    sys.exit(0 if result.get('success') else 1)
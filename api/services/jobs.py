@@ -0,0 +1,72 @@
+from datetime import datetime
+import time
+
+from api.common import db, logger
+
+# Прогресс длительных операций в коллекции jobs: изменения расходятся
+# клиентам через /api/live (тема jobs), записи живут сутки.
+
+JOB_PROGRESS_INTERVAL = 1
+JOB_TTL_SECONDS = 24 * 3600
+
+_indexes_ready = False
+
+
+def _ensure_indexes():
+    global _indexes_ready
+    if not _indexes_ready:
+        db.jobs.create_index('updated_at', expireAfterSeconds=JOB_TTL_SECONDS)
+        _indexes_ready = True
+
+
+def track_job(kind, items):
+    """Пропускает элементы пакетной операции и пишет ее прогресс в jobs.
+
+    Понимает элементы bulk_users: start (total), item (success) и summary.
+    Запись обновляется не чаще раза в JOB_PROGRESS_INTERVAL секунд, а также
+    в начале и в конце операции.
+    """
+    job = {'kind': kind, 'status': 'running', 'total': None, 'done': 0, 'failed': 0, 'started_at': datetime.utcnow()}
+    job['updated_at'] = job['started_at']
+    try:
+        _ensure_indexes()
+        job_id = db.jobs.insert_one(dict(job)).inserted_id
+    except Exception as e:
+        logger.error(f"Could not record job {kind}: {e}")
+        yield from items
+        return
+
+    def save(**fields):
+        job.update(fields, updated_at=datetime.utcnow())
+        try:
+            db.jobs.update_one({'_id': job_id}, {'$set': {k: v for k, v in job.items() if k != 'started_at'}})
+        except Exception as e:
+            logger.error(f"Could not update job {kind}: {e}")
+
+    saved_at = time.monotonic()
+    try:
+        for item in items:
+            kind_of_item = item.get('type')
+            if kind_of_item == 'start':
+                save(total=item.get('total'))
+            elif kind_of_item == 'item':
+                job['done'] += 1
+                if not item.get('success'):
+                    job['failed'] += 1
+                if time.monotonic() - saved_at >= JOB_PROGRESS_INTERVAL:
+                    save()
+                    saved_at = time.monotonic()
+            elif kind_of_item == 'error':
+                job['error'] = item.get('error')
+            yield item
+        save(status='failed' if job.get('error') else 'done')
+    except GeneratorExit:
+        # Клиент закрыл соединение: операция прервана вместе с ответом.
+        # Закрываем ее явно, чтобы она сразу довела до конца начатое
+        if hasattr(items, 'close'):
+            items.close()
+        save(status='cancelled')
+        raise
+    except Exception as e:
+        save(status='failed', error=str(e))
+        raise
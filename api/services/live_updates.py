@@ -0,0 +1,379 @@
+from datetime import datetime, timedelta
+import os
+import queue
+import socket
+import threading
+import time
+
+from bson import ObjectId
+from flask import Response, jsonify, request
+from pymongo.errors import OperationFailure, PyMongoError
+
+from api.common import db, logger
+from api.config import Config
+from api.serialization import dumps
+from api.services import versioning
+from api.services.fanout import FanOut
+
+# Коллекции, изменения которых рассылаются клиентам
+WATCHED_COLLECTIONS = ['users', 'traffic_samples', 'stats_snapshot', 'logs', 'jobs']
+
+# Темы общего потока и типы событий в них; resync и hello приходят всем
+LIVE_TOPICS = ['users', 'stats', 'services', 'notifications', 'traffic', 'jobs']
+EVENT_TOPICS = {
+    'user_added': 'users',
+    'user_updated': 'users',
+    'user_deleted': 'users',
+    'stats_updated': 'stats',
+    'service_state': 'services',
+    'notification': 'notifications',
+    'traffic_sample': 'traffic',
+    'job_progress': 'jobs',
+}
+
+# Поля пользователя, которые попадают в события (пароль никогда)
+LIVE_USER_FIELDS = [
+    'username', 'email', 'port', 'method', 'enable', 'role',
+    'traffic_limit', 'traffic_used', 'expires_at', 'updated_at',
+]
+
+# Поля, значения которых не рассылаются, но их изменение важно для кэшей
+SECRET_USER_FIELDS = {'password', 'subscription_token'}
+
+KEEPALIVE_INTERVAL = 15
+
+# Resume token у каждого процесса свой: воркеры читают поток независимо
+RESUME_TOKEN_ID = 'live_updates'
+RESUME_TOKEN_SAVE_INTERVAL = 1
+RESUME_TOKEN_TTL = 24 * 3600
+
+# События, после которых производитель кадров трафика строит новый кадр:
+# изменения пользователей (в том числе $inc трафика от traffic_monitor).
+# Его собственные записи (traffic_samples) и снимок статистики не будят его
+TRAFFIC_WAKE_EVENTS = {'user_added', 'user_updated', 'user_deleted'}
+
+# Опрос без change streams берет пользователей по updated_at с запасом
+# назад: запись могла получить updated_at чуть раньше, чем попала в базу
+USER_WATERMARK_OVERLAP = 5
+
+# Коды ошибок MongoDB: change streams недоступны без replica set / токен устарел
+CHANGE_STREAM_UNSUPPORTED = {40573, 40324}
+CHANGE_STREAM_HISTORY_LOST = 286
+
+
+def _user_fields(doc):
+    return {field: doc[field] for field in LIVE_USER_FIELDS if field in doc}
+
+
+def _stats_events(component, data):
+    """Обновление компонента снимка; службы дополнительно идут событием service_state"""
+    if component != 'services':
+        return [{'type': 'stats_updated', 'component': component, 'data': data}]
+    summary = {k: v for k, v in data.items() if k != 'user_services'}
+    return [
+        {'type': 'stats_updated', 'component': component, 'data': summary},
+        {'type': 'service_state', 'user_services': data.get('user_services', []), 'total_services': data.get('total_services', 0)},
+    ]
+
+
+def _notification_event(doc):
+    return {'type': 'notification', 'notification': {k: v for k, v in doc.items() if k != '_id'}}
+
+
+class LiveUpdates(FanOut):
+    """Живые обновления из MongoDB в виде типизированных событий.
+
+    Читает change stream базы по WATCHED_COLLECTIONS и после обрыва
+    продолжает с resume token, сохраненным этим процессом. Без replica set
+    переходит на опрос: раз в интервал читает пользователей, измененных
+    после прошлого опроса (по updated_at).
+
+    События: user_added, user_updated, user_deleted, traffic_sample,
+    stats_updated, service_state, notification, job_progress и resync
+    (клиенту нужно перечитать данные целиком).
+    """
+
+    def __init__(self, poll_interval=None):
+        super().__init__(queue_size=Config.LIVE_STREAM_QUEUE)
+        self.poll_interval = poll_interval or Config.LIVE_POLL_INTERVAL
+        self.mode = None
+        self.traffic_changed = threading.Event()
+        self.resume_token_id = f"{RESUME_TOKEN_ID}:{socket.gethostname()}:{os.getpid()}"
+        self.listeners = []
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def _on_subscribe(self):
+        self.start()
+
+    def add_listener(self, callback):
+        """Обработчик событий внутри процесса (например, сброс кэшей)"""
+        self.listeners.append(callback)
+
+    def emit(self, event):
+        if event['type'] in TRAFFIC_WAKE_EVENTS:
+            self.traffic_changed.set()
+        for callback in self.listeners:
+            try:
+                callback(event)
+            except Exception as e:
+                logger.error(f"Live updates listener failed: {e}")
+        self.publish(event)
+
+    def _run(self):
+        while True:
+            try:
+                self._watch()
+                self.mode = None
+            except OperationFailure as e:
+                if e.code in CHANGE_STREAM_UNSUPPORTED or 'replica set' in str(e):
+                    logger.info("Change streams are not available, falling back to polling")
+                    self.mode = 'polling'
+                    self._poll()
+                    return
+                self.mode = None
+                if e.code == CHANGE_STREAM_HISTORY_LOST:
+                    logger.warning("Stored resume token is too old, starting a new change stream")
+                    db.live_resume_tokens.delete_one({'_id': self.resume_token_id})
+                    # Изменения после сохраненных версий тоже не дочитать
+                    versioning.rotate(WATCHED_COLLECTIONS)
+                    self.emit({'type': 'resync'})
+                    continue
+                logger.error(f"Change stream failed: {e}")
+            except PyMongoError as e:
+                self.mode = None
+                logger.error(f"Change stream failed: {e}")
+            time.sleep(5)
+
+    def _watch(self):
+        db.live_resume_tokens.create_index('updated_at', expireAfterSeconds=RESUME_TOKEN_TTL)
+        stored = db.live_resume_tokens.find_one({'_id': self.resume_token_id})
+        pipeline = [{'$match': {'ns.coll': {'$in': WATCHED_COLLECTIONS}}}]
+        saved_at = 0
+        # Без своего resume token поток читается с самой поздней общей версии,
+        # чтобы версии этого воркера совпали с остальными
+        start = versioning.load(WATCHED_COLLECTIONS)
+        options = {'resume_after': stored['token']} if stored else {'start_at_operation_time': start}
+        with db.watch(pipeline, **options) as stream:
+            self.mode = 'change_stream'
+            logger.info("Live updates: watching MongoDB change stream")
+            for change in stream:
+                versioning.bump(change['ns']['coll'], change.get('clusterTime'))
+                for event in self._to_events(change):
+                    self.emit(event)
+                if time.monotonic() - saved_at >= RESUME_TOKEN_SAVE_INTERVAL:
+                    versioning.flush()
+                    db.live_resume_tokens.update_one(
+                        {'_id': self.resume_token_id},
+                        {'$set': {'token': stream.resume_token, 'updated_at': datetime.utcnow()}},
+                        upsert=True,
+                    )
+                    saved_at = time.monotonic()
+
+    def _to_events(self, change):
+        event = self._to_event(change)
+        if event is None:
+            return []
+        return event if isinstance(event, list) else [event]
+
+    def _to_event(self, change):
+        collection = change['ns']['coll']
+        operation = change['operationType']
+        doc_id = change.get('documentKey', {}).get('_id')
+
+        if collection == 'users':
+            if operation in ('insert', 'replace'):
+                event_type = 'user_added' if operation == 'insert' else 'user_updated'
+                return {'type': event_type, 'id': str(doc_id), 'fields': _user_fields(change['fullDocument'])}
+            if operation == 'update':
+                updated = change['updateDescription']['updatedFields']
+                fields = _user_fields(updated)
+                if not fields and not SECRET_USER_FIELDS & updated.keys():
+                    return None
+                # Для секретных полей передается только факт изменения
+                return {'type': 'user_updated', 'id': str(doc_id), 'fields': fields, 'keys': sorted(updated)}
+            if operation == 'delete':
+                return {'type': 'user_deleted', 'id': str(doc_id)}
+        elif collection == 'traffic_samples' and operation == 'insert':
+            doc = change['fullDocument']
+            return {'type': 'traffic_sample', 'timestamp': doc['timestamp'], 'total_used_gb': doc['total_used_gb']}
+        elif collection == 'stats_snapshot' and operation in ('update', 'replace', 'insert'):
+            fields = change.get('updateDescription', {}).get('updatedFields') or change.get('fullDocument') or {}
+            if 'data' in fields:
+                return _stats_events(doc_id, fields['data'])
+        elif collection == 'logs' and operation == 'insert':
+            if change['fullDocument'].get('type') == 'notification':
+                return _notification_event(change['fullDocument'])
+        elif collection == 'jobs' and operation in ('insert', 'update', 'replace'):
+            fields = change.get('fullDocument') or change['updateDescription']['updatedFields']
+            return {'type': 'job_progress', **{k: v for k, v in fields.items() if k != '_id'}, 'id': str(doc_id)}
+        return None
+
+    def _poll_users(self, users, watermark):
+        """Изменения пользователей с прошлого опроса; возвращает новую отметку updated_at.
+
+        Читаются только документы с updated_at не старше отметки (с запасом
+        USER_WATERMARK_OVERLAP), повторно прочитанные без изменений событий
+        не дают. Удаления ищутся по списку _id, только когда число
+        документов разошлось с известным.
+        """
+        since = watermark - timedelta(seconds=USER_WATERMARK_OVERLAP)
+        for doc in db.users.find({'updated_at': {'$gte': since}}, LIVE_USER_FIELDS):
+            self._poll_user(users, doc)
+            watermark = max(watermark, doc['updated_at'])
+        if db.users.estimated_document_count() != len(users):
+            ids = {doc['_id'] for doc in db.users.find({}, {'_id': 1})}
+            for user_id in users.keys() - {str(_id) for _id in ids}:
+                del users[user_id]
+                self.emit({'type': 'user_deleted', 'id': user_id})
+            # Документы без updated_at (записаны в обход менеджера)
+            missing = [_id for _id in ids if str(_id) not in users]
+            for doc in db.users.find({'_id': {'$in': missing}}, LIVE_USER_FIELDS) if missing else []:
+                self._poll_user(users, doc)
+        return watermark
+
+    def _poll_user(self, users, doc):
+        user_id = str(doc['_id'])
+        fields = _user_fields(doc)
+        previous = users.get(user_id)
+        users[user_id] = fields
+        if previous is None:
+            self.emit({'type': 'user_added', 'id': user_id, 'fields': fields})
+        else:
+            changed = {k: v for k, v in fields.items() if previous.get(k) != v}
+            if changed:
+                self.emit({'type': 'user_updated', 'id': user_id, 'fields': changed})
+
+    def _poll(self):
+        users = None
+        watermark = None
+        last_sample = None
+        last_notification = None
+        last_stats = last_jobs = datetime.utcnow()
+        while True:
+            try:
+                if users is None:
+                    # Полный снимок один раз, дальше — только изменения по updated_at
+                    watermark = datetime.utcnow()
+                    users = {str(doc['_id']): _user_fields(doc) for doc in db.users.find({}, LIVE_USER_FIELDS)}
+                else:
+                    watermark = self._poll_users(users, watermark)
+
+                if last_sample is None:
+                    latest = db.traffic_samples.find_one(sort=[('_id', -1)])
+                    last_sample = latest['_id'] if latest else 0
+                else:
+                    for sample in db.traffic_samples.find({'_id': {'$gt': last_sample}}).sort('_id', 1):
+                        self.emit({'type': 'traffic_sample', 'timestamp': sample['timestamp'], 'total_used_gb': sample['total_used_gb']})
+                        last_sample = sample['_id']
+
+                for doc in db.stats_snapshot.find({'updated_at': {'$gt': last_stats}}):
+                    for event in _stats_events(doc['_id'], doc['data']):
+                        self.emit(event)
+                    last_stats = max(last_stats, doc['updated_at'])
+
+                if last_notification is None:
+                    latest = db.logs.find_one({'type': 'notification'}, sort=[('_id', -1)])
+                    last_notification = latest['_id'] if latest else ObjectId.from_datetime(datetime.utcnow())
+                else:
+                    for doc in db.logs.find({'type': 'notification', '_id': {'$gt': last_notification}}).sort('_id', 1):
+                        self.emit(_notification_event(doc))
+                        last_notification = doc['_id']
+
+                for doc in db.jobs.find({'updated_at': {'$gt': last_jobs}}):
+                    self.emit({'type': 'job_progress', **{k: v for k, v in doc.items() if k != '_id'}, 'id': str(doc['_id'])})
+                    last_jobs = max(last_jobs, doc['updated_at'])
+            except PyMongoError as e:
+                logger.error(f"Live updates polling failed: {e}")
+            time.sleep(self.poll_interval)
+
+
+def parse_topics(value):
+    """Темы из ?topics=users,stats,...; без параметра — все темы"""
+    if not value:
+        return set(LIVE_TOPICS)
+    topics = {topic.strip() for topic in value.split(',') if topic.strip()}
+    unknown = topics - set(LIVE_TOPICS)
+    if unknown:
+        raise ValueError(f"Unknown topics: {', '.join(sorted(unknown))}. Must be one of: {', '.join(LIVE_TOPICS)}")
+    return topics
+
+
+def _too_many_streams():
+    return jsonify({'success': False, 'message': 'Too many open streams, try again later'}), 503, {'Retry-After': '30'}
+
+
+def stream_response():
+    """Общий SSE поток клиента: события выбранных тем в одном соединении.
+
+    Имя SSE события — тема (event: users, event: traffic, ...), hello и
+    resync идут без имени. Тема traffic подключает ту же очередь к
+    TrafficBroadcaster: кадры трафика идут со своими id, поэтому
+    Last-Event-ID продолжает поток трафика после переподключения.
+    """
+    try:
+        topics = parse_topics(request.args.get('topics'))
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+
+    live = get_live_updates()
+    subscriber = live.subscribe()
+    if subscriber is None:
+        return _too_many_streams()
+    sources = [live]
+    if 'traffic' in topics:
+        from api.services.traffic_service import get_traffic_broadcaster
+
+        broadcaster = get_traffic_broadcaster()
+        if broadcaster.subscribe(request.headers.get('Last-Event-ID'), subscriber=subscriber) is None:
+            live.unsubscribe(subscriber)
+            return _too_many_streams()
+        sources.append(broadcaster)
+
+    def generate():
+        try:
+            yield f"data: {dumps({'type': 'hello', 'mode': live.mode or 'starting', 'topics': sorted(topics)})}\n\n"
+            while True:
+                try:
+                    event = subscriber.queue.get(timeout=KEEPALIVE_INTERVAL)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                if event is None:
+                    yield f"data: {dumps({'type': 'resync', 'reason': 'Client too slow'})}\n\n"
+                    return
+                if isinstance(event, str):
+                    # Готовый кадр TrafficBroadcaster
+                    yield f"event: traffic\n{event}"
+                    continue
+                topic = EVENT_TOPICS.get(event['type'])
+                if topic is None:
+                    yield f"data: {dumps(event)}\n\n"
+                elif topic in topics:
+                    yield f"event: {topic}\ndata: {dumps(event)}\n\n"
+        finally:
+            for source in sources:
+                source.unsubscribe(subscriber)
+
+    return Response(generate(), mimetype='text/event-stream')
+
+
+_live = None
+_live_pid = None
+_live_lock = threading.Lock()
+
+
+def get_live_updates():
+    """LiveUpdates текущего процесса; после fork (gunicorn) создается заново"""
+    global _live, _live_pid
+    with _live_lock:
+        if _live is None or _live_pid != os.getpid():
+            _live = LiveUpdates()
+            _live_pid = os.getpid()
+        return _live
@@ -1,25 +1,47 @@
 from datetime import datetime, timedelta
-import time
 
-from api.common import db, logger
-from api.services.email_service import send_expiration_email, send_traffic_warning_email, send_expired_email
+from api.common import db
+from api.services.email_service import enqueue_emails
+
+
+def _log_notifications(notifications, now):
+    """Сохраняет уведомления в журнал: история и рассылка через /api/live"""
+    if not notifications:
+        return
+    db.logs.insert_many([{
+        **{k: v for k, v in item.items() if k != 'type'},
+        'type': 'notification',
+        'notification_type': item['type'],
+        'timestamp': now,
+    } for item in notifications])
+
+
+# Флаг еще не выставлен; в отличие от $ne: True, такое условие идет по индексу
+NOT_NOTIFIED = {'$in': [None, False]}
 
 
 def check_notifications_logic():
-    if db is None:
-        return []
+    """Уведомления о скором истечении срока.
 
+    Срок проверяет MongoDB по составному индексу (ensure_user_indexes),
+    поэтому читаются только подходящие пользователи и только нужные поля.
+    Флаги выставляются одним update_many, письма ставятся в очередь пачкой.
+    Предупреждения о трафике приходят из traffic_monitor через
+    notification_outbox (deliver_notification_outbox).
+    """
     notifications = []
+    emails = []
     now = datetime.utcnow()
+    projection = {'username': 1, 'email': 1, 'expires_at': 1}
 
     users_expiring = list(db.users.find({
         'enable': True,
+        'notified_expire': NOT_NOTIFIED,
         'expires_at': {'$gt': now, '$lt': now + timedelta(days=3)},
-        'notified_expire': {'$ne': True},
-    }))
+    }, projection))
     for user in users_expiring:
-        expires_at = user.get('expires_at')
-        days_left = (expires_at - now).days if isinstance(expires_at, datetime) else 0
+        expires_at = user['expires_at']
+        days_left = (expires_at - now).days
         notifications.append({
             'type': 'expire_soon',
             'user_id': str(user['_id']),
@@ -28,66 +50,95 @@ def check_notifications_logic():
             'expires_at': str(expires_at),
             'message': f"User {user.get('username')} expires in {days_left} days",
         })
-        if user.get('email'):
-            send_expiration_email(user['email'], user['username'], days_left, expires_at)
-        db.users.update_one({'_id': user['_id']}, {'$set': {'notified_expire': True}})
-
-    users_high_traffic = list(db.users.find({'enable': True, 'traffic_limit': {'$gt': 0}, 'notified_traffic': {'$ne': True}}))
-    for user in users_high_traffic:
-        used = user.get('traffic_used', 0)
-        limit = user.get('traffic_limit', 1)
-        usage_percent = (used / limit) * 100
-        if usage_percent > 90:
-            used_gb = round(used / 1024**3, 2)
-            limit_gb = round(limit / 1024**3, 2)
-            notifications.append({
-                'type': 'traffic_high',
-                'user_id': str(user['_id']),
-                'username': user.get('username'),
-                'usage_percent': round(usage_percent, 1),
-                'message': f"User {user.get('username')} used {usage_percent:.1f}% traffic",
-            })
-            if user.get('email'):
-                send_traffic_warning_email(user['email'], user['username'], usage_percent, used_gb, limit_gb)
-            db.users.update_one({'_id': user['_id']}, {'$set': {'notified_traffic': True}})
+        emails.append(('expiration', user.get('email'), {'username': user.get('username'), 'days_left': days_left, 'expires_at': expires_at}))
+    if users_expiring:
+        db.users.update_many({'_id': {'$in': [user['_id'] for user in users_expiring]}}, {'$set': {'notified_expire': True}})
 
+    enqueue_emails(db, emails)
+    _log_notifications(notifications, now)
     return notifications
 
 
-def background_notifications_check():
-    while True:
-        try:
-            if db is None:
-                time.sleep(60)
-                continue
-
-            now = datetime.utcnow()
-            check_notifications_logic()
-
-            expired_users = list(db.users.find({'enable': True, 'expires_at': {'$lte': now}, 'notified_expired': {'$ne': True}}))
-            for user in expired_users:
-                db.users.update_one({'_id': user['_id']}, {'$set': {'enable': False, 'notified_expired': True}})
-                if user.get('email'):
-                    send_expired_email(user['email'], user.get('username', 'user'))
-
-            if now.hour == 0 and now.minute < 5:
-                stats = list(db.users.aggregate([{'$group': {
-                    '_id': None,
-                    'total_used': {'$sum': '$traffic_used'},
-                    'total_limit': {'$sum': '$traffic_limit'},
-                    'avg_usage': {'$avg': {'$divide': ['$traffic_used', '$traffic_limit']}},
-                    'user_count': {'$sum': 1},
-                }}]))
-                if stats:
-                    db.logs.insert_one({
-                        'type': 'traffic_daily',
-                        'timestamp': now,
-                        'total_used_gb': round(stats[0]['total_used'] / 1024**3, 2),
-                        'total_limit_gb': round(stats[0]['total_limit'] / 1024**3, 2),
-                        'average_usage': round(stats[0].get('avg_usage', 0) * 100, 1),
-                        'user_count': stats[0]['user_count'],
-                    })
-            time.sleep(300)
-        except Exception as e:
-            logger.error(f"Error in background notifications: {e}")
-            time.sleep(60)
+# Запись, не подтвержденная за это время, доставляется повторно
+OUTBOX_CLAIM_TIMEOUT = timedelta(minutes=10)
+_outbox_indexes_ready = False
+
+
+def deliver_notification_outbox(limit=100):
+    """Переносит уведомления из notification_outbox в журнал и очередь писем.
+
+    Запись забирается атомарно; зависшую в 'delivering' дольше
+    OUTBOX_CLAIM_TIMEOUT забирают повторно (доставка как минимум один раз).
+    """
+    global _outbox_indexes_ready
+    if not _outbox_indexes_ready:
+        db.notification_outbox.create_index([('status', 1), ('created_at', 1)])
+        _outbox_indexes_ready = True
+
+    delivered = 0
+    for _ in range(limit):
+        now = datetime.utcnow()
+        entry = db.notification_outbox.find_one_and_update(
+            {'$or': [
+                {'status': 'pending'},
+                {'status': 'delivering', 'claimed_at': {'$lt': now - OUTBOX_CLAIM_TIMEOUT}},
+            ]},
+            {'$set': {'status': 'delivering', 'claimed_at': now}},
+            sort=[('created_at', 1)],
+        )
+        if entry is None:
+            break
+        _log_notifications([entry['notification']], entry['created_at'])
+        if entry.get('email'):
+            enqueue_emails(db, [entry['email']])
+        db.notification_outbox.update_one({'_id': entry['_id']}, {'$set': {'status': 'delivered', 'delivered_at': datetime.utcnow()}})
+        delivered += 1
+    return delivered
+
+
+def get_notification_history(limit=50):
+    """Последние уведомления из журнала, новые первыми"""
+    return list(db.logs.find({'type': 'notification'}, {'_id': 0}).sort('timestamp', -1).limit(limit))
+
+
+def notify_expired(expired_users, now=None):
+    """Журнал и письма об отключении истекших пользователей (письма — через очередь)"""
+    now = now or datetime.utcnow()
+    enqueue_emails(db, [('expired', user.get('email'), {'username': user.get('username', 'user')}) for user in expired_users])
+    _log_notifications([{
+        'type': 'expired',
+        'user_id': str(user['_id']),
+        'username': user.get('username'),
+        'message': f"User {user.get('username')} has expired",
+    } for user in expired_users], now)
+
+
+def record_traffic_daily():
+    """Дневная сводка трафика; одна запись на дату, повторные запуски за день ничего не меняют"""
+    now = datetime.utcnow()
+    stats = list(db.users.aggregate([{'$group': {
+        '_id': None,
+        'total_used': {'$sum': '$traffic_used'},
+        'total_limit': {'$sum': '$traffic_limit'},
+        # Пользователи без лимита (traffic_limit 0) в среднюю долю не входят: $avg пропускает null
+        'avg_usage': {'$avg': {'$cond': [
+            {'$gt': [{'$ifNull': ['$traffic_limit', 0]}, 0]},
+            {'$divide': [{'$ifNull': ['$traffic_used', 0]}, '$traffic_limit']},
+            None,
+        ]}},
+        'user_count': {'$sum': 1},
+    }}]))
+    if not stats:
+        return False
+    result = db.logs.update_one(
+        {'type': 'traffic_daily', 'date': now.strftime('%Y-%m-%d')},
+        {'$setOnInsert': {
+            'timestamp': now,
+            'total_used_gb': round(stats[0]['total_used'] / 1024**3, 2),
+            'total_limit_gb': round(stats[0]['total_limit'] / 1024**3, 2),
+            'average_usage': round((stats[0].get('avg_usage') or 0) * 100, 1),
+            'user_count': stats[0]['user_count'],
+        }},
+        upsert=True,
+    )
+    return result.upserted_id is not None
@@ -0,0 +1,63 @@
+from datetime import datetime, timedelta
+
+from api.common import db, manager
+from api.config import Config
+from api.services.cipher_service import load_cached_benchmark, run_benchmark_process
+from api.services.email_service import drain_email_queue
+from api.services.expiry_engine import start_expiry_engine
+from api.services.notification_service import check_notifications_logic, deliver_notification_outbox, record_traffic_daily
+from api.services.scheduler import get_scheduler
+
+
+def purge_old_records():
+    """Удаляет старые записи журналов, трафика и отправленных писем; возвращает число удаленных по коллекциям"""
+    now = datetime.utcnow()
+    logs_before = now - timedelta(days=Config.LOG_RETENTION_DAYS)
+    connections_before = now - timedelta(days=Config.CONNECTIONS_RETENTION_DAYS)
+    return {
+        # Дневные сводки нужны для истории трафика и не удаляются
+        'logs': db.logs.delete_many({'type': {'$ne': 'traffic_daily'}, 'timestamp': {'$lt': logs_before}}).deleted_count,
+        'connections': db.connections.delete_many({'timestamp': {'$lt': connections_before}}).deleted_count,
+        'notification_outbox': db.notification_outbox.delete_many({'status': 'delivered', 'created_at': {'$lt': logs_before}}).deleted_count,
+        'email_queue': db.email_queue.delete_many({'status': {'$in': ['sent', 'failed']}, 'created_at': {'$lt': logs_before}}).deleted_count,
+    }
+
+
+def reconcile_services():
+    """Создает недостающие службы пользователей и пересобирает конфиг admin"""
+    result = manager.sync_services()
+    if not result['success']:
+        raise RuntimeError(result['error'])
+    return {key: result[key] for key in ('services_created', 'total_users')}
+
+
+def benchmark_ciphers():
+    """Снимает бенчмарк шифров, если для этого CPU его еще нет.
+
+    Задача планировщика, поэтому бенчмарк идет в одном процессе: параллельные
+    прогоны в каждом воркере мешали бы друг другу и исказили бы замер.
+    """
+    if not Config.SS_METHOD_AUTO or load_cached_benchmark() is not None:
+        return None
+    return run_benchmark_process()['recommended_method']
+
+
+def notifications():
+    return len(check_notifications_logic())
+
+
+def start_scheduler():
+    """Регистрирует периодические задачи и запускает планировщик воркера"""
+    scheduler = get_scheduler()
+    scheduler.add('notifications', notifications, Config.NOTIFICATIONS_INTERVAL, jitter=30)
+    scheduler.add('notification_outbox', deliver_notification_outbox, Config.NOTIFICATION_OUTBOX_INTERVAL)
+    scheduler.add('email_queue', lambda: drain_email_queue(db), Config.EMAIL_QUEUE_INTERVAL)
+    # Запись за день одна (upsert по дате), поэтому достаточно запускать раз в час
+    scheduler.add('traffic_daily', record_traffic_daily, 3600, jitter=60)
+    scheduler.add('reconcile', reconcile_services, Config.RECONCILE_INTERVAL, jitter=60)
+    scheduler.add('retention', purge_old_records, 6 * 3600, jitter=300)
+    scheduler.add('cipher_benchmark', benchmark_ciphers, 24 * 3600)
+    scheduler.start()
+    # Сроки пользователей отслеживаются кучей с точным временем, а не периодическим обходом
+    start_expiry_engine(scheduler)
+    return scheduler
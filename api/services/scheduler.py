@@ -0,0 +1,205 @@
+import atexit
+import os
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+
+from pymongo.errors import DuplicateKeyError
+
+from api.common import db, logger
+from api.config import Config
+from api.lease_manager import LeaseError, LeaseManager
+from api.services.health_service import beat
+
+# Аренда лидера: периодические задачи запускает только ее владелец
+LEADER_RESOURCE = 'scheduler-leader'
+# Как часто лидер проверяет сроки задач (секунды)
+SCHEDULER_TICK = 1
+
+
+class ScheduledJob:
+    """Периодическая задача: интервал и случайный разброс срока (секунды)"""
+
+    def __init__(self, name, func, interval, jitter=0):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.jitter = jitter
+
+    def next_run_at(self, now):
+        return now + timedelta(seconds=self.interval + random.uniform(0, self.jitter))
+
+
+class Scheduler:
+    """Планировщик периодических задач с выбором лидера через аренду в MongoDB.
+
+    Цикл есть в каждом воркере, но задачи запускает только держатель аренды
+    LEADER_RESOURCE; остальные раз в SCHEDULER_LEASE_TTL / 2 пробуют ее
+    перехватить. Срок следующего запуска хранится в scheduler_jobs и
+    забирается атомарно, поэтому смена лидера не запускает задачу повторно.
+    На время выполнения задача держит свою аренду job:<имя>: прогон не
+    начнется, пока не закончился предыдущий, даже у прежнего лидера.
+    Каждый прогон пишется в scheduler_runs.
+    """
+
+    def __init__(self, lease_manager=None, ttl=None):
+        self.ttl = ttl or Config.SCHEDULER_LEASE_TTL
+        self.lease_manager = lease_manager or LeaseManager(db, ttl=self.ttl)
+        self.jobs = {}
+        self.leader = None
+        self._running = set()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._indexes_ready = False
+
+    def add(self, name, func, interval, jitter=0):
+        self.jobs[name] = ScheduledJob(name, func, interval, jitter)
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, daemon=True)
+                self._thread.start()
+                logger.info(f"Scheduler started with jobs: {', '.join(self.jobs)}")
+
+    @property
+    def is_leader(self):
+        return self.leader is not None and not self.leader.lost
+
+    def _ensure_indexes(self):
+        if not self._indexes_ready:
+            db.scheduler_runs.create_index('started_at', expireAfterSeconds=Config.SCHEDULER_HISTORY_DAYS * 86400)
+            db.scheduler_runs.create_index([('job', 1), ('started_at', -1)])
+            self._indexes_ready = True
+
+    def _try_lead(self):
+        lease = self.lease_manager.try_acquire(LEADER_RESOURCE, self.ttl)
+        if lease is not None:
+            lease.start_heartbeat()
+            logger.info(f"Scheduler leadership acquired by {self.lease_manager.node}")
+        return lease
+
+    def _loop(self):
+        while True:
+            try:
+                if not self.is_leader:
+                    if self.leader is not None:
+                        logger.warning("Scheduler leadership lost")
+                        self.leader = None
+                    self.leader = self._try_lead()
+                if self.is_leader:
+                    self._ensure_indexes()
+                    self._run_due()
+            except Exception as e:
+                logger.error(f"Scheduler error: {e}")
+            time.sleep(SCHEDULER_TICK if self.is_leader else self.ttl / 2)
+
+    def _claim(self, job, now):
+        """Забирает срок задачи; False, если срок не подошел"""
+        try:
+            db.scheduler_jobs.find_one_and_update(
+                {'_id': job.name, 'next_run_at': {'$lte': now}},
+                {'$set': {'next_run_at': job.next_run_at(now), 'interval': job.interval}},
+                upsert=True,
+            )
+        except DuplicateKeyError:
+            return False
+        return True
+
+    def _run_due(self):
+        # Сроки сдвигает только действующий лидер: проверка после _claim
+        # теряла бы уже забранный прогон
+        try:
+            self.leader.fence()
+        except LeaseError:
+            self.leader.lost = True
+            self.leader.release()
+            raise
+        now = datetime.utcnow()
+        for job in self.jobs.values():
+            with self._lock:
+                if job.name in self._running:
+                    continue
+            if not self._claim(job, now):
+                continue
+            with self._lock:
+                self._running.add(job.name)
+            threading.Thread(target=self._execute, args=(job,), daemon=True).start()
+
+    def _execute(self, job):
+        run = {'job': job.name, 'node': self.lease_manager.node, 'started_at': datetime.utcnow()}
+        try:
+            # Аренда задачи держится на время прогона и продлевается heartbeat
+            lease = self.lease_manager.try_acquire(f'job:{job.name}', self.ttl)
+            if lease is None:
+                # Предыдущий прогон еще идет (например, у прежнего лидера)
+                run['status'] = 'skipped'
+            else:
+                lease.start_heartbeat()
+                try:
+                    run['result'] = job.func()
+                    run['status'] = 'ok'
+                    beat(job.name)
+                finally:
+                    lease.release()
+        except Exception as e:
+            logger.error(f"Scheduled job {job.name} failed: {e}")
+            run.update(status='failed', error=str(e))
+        finally:
+            with self._lock:
+                self._running.discard(job.name)
+        self._record(job, run)
+
+    def _record(self, job, run):
+        run['finished_at'] = datetime.utcnow()
+        run['duration'] = round((run['finished_at'] - run['started_at']).total_seconds(), 3)
+        try:
+            db.scheduler_runs.insert_one(run)
+            db.scheduler_jobs.update_one({'_id': job.name}, {'$set': {
+                'last_run_at': run['started_at'],
+                'last_status': run['status'],
+                'last_duration': run['duration'],
+                'last_error': run.get('error'),
+            }})
+        except Exception as e:
+            logger.error(f"Could not record run of {job.name}: {e}")
+
+    def release(self):
+        if self.is_leader:
+            try:
+                self.leader.release()
+            except Exception as e:
+                logger.warning(f"Could not release scheduler leadership: {e}")
+            self.leader = None
+
+
+def get_job_status(runs_limit=10):
+    """Состояние задач и последние прогоны для /api/scheduler/jobs"""
+    jobs = list(db.scheduler_jobs.find().sort('_id', 1))
+    for job in jobs:
+        job['runs'] = list(db.scheduler_runs.find({'job': job['_id']}, {'_id': 0, 'job': 0}).sort('started_at', -1).limit(runs_limit))
+    leader = db.leases.find_one({'_id': LEADER_RESOURCE}, {'owner': 1, 'expires_at': 1})
+    return {'leader': leader, 'jobs': jobs}
+
+
+_scheduler = None
+_scheduler_pid = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """Планировщик текущего процесса; после fork (gunicorn) создается заново"""
+    global _scheduler, _scheduler_pid
+    with _scheduler_lock:
+        if _scheduler is None or _scheduler_pid != os.getpid():
+            _scheduler = Scheduler()
+            _scheduler_pid = os.getpid()
+        return _scheduler
+
+
+@atexit.register
+def _release_leadership():
+    # Воркер уходит (перезапуск, остановка): лидерство сразу достается другому
+    if _scheduler is not None and _scheduler_pid == os.getpid():
+        _scheduler.release()
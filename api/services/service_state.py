@@ -0,0 +1,124 @@
+import threading
+import time
+
+from api.config import Config
+from api.config_generator import HostSystemctlManager
+from api.host_channel import SYSTEMCTL_PATH
+
+# Свойства юнита, которые читаются одним вызовом systemctl show
+STATE_PROPERTIES = ['LoadState', 'ActiveState', 'SubState', 'UnitFileState', 'MainPID', 'ActiveEnterTimestampMonotonic']
+
+# Состояние, которого ждем после действия: ActiveState или UnitFileState
+ACTION_TARGETS = {
+    'start': {'active'},
+    'restart': {'active'},
+    'reload': {'active'},
+    'stop': {'inactive', 'failed'},
+    'enable': {'enabled'},
+    'disable': {'disabled'},
+}
+UNIT_FILE_STATES = {'enabled', 'disabled'}
+WAIT_STATES = {'active', 'inactive', 'failed'} | UNIT_FILE_STATES
+
+# Опрос с нарастающей паузой; чаще PROBE_INTERVAL юнит не опрашивается,
+# сколько бы запросов его ни ждали
+PROBE_INTERVAL = 0.2
+PROBE_MAX_DELAY = 1.0
+
+
+def read_unit_state(unit):
+    """Состояние юнита одним systemctl show (вместо pgrep + systemctl status)"""
+    result = HostSystemctlManager.run_on_host([SYSTEMCTL_PATH, 'show', unit, f"--property={','.join(STATE_PROPERTIES)}"])
+    if not result['success']:
+        return {'success': False, 'error': result.get('error') or result.get('stderr') or 'systemctl show failed'}
+
+    props = dict(line.split('=', 1) for line in result['stdout'].splitlines() if '=' in line)
+    active_state = props.get('ActiveState', 'unknown')
+    pid = int(props.get('MainPID') or 0)
+    entered = int(props.get('ActiveEnterTimestampMonotonic') or 0)
+    # Контейнер и хост используют одни монотонные часы ядра
+    uptime = round(time.monotonic() - entered / 1e6) if active_state == 'active' and entered else None
+    return {
+        'success': True,
+        'unit': unit,
+        'exists': props.get('LoadState') != 'not-found',
+        'active_state': active_state,
+        'sub_state': props.get('SubState', 'unknown'),
+        'unit_file_state': props.get('UnitFileState', ''),
+        'active': active_state == 'active',
+        'enabled': props.get('UnitFileState') == 'enabled',
+        'pid': pid or None,
+        'uptime': uptime,
+    }
+
+
+def _matches(state, targets):
+    if targets & UNIT_FILE_STATES:
+        return state['unit_file_state'] in targets
+    return state['active_state'] in targets
+
+
+class UnitStateWatcher:
+    """Ожидание состояния юнита на стороне сервера.
+
+    Команды хоста идут через канал с одной командой на запрос, подписаться
+    на сигналы D-Bus через него нельзя, поэтому юнит опрашивается
+    systemctl show с нарастающей паузой. Одновременные ожидания одного
+    юнита делят опросы: результат моложе PROBE_INTERVAL берется из кэша.
+    """
+
+    def __init__(self):
+        self._cache = {}
+        self._unit_locks = {}
+        self._lock = threading.Lock()
+
+    def probe(self, unit):
+        with self._lock:
+            unit_lock = self._unit_locks.setdefault(unit, threading.Lock())
+        with unit_lock:
+            cached = self._cache.get(unit)
+            if cached is not None and time.monotonic() - cached[0] < PROBE_INTERVAL:
+                return cached[1]
+            state = read_unit_state(unit)
+            self._cache[unit] = (time.monotonic(), state)
+            return state
+
+    def wait(self, unit, targets, timeout):
+        """Ждет targets не дольше timeout секунд; возвращает (состояние, достигнуто ли)"""
+        deadline = time.monotonic() + timeout
+        delay = PROBE_INTERVAL
+        while True:
+            state = self.probe(unit)
+            if not state['success']:
+                return state, False
+            if _matches(state, targets):
+                return state, True
+            # Юнит упал при запуске — ждать дальше бессмысленно
+            if state['active_state'] == 'failed' and 'active' in targets:
+                return state, False
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return state, False
+            time.sleep(min(delay, remaining))
+            delay = min(delay * 2, PROBE_MAX_DELAY)
+
+
+_watcher = UnitStateWatcher()
+
+
+def parse_wait_timeout(value):
+    """Таймаут ожидания из запроса: по умолчанию SERVICE_WAIT_TIMEOUT, не больше SERVICE_WAIT_MAX"""
+    if value in (None, ''):
+        return Config.SERVICE_WAIT_TIMEOUT
+    timeout = float(value)
+    if timeout < 0:
+        raise ValueError('timeout must be non-negative')
+    return min(timeout, Config.SERVICE_WAIT_MAX)
+
+
+def get_unit_state(unit):
+    return _watcher.probe(unit)
+
+
+def wait_for_state(unit, targets, timeout):
+    return _watcher.wait(unit, set(targets), timeout)
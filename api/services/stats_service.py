@@ -0,0 +1,220 @@
+from datetime import datetime, timedelta
+import os
+import threading
+import time
+
+import psutil
+from pymongo.errors import DuplicateKeyError
+
+from api.common import db, manager, mongo, logger
+from api.config import Config
+from api.config_generator import HostSystemctlManager
+from api.services.health_service import beat
+
+# Снимок статистики: каждый компонент обновляется фоном по своему расписанию
+# и хранится в коллекции stats_snapshot, общей для всех воркеров.
+# Запрос /api/stats только читает готовый снимок.
+
+READ_CACHE_SECONDS = 1
+
+_local_snapshot = {}
+_read_cache = {'at': 0.0, 'components': None}
+_read_lock = threading.Lock()
+
+
+def _collect_users():
+    now = datetime.utcnow()
+    return {
+        'total': db.users.count_documents({}),
+        'active': db.users.count_documents({'enable': True, '$or': [{'expires_at': {'$gt': now}}, {'expires_at': {'$exists': False}}]}),
+    }
+
+
+def _collect_traffic():
+    total_used = 0
+    total_limit = 0
+    traffic_stats = list(db.users.aggregate([{'$group': {'_id': None, 'total_used': {'$sum': '$traffic_used'}, 'total_limit': {'$sum': '$traffic_limit'}}}]))
+    if traffic_stats:
+        total_used = traffic_stats[0].get('total_used', 0)
+        total_limit = traffic_stats[0].get('total_limit', 0)
+    return {'total_used_gb': round(total_used / 1024**3, 2), 'total_limit_gb': round(total_limit / 1024**3, 2)}
+
+
+def _collect_system():
+    # interval=None не блокирует: загрузка считается с прошлого вызова
+    return {
+        'cpu_usage': round(psutil.cpu_percent(interval=None), 1),
+        'memory_usage': round(psutil.virtual_memory().percent, 1),
+    }
+
+
+def _collect_services():
+    total_services = 0
+    active_services = 0
+    user_services = []
+    if manager is not None:
+        services_result = manager.get_all_services_status()
+        if services_result.get('success'):
+            total_services = services_result.get('total_services', 0)
+            user_services = services_result.get('user_services', [])
+            active_services = sum(1 for s in user_services if s.get('active', False))
+    # Полный список отдается через /api/services/status, в /api/stats только счетчики
+    return {'total_services': total_services, 'active_services': active_services, 'user_services': user_services}
+
+
+def _collect_admin_service():
+    result = HostSystemctlManager.run_on_host(['systemctl', 'is-active', 'shadowsocks.service'], timeout=5)
+    return 'running' if result['success'] else ('unavailable' if result.get('error') else 'stopped')
+
+
+# Компонент -> (функция сбора, интервал обновления в секундах, нужна ли БД)
+COMPONENTS = {
+    'users': (_collect_users, Config.STATS_DB_INTERVAL, True),
+    'traffic': (_collect_traffic, Config.STATS_DB_INTERVAL, True),
+    'system': (_collect_system, Config.STATS_SYSTEM_INTERVAL, False),
+    'services': (_collect_services, Config.STATS_SERVICES_INTERVAL, False),
+    'admin_service': (_collect_admin_service, Config.STATS_SERVICES_INTERVAL, False),
+}
+
+DEFAULTS = {
+    'users': {'total': 0, 'active': 0},
+    'traffic': {'total_used_gb': 0, 'total_limit_gb': 0},
+    'system': {'cpu_usage': 0, 'memory_usage': 0},
+    'services': {'total_services': 0, 'active_services': 0, 'user_services': []},
+    'admin_service': 'unknown',
+}
+
+
+def _claim(name, interval):
+    """Забирает обновление компонента; только один воркер обновляет его за интервал"""
+    now = datetime.utcnow()
+    if not mongo.available:
+        entry = _local_snapshot.get(name)
+        return entry is None or entry['next_refresh_at'] <= now
+    try:
+        db.stats_snapshot.find_one_and_update(
+            {'_id': name, 'next_refresh_at': {'$lte': now}},
+            {'$set': {'next_refresh_at': now + timedelta(seconds=interval)}},
+            upsert=True,
+        )
+    except DuplicateKeyError:
+        # Компонент свежий или его уже обновляет другой воркер
+        return False
+    return True
+
+
+def _store(name, data, interval):
+    now = datetime.utcnow()
+    if not mongo.available:
+        _local_snapshot[name] = {'data': data, 'updated_at': now, 'next_refresh_at': now + timedelta(seconds=interval)}
+        return
+    db.stats_snapshot.update_one(
+        {'_id': name},
+        {'$set': {'data': data, 'updated_at': now}, '$setOnInsert': {'next_refresh_at': now + timedelta(seconds=interval)}},
+        upsert=True,
+    )
+
+
+def refresh_due_components(force=False):
+    """Обновляет компоненты, у которых подошел срок; возвращает их имена"""
+    refreshed = []
+    for name, (collect, interval, needs_db) in COMPONENTS.items():
+        if needs_db and not mongo.available:
+            continue
+        if not force and not _claim(name, interval):
+            continue
+        try:
+            _store(name, collect(), interval)
+            refreshed.append(name)
+        except Exception as e:
+            logger.error(f"Error refreshing stats component {name}: {e}")
+    return refreshed
+
+
+def _read_components():
+    if not mongo.available:
+        return dict(_local_snapshot)
+    with _read_lock:
+        if _read_cache['components'] is None or time.monotonic() - _read_cache['at'] > READ_CACHE_SECONDS:
+            _read_cache['components'] = {doc['_id']: doc for doc in db.stats_snapshot.find({'data': {'$exists': True}})}
+            _read_cache['at'] = time.monotonic()
+        return _read_cache['components']
+
+
+def read_components():
+    """Документы компонентов снимка; пустой словарь, если прочитать не удалось"""
+    try:
+        return _read_components()
+    except Exception as e:
+        logger.error(f"Error reading stats snapshot: {e}")
+        return {}
+
+
+def get_stats_snapshot(components=None):
+    """Последний снимок статистики с возрастом каждого компонента в секундах.
+
+    components — уже прочитанные документы (read_components), чтобы не читать их повторно.
+    """
+    if components is None:
+        components = read_components()
+
+    now = datetime.utcnow()
+    stats = {}
+    age = {}
+    for name in COMPONENTS:
+        entry = components.get(name)
+        if entry is None:
+            stats[name] = DEFAULTS[name]
+            age[name] = None
+        else:
+            stats[name] = entry['data']
+            age[name] = round((now - entry['updated_at']).total_seconds(), 1)
+    stats['services'] = {k: v for k, v in stats['services'].items() if k != 'user_services'}
+
+    try:
+        hostname = os.uname().nodename if hasattr(os, 'uname') else 'docker-container'
+    except Exception:
+        hostname = 'docker-container'
+
+    stats['server'] = {'ip': Config.SS_SERVER_IP, 'hostname': hostname, 'db_status': mongo.state, 'manager_status': 'connected' if manager is not None else 'disconnected'}
+    stats['age'] = age
+    return stats
+
+
+def snapshot_version(names=None, components=None):
+    """Версия снимка для ETag: время обновления компонентов"""
+    if components is None:
+        try:
+            components = _read_components()
+        except Exception:
+            return None
+    names = names or list(COMPONENTS)
+    return ','.join(
+        components[name]['updated_at'].isoformat() if name in components else '-'
+        for name in names
+    )
+
+
+def get_services_status(fresh=False, components=None):
+    """Статус служб из снимка; fresh=True опрашивает systemd сразу и обновляет снимок"""
+    if fresh:
+        data = _collect_services()
+        _store('services', data, COMPONENTS['services'][1])
+        with _read_lock:
+            _read_cache['components'] = None
+    else:
+        entry = (_read_components() if components is None else components).get('services')
+        data = entry['data'] if entry else DEFAULTS['services']
+    return {'success': True, 'user_services': data['user_services'], 'total_services': data['total_services']}
+
+
+def background_stats_refresh(interval=1):
+    # Первый вызов cpu_percent(None) задает точку отсчета и всегда возвращает 0
+    psutil.cpu_percent(interval=None)
+    while True:
+        try:
+            refresh_due_components()
+            beat('stats_refresh')
+        except Exception as e:
+            logger.error(f"Error refreshing stats snapshot: {e}")
+        time.sleep(interval)
@@ -0,0 +1,144 @@
+import base64
+import hashlib
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from bson import ObjectId
+
+from api.common import db, logger
+from api.config import Config
+from api.serialization import dumps
+from api.services.export_service import export_record, sip008_server
+from api.services.live_updates import get_live_updates
+
+SUBSCRIPTION_FORMATS = ['sip008', 'base64']
+
+# Изменение этих полей меняет содержимое подписки
+SUBSCRIPTION_FIELDS = {'port', 'password', 'method', 'enable', 'subscription_token', 'username'}
+
+
+class SubscriptionCache:
+    """Кэш готовых ответов подписки в памяти процесса.
+
+    Ключ — токен подписки. Запись сбрасывается событием живых обновлений,
+    если у пользователя изменились порт, пароль или метод, и в любом случае
+    живет не дольше SUBSCRIPTION_CACHE_TTL (на случай режима опроса, где
+    смена пароля не видна).
+    """
+
+    def __init__(self, ttl=None, max_entries=None):
+        self.ttl = ttl or Config.SUBSCRIPTION_CACHE_TTL
+        self.max_entries = max_entries or Config.SUBSCRIPTION_CACHE_SIZE
+        self._entries = OrderedDict()
+        self._tokens_by_user = {}
+        self._lock = threading.Lock()
+        self._listening = False
+
+    def _listen(self):
+        if not self._listening:
+            live = get_live_updates()
+            live.add_listener(self._on_event)
+            live.start()
+            self._listening = True
+
+    def _on_event(self, event):
+        if event['type'] == 'user_deleted':
+            self.invalidate_user(event['id'])
+        elif event['type'] == 'user_updated':
+            keys = set(event.get('keys') or event.get('fields', {}))
+            if keys & SUBSCRIPTION_FIELDS:
+                self.invalidate_user(event['id'])
+        elif event['type'] == 'resync':
+            self.clear()
+
+    def get(self, token):
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            if time.monotonic() - entry['cached_at'] > self.ttl:
+                self._remove(token)
+                return None
+            self._entries.move_to_end(token)
+            return entry
+
+    def put(self, token, user_id, entry):
+        with self._lock:
+            self._listen()
+            entry['cached_at'] = time.monotonic()
+            entry['user_id'] = user_id
+            self._entries[token] = entry
+            self._entries.move_to_end(token)
+            self._tokens_by_user[user_id] = token
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+
+    def _remove(self, token):
+        entry = self._entries.pop(token, None)
+        if entry is not None and self._tokens_by_user.get(entry['user_id']) == token:
+            del self._tokens_by_user[entry['user_id']]
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            token = self._tokens_by_user.get(user_id)
+            if token is not None:
+                self._remove(token)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tokens_by_user.clear()
+
+
+_cache = SubscriptionCache()
+
+
+def _build_entry(user):
+    record = export_record(user)
+    bodies = {
+        'sip008': dumps({'version': 1, 'servers': [sip008_server(user)]}),
+        'base64': base64.b64encode((record['ss_url_with_comment'] + '\n').encode('utf-8')).decode('ascii'),
+    }
+    return {
+        'bodies': bodies,
+        'etags': {fmt: hashlib.sha1(body.encode('utf-8')).hexdigest() for fmt, body in bodies.items()},
+    }
+
+
+def get_subscription(token):
+    """Готовый ответ подписки по токену или None; Mongo читается только при промахе кэша"""
+    entry = _cache.get(token)
+    if entry is not None:
+        return entry
+    user = db.users.find_one(
+        {'subscription_token': token, 'enable': {'$ne': False}},
+        {'username': 1, 'port': 1, 'password': 1, 'method': 1},
+    )
+    if not user or not user.get('password') or not user.get('port'):
+        return None
+    entry = _build_entry(user)
+    _cache.put(token, str(user['_id']), entry)
+    return entry
+
+
+def issue_subscription_token(user_id, rotate=False):
+    """Токен подписки пользователя; создается при первом запросе, rotate выдает новый"""
+    user = db.users.find_one({'_id': ObjectId(user_id)}, {'subscription_token': 1})
+    if not user:
+        return None
+    token = user.get('subscription_token')
+    if token and not rotate:
+        return token
+    token = secrets.token_urlsafe(24)
+    db.users.update_one({'_id': user['_id']}, {'$set': {'subscription_token': token}})
+    _cache.invalidate_user(str(user['_id']))
+    logger.info(f"Subscription token {'rotated' if rotate else 'issued'} for user {user_id}")
+    return token
+
+
+def subscription_url(token, base_url):
+    """Ссылка подписки; SUBSCRIPTION_BASE_URL задает внешний адрес панели"""
+    return f"{(Config.SUBSCRIPTION_BASE_URL or base_url).rstrip('/')}/api/sub/{token}"
@@ -0,0 +1,62 @@
+from datetime import datetime
+
+from pymongo.errors import DuplicateKeyError
+
+from api.config import Config
+from api.database import db
+
+# Модуль используется процессом traffic_monitor, поэтому не импортирует
+# api.common (Flask-приложение и менеджер служб там не нужны).
+
+# Поля пользователя, которые нужны для проверки порогов после $inc трафика
+ALERT_USER_FIELDS = {'username': 1, 'email': 1, 'traffic_used': 1, 'traffic_limit': 1, 'traffic_alert_level': 1, 'traffic_period': 1}
+
+
+def crossed_threshold(user, thresholds=None):
+    """Наибольший порог (в процентах), пересеченный с прошлого предупреждения, или None"""
+    limit = user.get('traffic_limit') or 0
+    if limit <= 0:
+        return None
+    used = user.get('traffic_used') or 0
+    level = user.get('traffic_alert_level') or 0
+    crossed = [t for t in (thresholds or Config.TRAFFIC_ALERT_THRESHOLDS) if t > level and used * 100 >= t * limit]
+    return max(crossed) if crossed else None
+
+
+def record_traffic_alert(user, threshold, now=None):
+    """Кладет предупреждение в notification_outbox и поднимает уровень пользователя.
+
+    Ключ записи — пользователь, расчетный период и порог, поэтому повтор
+    после сбоя между двумя записями не создаст второе предупреждение.
+    Период (traffic_period) увеличивается при сбросе трафика.
+    """
+    now = now or datetime.utcnow()
+    used = user.get('traffic_used') or 0
+    limit = user['traffic_limit']
+    usage_percent = round(used / limit * 100, 1)
+    try:
+        db.notification_outbox.insert_one({
+            '_id': f"traffic:{user['_id']}:{user.get('traffic_period') or 0}:{threshold}",
+            'status': 'pending',
+            'created_at': now,
+            'notification': {
+                'type': 'traffic_high',
+                'user_id': str(user['_id']),
+                'username': user.get('username'),
+                'threshold': threshold,
+                'usage_percent': usage_percent,
+                'message': f"User {user.get('username')} reached {threshold}% of traffic limit ({usage_percent}%)",
+            },
+            'email': ('traffic_warning', user.get('email'), {
+                'username': user.get('username'),
+                'usage_percent': usage_percent,
+                'traffic_used_gb': round(used / 1024**3, 2),
+                'traffic_limit_gb': round(limit / 1024**3, 2),
+            }),
+        })
+    except DuplicateKeyError:
+        pass
+    db.users.update_one(
+        {'_id': user['_id'], '$or': [{'traffic_alert_level': {'$lt': threshold}}, {'traffic_alert_level': None}]},
+        {'$set': {'traffic_alert_level': threshold}},
+    )
@@ -1,74 +1,231 @@
+from collections import deque
 from datetime import datetime, timedelta
-import json
+import os
+import queue
+import threading
 import time
 
-from flask import Response
+from flask import Response, jsonify, request
 
-from api.common import db, logger, MongoJSONEncoder
+from api.common import db, logger
+from api.config import Config
+from api.serialization import dumps
+from api.services.fanout import FanOut
+from api.services.live_updates import get_live_updates
 
-traffic_history = []
+# Точки истории для графика: одна на интервал, общая для всех воркеров
+HISTORY_POINTS = 20
+
+
+class TrafficBroadcaster(FanOut):
+    """Один производитель кадров трафика на процесс, рассылка всем подписчикам.
+
+    Кадр считается один раз за интервал и раскладывается по очередям клиентов.
+    Если работает поток изменений MongoDB, новый кадр строится только после
+    изменений пользователей (но не реже IDLE_REFRESH секунд); собственные
+    записи истории и снимок статистики производителя не будят.
+
+    Протокол: новый клиент получает traffic_snapshot, дальше идут
+    traffic_delta только с изменившимися пользователями, итогами и новыми
+    точками истории. У каждого кадра SSE id вида "<epoch>:<seq>"; клиент,
+    переподключившийся с Last-Event-ID, получает пропущенные дельты, если
+    они еще в буфере, иначе — снимок.
+    """
+
+    IDLE_REFRESH = 60
+    DELTA_BUFFER = 100
+
+    def __init__(self, interval=None, queue_size=None, max_subscribers=None):
+        super().__init__(queue_size, max_subscribers)
+        self.interval = interval or Config.TRAFFIC_STREAM_INTERVAL
+        self._producer = None
+        self._indexes_ready = False
+        self._reset_state()
+
+    def _reset_state(self):
+        self.epoch = os.urandom(4).hex()
+        self.seq = 0
+        self.state = None
+        self.deltas = deque(maxlen=self.DELTA_BUFFER)
+
+    def _event(self, message):
+        return f"id: {self.epoch}:{message['seq']}\ndata: {dumps(message)}\n\n"
+
+    def _snapshot_event(self):
+        return self._event({
+            'type': 'traffic_snapshot',
+            'seq': self.seq,
+            'data': {
+                'users': list(self.state['users'].values()),
+                'total': self.state['total'],
+                'history': self.state['history'],
+            },
+        })
+
+    def _initial_events(self, last_event_id):
+        """Кадры для нового подписчика (вызывается под блокировкой)"""
+        if self.state is None:
+            return []
+        if last_event_id:
+            epoch, _, seq = last_event_id.partition(':')
+            if epoch == self.epoch and seq.isdigit():
+                missed = [event for event_seq, event in self.deltas if event_seq > int(seq)]
+                first_missed = int(seq) + 1
+                buffered = not missed or self.deltas[0][0] <= first_missed
+                if buffered and len(missed) < self.queue_size:
+                    return missed
+        return [self._snapshot_event()]
+
+    def subscribe(self, last_event_id=None, subscriber=None):
+        return super().subscribe(initial=lambda: self._initial_events(last_event_id), subscriber=subscriber)
+
+    def _on_subscribe(self):
+        if self._producer is None:
+            self._producer = threading.Thread(target=self._run, daemon=True)
+            self._producer.start()
+
+    def _run(self):
+        live = get_live_updates()
+        live.start()
+        while True:
+            with self._lock:
+                if not self.subscribers:
+                    # Нет клиентов — производитель останавливается до следующей подписки
+                    self._producer = None
+                    self._reset_state()
+                    return
+            started = time.monotonic()
+            live.traffic_changed.clear()
+            frame = self._build_frame()
+            if frame is not None:
+                self.publish(frame)
+            time.sleep(max(0, self.interval - (time.monotonic() - started)))
+            if live.mode == 'change_stream':
+                live.traffic_changed.wait(self.IDLE_REFRESH)
+
+    def _apply(self, current):
+        """Обновляет состояние и возвращает кадр-дельту или None, если ничего не изменилось"""
+        with self._lock:
+            previous = self.state
+            self.state = current
+            if previous is None:
+                self.seq += 1
+                # Первый кадр: клиенты, подписавшиеся до него, получают снимок
+                event = self._snapshot_event()
+                self.deltas.append((self.seq, event))
+                return event
+
+            delta = {
+                'users': [user for user_id, user in current['users'].items() if previous['users'].get(user_id) != user],
+                'removed': [user_id for user_id in previous['users'] if user_id not in current['users']],
+            }
+            if current['total']['total_used_gb'] != previous['total']['total_used_gb'] or current['total']['total_limit_gb'] != previous['total']['total_limit_gb']:
+                delta['total'] = current['total']
+            known = {point['timestamp'] for point in previous['history']}
+            delta['history'] = [point for point in current['history'] if point['timestamp'] not in known]
+            if not any(delta.values()):
+                return None
+
+            self.seq += 1
+            event = self._event({'type': 'traffic_delta', 'seq': self.seq, 'data': delta})
+            self.deltas.append((self.seq, event))
+            return event
+
+    def _record_history(self, total_used_gb, now):
+        """Точка истории на интервал; воркеры пишут в одну и ту же точку"""
+        if not self._indexes_ready:
+            db.traffic_samples.create_index('timestamp', expireAfterSeconds=self.interval * HISTORY_POINTS * 5)
+            self._indexes_ready = True
+        bucket = int(now.timestamp() // self.interval)
+        db.traffic_samples.update_one(
+            {'_id': bucket},
+            {'$setOnInsert': {'timestamp': now, 'total_used_gb': total_used_gb}},
+            upsert=True,
+        )
+        samples = list(db.traffic_samples.find().sort('_id', -1).limit(HISTORY_POINTS))
+        return [{'timestamp': h['timestamp'].isoformat(), 'total_used_gb': h['total_used_gb']} for h in reversed(samples)]
+
+    def _build_frame(self):
+        try:
+            users = list(db.users.find({}, {
+                'username': 1,
+                'traffic_used': 1,
+                'traffic_limit': 1,
+                'port': 1,
+                'enable': 1,
+                'updated_at': 1,
+            }).sort('updated_at', -1).limit(10))
+
+            traffic_data = [{
+                'user_id': str(user['_id']),
+                'username': user.get('username'),
+                'port': user.get('port'),
+                'enabled': user.get('enable', True),
+                'traffic_used_gb': round(user.get('traffic_used', 0) / 1024**3, 3),
+                'traffic_limit_gb': round(user.get('traffic_limit', 0) / 1024**3, 2),
+                'updated_at': user['updated_at'].isoformat() if user.get('updated_at') else None,
+            } for user in users]
+
+            total_stats = list(db.users.aggregate([
+                {'$group': {
+                    '_id': None,
+                    'total_used': {'$sum': '$traffic_used'},
+                    'total_limit': {'$sum': '$traffic_limit'},
+                }}
+            ]))
+
+            now = datetime.utcnow()
+            total_traffic = {
+                'total_used_gb': round(total_stats[0]['total_used'] / 1024**3, 2) if total_stats else 0,
+                'total_limit_gb': round(total_stats[0]['total_limit'] / 1024**3, 2) if total_stats else 0,
+                'timestamp': now.isoformat(),
+            }
+
+            return self._apply({
+                'users': {user['user_id']: user for user in traffic_data},
+                'total': total_traffic,
+                'history': self._record_history(total_traffic['total_used_gb'], now),
+            })
+        except Exception as e:
+            logger.error(f"Error in traffic stream: {e}")
+            return f"data: {dumps({'type': 'error', 'message': str(e)})}\n\n"
+
+
+_broadcaster = None
+_broadcaster_pid = None
+_broadcaster_lock = threading.Lock()
+
+
+def get_traffic_broadcaster():
+    """Broadcaster текущего процесса; после fork (gunicorn) создается заново"""
+    global _broadcaster, _broadcaster_pid
+    with _broadcaster_lock:
+        if _broadcaster is None or _broadcaster_pid != os.getpid():
+            _broadcaster = TrafficBroadcaster()
+            _broadcaster_pid = os.getpid()
+        return _broadcaster
 
 
 def stream_response():
+    broadcaster = get_traffic_broadcaster()
+    subscriber = broadcaster.subscribe(request.headers.get('Last-Event-ID'))
+    if subscriber is None:
+        return jsonify({'success': False, 'message': 'Too many open streams, try again later'}), 503, {'Retry-After': '30'}
+
     def generate():
-        while True:
-            try:
-                if db is not None:
-                    users = list(db.users.find({}, {
-                        'username': 1,
-                        'traffic_used': 1,
-                        'traffic_limit': 1,
-                        'port': 1,
-                        'enable': 1,
-                        'updated_at': 1,
-                    }).sort('updated_at', -1).limit(10))
-
-                    traffic_data = [{
-                        'user_id': str(user['_id']),
-                        'username': user.get('username'),
-                        'port': user.get('port'),
-                        'enabled': user.get('enable', True),
-                        'traffic_used_gb': round(user.get('traffic_used', 0) / 1024**3, 3),
-                        'traffic_limit_gb': round(user.get('traffic_limit', 0) / 1024**3, 2),
-                        'updated_at': user.get('updated_at', datetime.utcnow()).isoformat(),
-                    } for user in users]
-
-                    total_stats = list(db.users.aggregate([
-                        {'$group': {
-                            '_id': None,
-                            'total_used': {'$sum': '$traffic_used'},
-                            'total_limit': {'$sum': '$traffic_limit'},
-                        }}
-                    ]))
-
-                    total_traffic = {
-                        'total_used_gb': round(total_stats[0]['total_used'] / 1024**3, 2) if total_stats else 0,
-                        'total_limit_gb': round(total_stats[0]['total_limit'] / 1024**3, 2) if total_stats else 0,
-                        'timestamp': datetime.utcnow().isoformat(),
-                    }
-
-                    traffic_history.append({
-                        'timestamp': datetime.utcnow(),
-                        'total_used_gb': total_traffic['total_used_gb'],
-                    })
-                    if len(traffic_history) > 100:
-                        traffic_history.pop(0)
-
-                    payload = {
-                        'type': 'traffic_update',
-                        'data': {
-                            'users': traffic_data,
-                            'total': total_traffic,
-                            'history': [{'timestamp': h['timestamp'].isoformat(), 'total_used_gb': h['total_used_gb']} for h in traffic_history[-20:]],
-                        },
-                    }
-                    yield f"data: {json.dumps(payload, cls=MongoJSONEncoder)}\n\n"
-
-                time.sleep(5)
-            except Exception as e:
-                logger.error(f"Error in traffic stream: {e}")
-                yield f"data: {json.dumps({'type': 'error', 'message': str(e)})}\n\n"
-                time.sleep(10)
+        try:
+            while True:
+                try:
+                    frame = subscriber.queue.get(timeout=broadcaster.interval * 3)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                if frame is None:
+                    yield f"data: {dumps({'type': 'error', 'message': 'Client too slow, reconnect'})}\n\n"
+                    return
+                yield frame
+        finally:
+            broadcaster.unsubscribe(subscriber)
 
     return Response(generate(), mimetype='text/event-stream')
 
@@ -85,7 +242,7 @@ def get_history(days: int):
         }},
         {'$sort': {'_id': 1}},
     ]
-    history = list(db.logs.aggregate(pipeline)) if db is not None else []
+    history = list(db.logs.aggregate(pipeline))
     return [{
         'date': item['_id'],
         'total_used_gb': round(item['total_used_gb'], 2),
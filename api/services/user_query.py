@@ -0,0 +1,264 @@
+import base64
+import re
+from datetime import datetime, timedelta
+
+from bson import ObjectId, json_util
+
+
+def build_user_filter(filters=None):
+    """Строит запрос MongoDB по фильтрам из API.
+
+    Поддерживаются: enable, role, expired, expires_within_days,
+    traffic_percent_gte, username_prefix. Условия объединяются через $and,
+    поэтому фильтры по одному полю (expired и expires_within_days) не
+    затирают друг друга.
+    """
+    filters = filters or {}
+    conditions = []
+    now = datetime.utcnow()
+
+    def number(key):
+        try:
+            return float(filters[key])
+        except (TypeError, ValueError):
+            raise ValueError(f'{key} must be a number')
+
+    if 'enable' in filters:
+        conditions.append({'enable': bool(filters['enable'])})
+
+    if filters.get('role'):
+        conditions.append({'role': str(filters['role'])})
+
+    if filters.get('expired') is True:
+        conditions.append({'expires_at': {'$lte': now}})
+    elif filters.get('expired') is False:
+        conditions.append({'$or': [{'expires_at': {'$gt': now}}, {'expires_at': None}]})
+
+    if filters.get('expires_within_days') is not None:
+        days = number('expires_within_days')
+        conditions.append({'expires_at': {'$gt': now, '$lte': now + timedelta(days=days)}})
+
+    if filters.get('traffic_percent_gte') is not None:
+        percent = number('traffic_percent_gte')
+        conditions.append({
+            'traffic_limit': {'$gt': 0},
+            '$expr': {'$gte': ['$traffic_used', {'$multiply': ['$traffic_limit', percent / 100]}]},
+        })
+
+    if filters.get('username_prefix'):
+        conditions.append({'username': {'$regex': '^' + re.escape(str(filters['username_prefix']))}})
+
+    if not conditions:
+        return {}
+    return conditions[0] if len(conditions) == 1 else {'$and': conditions}
+
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# Ключи сортировки: None — только по _id (порядок создания), строка — поле
+# документа (сортировку и курсор обслуживает индекс (поле, _id)), выражение —
+# вычисляемый ключ, который считается через $addFields для всей выборки и
+# индексом не обслуживается
+SORT_KEYS = {
+    'created': None,
+    'username': 'username',
+    'port': 'port',
+    'usage': 'traffic_used',
+    # Доля от лимита зависит от двух полей: не индексируется, сортировка
+    # проходит по всей отфильтрованной выборке
+    'usage_percent': {'$cond': [
+        {'$gt': [{'$ifNull': ['$traffic_limit', 0]}, 0]},
+        {'$divide': [{'$ifNull': ['$traffic_used', 0]}, '$traffic_limit']},
+        0,
+    ]},
+    'expiry': 'expires_at',
+    # Отключенные (enable: false) идут перед активными
+    'status': 'enable',
+}
+
+# Поля сортировки, где null означает «без ограничения»: такие документы идут
+# после всех значений при asc и перед ними при desc. MongoDB ставит null
+# первым, поэтому страница собирается из двух частей (со значением и без),
+# каждую обслуживает тот же индекс (поле, _id), а курсор с null указывает на
+# часть без значения
+NULLS_LAST = {'expires_at'}
+
+# Поля документа, которые можно запросить через fields
+USER_FIELDS = [
+    'username', 'email', 'port', 'method', 'enable', 'role',
+    'traffic_limit', 'traffic_used', 'expires_at', 'created_at', 'updated_at',
+]
+
+GB = 1024 ** 3
+
+
+def _derived_fields(now):
+    """Вычисляемые поля пользователя (выражения агрегации)"""
+    is_date = {'$eq': [{'$type': '$expires_at'}, 'date']}
+    return {
+        'expires_at': {'$cond': [
+            is_date,
+            {'$dateToString': {'date': '$expires_at', 'format': '%Y-%m-%dT%H:%M:%S.%L'}},
+            '$expires_at',
+        ]},
+        'days_remaining': {'$cond': [
+            is_date,
+            {'$max': [0, {'$floor': {'$divide': [{'$subtract': ['$expires_at', now]}, 86400000]}}]},
+            '$$REMOVE',
+        ]},
+        'traffic_used_gb': {'$round': [{'$divide': [{'$ifNull': ['$traffic_used', 0]}, GB]}, 2]},
+        'traffic_limit_gb': {'$round': [{'$divide': [{'$ifNull': ['$traffic_limit', 0]}, GB]}, 2]},
+        'traffic_percent': {'$cond': [
+            {'$gt': [{'$ifNull': ['$traffic_limit', 0]}, 0]},
+            {'$round': [{'$multiply': [{'$divide': [{'$ifNull': ['$traffic_used', 0]}, '$traffic_limit']}, 100]}, 1]},
+            0,
+        ]},
+        'is_active': {'$ifNull': ['$enable', True]},
+        'service_name': {'$cond': [
+            {'$eq': [{'$type': '$username'}, 'string']},
+            {'$concat': ['shadowsocks-', '$username', '.service']},
+            '$$REMOVE',
+        ]},
+    }
+
+
+def encode_cursor(sort_value, user_id):
+    data = json_util.dumps({'v': sort_value, 'id': user_id})
+    return base64.urlsafe_b64encode(data.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    try:
+        data = json_util.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+        return data.get('v'), ObjectId(data['id'])
+    except Exception:
+        raise ValueError('Invalid cursor')
+
+
+def filters_from_args(args):
+    """Фильтры build_user_filter из строки запроса"""
+    filters = {}
+    for key in ('enable', 'expired'):
+        if args.get(key) is not None:
+            filters[key] = args[key].lower() == 'true'
+    for key in ('role', 'username_prefix'):
+        if args.get(key):
+            filters[key] = args[key]
+    for key in ('expires_within_days', 'traffic_percent_gte'):
+        if args.get(key) is not None:
+            try:
+                filters[key] = float(args[key])
+            except ValueError:
+                raise ValueError(f'{key} must be a number')
+    return filters
+
+
+def build_users_pipeline(filters=None, sort='created', order='asc', limit=DEFAULT_PAGE_SIZE, cursor=None, fields=None, nulls=None):
+    """Конвейер агрегации для страницы пользователей.
+
+    Фильтр, сортировка и курсор применяются до $limit, вычисляемые поля
+    считаются только для документов страницы. Возвращает на один документ
+    больше limit, чтобы понять, есть ли следующая страница.
+
+    nulls для полей из NULLS_LAST выбирает часть выборки: True — документы
+    без значения поля, False — со значением, None — все.
+    """
+    if sort not in SORT_KEYS:
+        raise ValueError(f'Invalid sort. Must be one of: {", ".join(SORT_KEYS)}')
+    if order not in ('asc', 'desc'):
+        raise ValueError('Invalid order. Must be asc or desc')
+    derived = _derived_fields(datetime.utcnow())
+    if fields is not None:
+        unknown = [f for f in fields if f not in USER_FIELDS and f not in derived]
+        if unknown:
+            raise ValueError(f'Unknown fields: {", ".join(unknown)}')
+
+    direction = 1 if order == 'asc' else -1
+    compare = '$gt' if direction == 1 else '$lt'
+    sort_key = SORT_KEYS[sort]
+    # Поле, по которому идут $sort и курсор: само поле документа или _sort
+    sort_field = sort_key if isinstance(sort_key, str) else '_sort'
+
+    pipeline = [{'$match': build_user_filter(filters)}]
+    if nulls is not None:
+        pipeline.append({'$match': {sort_field: None} if nulls else {sort_field: {'$ne': None}}})
+    if isinstance(sort_key, dict):
+        pipeline.append({'$addFields': {'_sort': sort_key}})
+
+    if cursor:
+        last_value, last_id = decode_cursor(cursor)
+        if sort_key is None:
+            pipeline.append({'$match': {'_id': {compare: last_id}}})
+        else:
+            pipeline.append({'$match': {'$or': [
+                {sort_field: {compare: last_value}},
+                {sort_field: last_value, '_id': {compare: last_id}},
+            ]}})
+
+    pipeline.append({'$sort': {sort_field: direction, '_id': direction} if sort_key is not None else {'_id': direction}})
+    pipeline.append({'$limit': limit + 1})
+
+    # Значение ключа для курсора следующей страницы; для поля документа —
+    # копия до вычисляемых полей, которые могут его переопределить
+    sort_value = {} if sort_key is None else {'_sort': '$' + sort_field}
+    if fields is None:
+        pipeline.append({'$addFields': dict(derived, _id={'$toString': '$_id'}, **sort_value)})
+        pipeline.append({'$project': {'password': 0}})
+    else:
+        projection = {'_id': {'$toString': '$_id'}, **sort_value}
+        for field in fields:
+            projection[field] = derived.get(field, 1)
+        pipeline.append({'$project': projection})
+    return pipeline
+
+
+def _page_parts(sort, order, cursor):
+    """Части выборки (nulls, cursor) в порядке выдачи для build_users_pipeline"""
+    if SORT_KEYS.get(sort) not in NULLS_LAST:
+        return [(None, cursor)]
+    parts = [False, True] if order == 'asc' else [True, False]
+    if cursor:
+        last_value, _ = decode_cursor(cursor)
+        start = parts.index(last_value is None)
+        return [(parts[start], cursor)] + [(nulls, None) for nulls in parts[start + 1:]]
+    return [(nulls, None) for nulls in parts]
+
+
+def list_users_page(db, filters=None, sort='created', order='asc', limit=None, cursor=None, fields=None, with_total=False):
+    """Страница пользователей: users, next_cursor и при запросе total"""
+    limit = max(1, min(int(limit or DEFAULT_PAGE_SIZE), MAX_PAGE_SIZE))
+    users = []
+    for nulls, part_cursor in _page_parts(sort, order, cursor):
+        pipeline = build_users_pipeline(filters, sort, order, limit - len(users), part_cursor, fields, nulls)
+        users.extend(db.users.aggregate(pipeline))
+        if len(users) > limit:
+            break
+
+    next_cursor = None
+    if len(users) > limit:
+        users = users[:limit]
+        last = users[-1]
+        next_cursor = encode_cursor(last.get('_sort'), last['_id'])
+    for user in users:
+        user.pop('_sort', None)
+
+    page = {'users': users, 'next_cursor': next_cursor}
+    if with_total:
+        page['total'] = db.users.count_documents(build_user_filter(filters))
+    return page
+
+
+def ensure_user_indexes(db):
+    """Индексы под фильтры и сортировки списка пользователей и проверку уведомлений"""
+    # Сортировки по полю документа: (поле, _id) обслуживает и $sort, и курсор
+    db.users.create_index([('enable', 1), ('_id', 1)])
+    db.users.create_index([('expires_at', 1), ('_id', 1)])
+    db.users.create_index([('traffic_used', 1), ('_id', 1)])
+    db.users.create_index([('username', 1), ('_id', 1)])
+    db.users.create_index([('port', 1), ('_id', 1)])
+    db.users.create_index('subscription_token', unique=True, sparse=True)
+    # Опрос живых обновлений без change streams и последние активные в потоке трафика
+    db.users.create_index([('updated_at', 1)])
+    # Проверка скорого истечения: равенство по enable и флагу, затем диапазон
+    db.users.create_index([('enable', 1), ('notified_expire', 1), ('expires_at', 1)])
@@ -0,0 +1,139 @@
+import hashlib
+import os
+import threading
+import time
+from functools import wraps
+
+from flask import Response, make_response, request
+from pymongo.errors import DuplicateKeyError
+
+from api.common import db
+
+# Версии коллекций для ETag: clusterTime последнего изменения из change stream.
+# Общая часть хранится в MongoDB (collection_versions): воркеры поднимают ее
+# через $max по прочитанным событиям, а новый воркер берет версии оттуда и
+# дочитывает поток с самой поздней из них. Поэтому воркеры, видевшие одни и
+# те же изменения, отдают одинаковые ETag.
+# В режиме опроса (MongoDB без replica set) изменения не отслеживаются:
+# collection_version возвращает None и ответы идут без ETag (всегда 200).
+_versions = {}
+# Версии, еще не записанные в collection_versions
+_pending = {}
+_lock = threading.Lock()
+
+# Сохраненная версия старше этого не дочитывается — база версий обновляется
+MAX_REPLAY_AGE = 24 * 3600
+
+
+def _format(cluster_time):
+    return f"{cluster_time.time}.{cluster_time.inc}"
+
+
+def rotate(collections):
+    """Новая общая база версий, когда пропущенные изменения не дочитать"""
+    for collection in collections:
+        db.collection_versions.update_one(
+            {'_id': collection},
+            {'$currentDate': {'cluster_time': {'$type': 'timestamp'}}},
+            upsert=True,
+        )
+
+
+def load(collections):
+    """Версии из общего хранилища при открытии потока.
+
+    Возвращает clusterTime, с которого поток нужно читать, чтобы не пропустить
+    изменения после сохраненных версий.
+    """
+    stored = {doc['_id']: doc['cluster_time'] for doc in db.collection_versions.find({'_id': {'$in': list(collections)}})}
+    start = max(stored.values()) if stored else None
+    if start is not None and start.time < time.time() - MAX_REPLAY_AGE:
+        start = None
+    missing = [collection for collection in collections if collection not in stored]
+    if start is None or missing:
+        rotate(collections if start is None else missing)
+        stored = {doc['_id']: doc['cluster_time'] for doc in db.collection_versions.find({'_id': {'$in': list(collections)}})}
+        if start is None:
+            # Изменения после новой базы дочитываются из потока
+            start = min(stored.values())
+    with _lock:
+        _versions.clear()
+        _pending.clear()
+        _versions.update({collection: _format(cluster_time) for collection, cluster_time in stored.items()})
+    return start
+
+
+def bump(collection, cluster_time):
+    """Изменение из потока: локальная версия сразу, общая — при flush"""
+    with _lock:
+        if cluster_time is None:
+            _versions[collection] = os.urandom(4).hex()
+            return
+        _versions[collection] = _format(cluster_time)
+        _pending[collection] = cluster_time
+
+
+def flush():
+    """Записывает накопленные версии в порядке clusterTime.
+
+    При обрыве посередине самая поздняя сохраненная версия не опережает
+    несохраненные: новый воркер дочитает их из потока.
+    """
+    with _lock:
+        pending = sorted(_pending.items(), key=lambda item: item[1])
+        _pending.clear()
+    for collection, cluster_time in pending:
+        try:
+            db.collection_versions.update_one({'_id': collection}, {'$max': {'cluster_time': cluster_time}}, upsert=True)
+        except DuplicateKeyError:
+            # Документ одновременно вставил другой воркер
+            db.collection_versions.update_one({'_id': collection}, {'$max': {'cluster_time': cluster_time}})
+
+
+def invalidate(*collections):
+    """Запись из этого воркера: локальная версия меняется сразу, не дожидаясь
+    события потока, чтобы следующий запрос не получил 304 со старыми данными"""
+    with _lock:
+        for collection in collections:
+            _versions[collection] = f"{_versions.get(collection, '')}~{os.urandom(4).hex()}"
+
+
+def collection_version(collection):
+    """Версия коллекции или None, если изменения не отслеживаются (режим опроса)"""
+    from api.services.live_updates import get_live_updates
+
+    live = get_live_updates()
+    live.start()
+    if live.mode != 'change_stream':
+        return None
+    with _lock:
+        return _versions.get(collection)
+
+
+def time_bucket(seconds):
+    """Часть версии для данных, которые меняются со временем (days_remaining)"""
+    return str(int(time.time() // seconds))
+
+
+def conditional(version_fn):
+    """ETag по версии ресурса: If-None-Match отвечается 304 до запроса к БД.
+
+    version_fn возвращает строку версии или None (тогда ответ без ETag).
+    ETag учитывает путь и параметры запроса.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            version = version_fn()
+            if version is None:
+                return view(*args, **kwargs)
+            etag = hashlib.sha1(f"{version}|{request.full_path}".encode('utf-8')).hexdigest()
+            headers = {'ETag': f'"{etag}"', 'Cache-Control': 'no-cache'}
+            if request.if_none_match.contains(etag):
+                return Response(status=304, headers=headers)
+            response = make_response(view(*args, **kwargs))
+            if response.status_code == 200:
+                response.headers.extend(headers)
+            return response
+        return wrapper
+    return decorator
@@ -1,17 +1,19 @@
+import os
 import time
 import subprocess
 import logging
-from pymongo import MongoClient
+from pymongo import ReturnDocument
 from datetime import datetime, timezone
-from api.config import Config
+from api.database import db
+from api.services.traffic_alerts import ALERT_USER_FIELDS, crossed_threshold, record_traffic_alert
 
 logging.basicConfig(level=logging.INFO)
 log = logging.getLogger("traffic")
 
 class TrafficMonitor:
     def __init__(self):
-        self.client = MongoClient(Config.MONGO_URI)
-        self.db = self.client[Config.MONGO_DB]
+        # Общий модуль подключения: пул с настройками из Config
+        self.db = db
         self.users = self.db.users
         self.connections = self.db.connections
 
@@ -50,14 +52,21 @@ class TrafficMonitor:
             if delta <= 0:
                 continue
 
-            user = self.users.find_one({"port": port})
+            # Приращение и чтение нового значения одной операцией: пороги
+            # предупреждений проверяются сразу, без отдельного обхода пользователей
+            user = self.users.find_one_and_update(
+                {"port": port},
+                # updated_at нужен опросу живых обновлений без change streams
+                {"$inc": {"traffic_used": delta}, "$set": {"updated_at": datetime.utcnow()}},
+                projection=ALERT_USER_FIELDS,
+                return_document=ReturnDocument.AFTER
+            )
             if not user:
                 continue
 
-            self.users.update_one(
-                {"_id": user["_id"]},
-                {"$inc": {"traffic_used": delta}}
-            )
+            threshold = crossed_threshold(user)
+            if threshold is not None:
+                record_traffic_alert(user, threshold, now)
 
             self.connections.insert_one({
                 "user_id": user["_id"],
@@ -70,6 +79,12 @@ class TrafficMonitor:
             log.info(f"{user['username']} {port} +{delta/1024/1024:.2f} MB")
 
         self.last_counters = current
+        # Отметка для /api/health/ready: по ней видно отставание монитора
+        self.db.heartbeats.update_one(
+            {"_id": "traffic_monitor"},
+            {"$set": {"updated_at": datetime.utcnow(), "pid": os.getpid()}},
+            upsert=True
+        )
 
     def run(self):
         log.info("Traffic monitor started")
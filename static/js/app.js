@@ -1,10 +1,12 @@
 // app.js - Основная логика приложения Shadowsocks Manager
 
 // ==================== ГЛОБАЛЬНЫЕ ПЕРЕМЕННЫЕ ====================
-let eventSource = null;
+let liveSource = null;
 let trafficChart = null;
 let historyChart = null;
 let liveTrafficData = [];
+let trafficState = null; // Состояние потока трафика: снимок + примененные дельты
+let jobsState = {}; // Длительные операции из темы jobs по id
 let usersData = []; // Глобальные данные пользователей
 
 // Базовый URL API
@@ -14,6 +16,7 @@ const API_BASE = window.location.origin;
 const API_ENDPOINTS = {
     // GET запросы
     health: '/api/health',
+    dashboard: '/api/dashboard',
     stats: '/api/stats',
     users: '/api/users',
     'services.status': '/api/services/status',
@@ -29,7 +32,7 @@ const API_ENDPOINTS = {
     'user.add': '/api/users',
     
     // SSE поток
-    'traffic.stream': '/api/traffic-stream',
+    'live.stream': '/api/live',
     
     // Service control
     'service.control': '/api/service/control'
@@ -51,6 +54,33 @@ function getApiUrl(endpointKey, id = null) {
     return API_BASE + endpoint;
 }
 
+// Ответы с ETag: при повторном запросе отправляем If-None-Match,
+// на 304 возвращаем сохраненные данные без повторного разбора
+const validatedResponses = new Map();
+
+async function fetchWithValidators(url) {
+    const cached = validatedResponses.get(url);
+    const response = await fetch(url, {
+        headers: cached ? { 'If-None-Match': cached.etag } : {}
+    });
+    
+    if (response.status === 304 && cached) {
+        return { ok: true, status: 304, notModified: true, json: async () => cached.data };
+    }
+    if (!response.ok) {
+        return { ok: false, status: response.status, statusText: response.statusText, notModified: false, json: () => response.json() };
+    }
+    
+    const data = await response.json();
+    const etag = response.headers.get('ETag');
+    if (etag) {
+        validatedResponses.set(url, { etag: etag, data: data });
+    } else {
+        validatedResponses.delete(url);
+    }
+    return { ok: true, status: response.status, notModified: false, json: async () => data };
+}
+
 // Функция для получения URL конфигурации пользователя
 function getUserConfigUrl(userId) {
     return `${API_BASE}/api/users/${userId}/config`;
@@ -86,12 +116,6 @@ function getRestartServiceUrl(userId) {
     return `${API_BASE}/api/users/${userId}/service/restart`;
 }
 
-const UPDATE_INTERVALS = {
-    stats: 30000,      // 30 секунд
-    services: 60000,   // 1 минута
-    notifications: 300000 // 5 минут
-};
-
 // ==================== ИНИЦИАЛИЗАЦИЯ ====================
 
 document.addEventListener('DOMContentLoaded', function() {
@@ -102,18 +126,16 @@ function initApp() {
     // Проверяем соединение с API
     checkConnection().then(connected => {
         if (connected) {
-            // Загружаем начальные данные
-            loadDashboard();
-            startTrafficStream();
-            loadActivityLog();
-            loadTrafficHistory();
-            checkNotifications();
+            // Загружаем начальные данные одним запросом
+            bootstrapDashboard();
             
-            // Настраиваем периодическое обновление
-            setupAutoRefresh();
+            // Все обновления дальше приходят по одному потоку /api/live
+            registerDashboardTopics();
+            startLiveUpdates();
             
             // Настраиваем обработчики событий
             setupEventListeners();
+            setupUsersTable();
             
             // Загружаем настройки экспорта
             loadExportSettings();
@@ -136,20 +158,6 @@ async function checkConnection() {
     }
 }
 
-function setupAutoRefresh() {
-    // Обновляем статистику каждые 30 секунд
-    setInterval(loadStats, UPDATE_INTERVALS.stats);
-    
-    // Обновляем обзор служб каждую минуту
-    setInterval(loadServicesOverview, UPDATE_INTERVALS.services);
-    
-    // Проверяем уведомления каждые 5 минут
-    setInterval(checkNotifications, UPDATE_INTERVALS.notifications);
-    
-    // Проверяем здоровье сервера каждую минуту
-    setInterval(checkServerHealth, 60000);
-}
-
 function setupEventListeners() {
     // Закрытие панели уведомлений при клике вне её
     document.addEventListener('click', function(event) {
@@ -192,23 +200,18 @@ function setServerStatusOffline() {
     if (liveStatus) liveStatus.textContent = 'Real-time: Disconnected';
 }
 
-async function checkServerHealth() {
-    try {
-        const response = await fetch(getApiUrl('health'));
-        if (response.ok) {
-            const data = await response.json();
-            if (data.status === 'healthy') {
-                // Сервер онлайн
-                const statusEl = document.getElementById('server-status');
-                if (statusEl) {
-                    statusEl.className = 'server-status status-online';
-                    statusEl.innerHTML = '<i class="fas fa-circle"></i> Online';
-                }
-            }
-        }
-    } catch (error) {
-        setServerStatusOffline();
+// Состояние сервера определяется открытым потоком /api/live, без опроса /api/health
+function setServerStatusOnline() {
+    const statusEl = document.getElementById('server-status');
+    if (statusEl) {
+        statusEl.className = 'server-status status-online';
+        statusEl.innerHTML = '<i class="fas fa-circle"></i> Online';
     }
+    
+    const liveIndicator = document.getElementById('live-indicator');
+    const liveStatus = document.getElementById('live-status');
+    if (liveIndicator) liveIndicator.style.background = '#28a745';
+    if (liveStatus) liveStatus.textContent = 'Real-time: Connected';
 }
 
 // ==================== ДАШБОРД ====================
@@ -225,10 +228,37 @@ async function loadDashboard() {
     }
 }
 
+// Первый экран из /api/dashboard; при ошибке — отдельные запросы
+async function bootstrapDashboard() {
+    try {
+        const response = await fetch(getApiUrl('dashboard'));
+        if (!response.ok) throw new Error('Failed to fetch dashboard');
+        
+        const data = await response.json();
+        if (!data.success) throw new Error(data.message || 'Failed to load dashboard');
+        
+        updateStatsDisplay(data.stats);
+        if (typeof window.updateServicesOverview === 'function') {
+            window.updateServicesOverview(data.services.user_services || []);
+        }
+        updateActivityLog(data.activity || []);
+        if (data.traffic_history && data.traffic_history.length > 0) {
+            updateHistoryChart(data.traffic_history);
+        }
+        
+        // Первая страница таблицы; остальные догружаются при прокрутке
+        seedUsersView(data.users, data.stats.users ? data.stats.users.total : null);
+    } catch (error) {
+        console.error('Error bootstrapping dashboard:', error);
+        await Promise.all([loadDashboard(), loadActivityLog(), loadTrafficHistory()]);
+    }
+}
+
 async function loadStats() {
     try {
-        const response = await fetch(getApiUrl('stats'));
+        const response = await fetchWithValidators(getApiUrl('stats'));
         if (!response.ok) throw new Error('Failed to fetch stats');
+        if (response.notModified) return;
         
         const data = await response.json();
         
@@ -348,43 +378,273 @@ function updateStatsDisplay(stats) {
     }
 }
 
-async function loadUsers() {
-    try {
-        const response = await fetch(getApiUrl('users'));
+// Загрузить всех пользователей, проходя по страницам /api/users
+// (начиная с cursor, если первая страница уже получена)
+async function fetchAllUsers(pageSize = 500, cursor = null) {
+    let users = [];
+    let notModified = true;
+    do {
+        const params = new URLSearchParams({ limit: pageSize });
+        if (cursor) params.set('cursor', cursor);
+        const response = await fetchWithValidators(`${getApiUrl('users')}?${params}`);
         if (!response.ok) throw new Error('Failed to fetch users');
         
         const data = await response.json();
-        console.log('Users data loaded:', data);
-        
-        if (data.success) {
-            usersData = data.users || []; // Сохраняем локально
-            window.usersData = usersData; // Сохраняем глобально для доступа из других скриптов
-            console.log('window.usersData set to:', window.usersData);
-            updateUsersDisplay(usersData);
-        }
+        if (!data.success) return data;
+        notModified = notModified && response.notModified;
+        users = users.concat(data.users || []);
+        cursor = data.next_cursor;
+    } while (cursor);
+    return { success: true, users: users, notModified: notModified };
+}
+
+// ==================== ТАБЛИЦА ПОЛЬЗОВАТЕЛЕЙ ====================
+// Виртуальная таблица: в DOM только видимые строки, страницы догружаются
+// по курсору /api/users при прокрутке, фильтр и сортировка — на сервере,
+// события из /api/live меняют строки на месте
+
+const USERS_PAGE_SIZE = 500;
+const USER_ROWS_OVERSCAN = 10;
+const USER_TABLE_FIELDS = [
+    'username', 'email', 'role', 'port', 'enable', 'service_name',
+    'traffic_used', 'traffic_limit', 'traffic_used_gb', 'traffic_limit_gb', 'traffic_percent',
+    'expires_at', 'days_remaining'
+];
+
+// Фильтры статуса -> параметры build_user_filter
+const USER_STATUS_FILTERS = {
+    active: { enable: 'true', expired: 'false' },
+    inactive: { enable: 'false' },
+    expired: { expired: 'true' },
+    expiring: { expires_within_days: '7' },
+    high_traffic: { traffic_percent_gte: '80' }
+};
+
+const usersView = {
+    rows: [],            // загруженные строки по порядку сервера
+    index: new Map(),    // _id -> позиция в rows
+    total: null,         // всего по текущему фильтру
+    cursor: null,        // курсор следующей страницы
+    done: false,         // загружены все страницы
+    loading: null,       // текущий запрос страницы
+    generation: 0,       // меняется при сбросе: ответы старых запросов отбрасываются
+    rowHeight: 76,       // уточняется по первой отрисованной строке
+    rendered: { start: -1, end: -1 },
+    query: { sort: 'created', order: 'asc', search: '', status: '' }
+};
+
+function usersQueryParams() {
+    const params = new URLSearchParams({
+        limit: USERS_PAGE_SIZE,
+        sort: usersView.query.sort,
+        order: usersView.query.order,
+        fields: USER_TABLE_FIELDS.join(',')
+    });
+    if (usersView.query.search) params.set('username_prefix', usersView.query.search);
+    Object.entries(USER_STATUS_FILTERS[usersView.query.status] || {}).forEach(([key, value]) => params.set(key, value));
+    return params;
+}
+
+function setUsersRows(rows) {
+    usersView.rows = rows;
+    usersView.index = new Map(rows.map((user, i) => [user._id, i]));
+    usersData = rows;
+    window.usersData = rows; // Загруженные строки для других скриптов
+}
+
+// Первая страница из /api/dashboard (сортировка и фильтр по умолчанию)
+function seedUsersView(page, total) {
+    usersView.generation++;
+    usersView.loading = null;
+    setUsersRows(page.users || []);
+    usersView.cursor = page.next_cursor;
+    usersView.done = !page.next_cursor;
+    usersView.total = usersView.done ? usersView.rows.length : total;
+    renderUsersWindow(true);
+}
+
+// Сбросить загруженные страницы и перечитать с сервера, сохранив прокрутку
+function reloadUsersView() {
+    usersView.generation++;
+    usersView.loading = null;
+    setUsersRows([]);
+    usersView.cursor = null;
+    usersView.done = false;
+    usersView.total = null;
+    return loadNextUsersPage();
+}
+
+async function loadUsers() {
+    try {
+        await reloadUsersView();
     } catch (error) {
         console.error('Error loading users:', error);
     }
 }
 
-function updateUsersDisplay(users) {
+function loadNextUsersPage() {
+    if (usersView.done) return Promise.resolve();
+    if (usersView.loading) return usersView.loading;
+    
+    const generation = usersView.generation;
+    const params = usersQueryParams();
+    if (usersView.cursor) params.set('cursor', usersView.cursor);
+    if (usersView.total === null) params.set('count', 'true');
+    
+    usersView.loading = (async () => {
+        try {
+            const response = await fetch(`${getApiUrl('users')}?${params}`);
+            const data = await response.json();
+            if (generation !== usersView.generation) return;
+            if (!data.success) throw new Error(data.message || 'Failed to fetch users');
+            
+            const start = usersView.rows.length;
+            (data.users || []).forEach((user, i) => {
+                usersView.rows.push(user);
+                usersView.index.set(user._id, start + i);
+            });
+            usersView.cursor = data.next_cursor;
+            usersView.done = !data.next_cursor;
+            if (data.total !== undefined) usersView.total = data.total;
+            if (usersView.done) usersView.total = usersView.rows.length;
+        } finally {
+            if (generation === usersView.generation) {
+                usersView.loading = null;
+                renderUsersWindow(true);
+            }
+        }
+    })();
+    return usersView.loading;
+}
+
+// Нарисовать только видимые строки; недостающие страницы догружаются
+function renderUsersWindow(force = false) {
     const tbody = document.getElementById('users-body');
-    if (!tbody) return;
+    const container = document.getElementById('users-scroll');
+    if (!tbody || !container) return;
     
-    if (!users || users.length === 0) {
+    const count = usersView.total !== null ? usersView.total : usersView.rows.length;
+    updateUsersCount(count);
+    
+    if (count === 0 && usersView.done) {
+        usersView.rendered = { start: -1, end: -1 };
         tbody.innerHTML = `
             <tr>
                 <td colspan="7" class="no-data">
                     <i class="fas fa-users"></i>
-                    <p>No users found. Click "Add User" to create your first user.</p>
+                    <p>${usersView.query.search || usersView.query.status ? 'No users match the filter.' : 'No users found. Click "Add User" to create your first user.'}</p>
                 </td>
             </tr>
         `;
-    } else {
-        tbody.innerHTML = users.map(user => createUserRow(user)).join('');
+        return;
+    }
+    
+    const rowHeight = usersView.rowHeight;
+    const visible = Math.ceil((container.clientHeight || 600) / rowHeight);
+    const start = Math.max(0, Math.floor(container.scrollTop / rowHeight) - USER_ROWS_OVERSCAN);
+    const end = Math.min(count, start + visible + 2 * USER_ROWS_OVERSCAN);
+    
+    if (!force && start === usersView.rendered.start && end === usersView.rendered.end) return;
+    usersView.rendered = { start, end };
+    
+    const html = [`<tr class="users-spacer" style="height: ${start * rowHeight}px"><td colspan="7"></td></tr>`];
+    for (let i = start; i < end; i++) {
+        const user = usersView.rows[i];
+        html.push(user ? createUserRow(user) : `
+            <tr class="user-row user-row-placeholder" style="height: ${rowHeight}px">
+                <td colspan="7"><i class="fas fa-spinner fa-spin"></i> Loading...</td>
+            </tr>
+        `);
+    }
+    html.push(`<tr class="users-spacer" style="height: ${(count - end) * rowHeight}px"><td colspan="7"></td></tr>`);
+    tbody.innerHTML = html.join('');
+    
+    // Высота строки берется из отрисованной строки, чтобы полосы прокрутки совпадали
+    const firstRow = tbody.querySelector('tr.user-row:not(.user-row-placeholder)');
+    if (firstRow && Math.abs(firstRow.offsetHeight - rowHeight) > 1) {
+        usersView.rowHeight = firstRow.offsetHeight;
+        renderUsersWindow(true);
+        return;
+    }
+    
+    if (end > usersView.rows.length && !usersView.done) {
+        loadNextUsersPage().catch(error => console.error('Error loading users:', error));
     }
 }
 
+function updateUsersCount(count) {
+    const counter = document.getElementById('users-count');
+    if (counter) {
+        counter.textContent = usersView.done || usersView.total !== null
+            ? `${count} user${count === 1 ? '' : 's'}`
+            : `${usersView.rows.length}+ users`;
+    }
+}
+
+// Перерисовать одну строку, если она сейчас в DOM
+function patchUserRow(userId) {
+    const position = usersView.index.get(userId);
+    if (position === undefined || position < usersView.rendered.start || position >= usersView.rendered.end) return;
+    const row = document.querySelector(`#users-body tr[data-user-id="${userId}"]`);
+    if (row) row.outerHTML = createUserRow(usersView.rows[position]);
+}
+
+function removeUserRow(userId) {
+    const position = usersView.index.get(userId);
+    if (position === undefined) return;
+    usersView.rows.splice(position, 1);
+    setUsersRows(usersView.rows);
+    if (usersView.total !== null) usersView.total = Math.max(0, usersView.total - 1);
+    renderUsersWindow(true);
+}
+
+let usersSearchTimer = null;
+function onUsersSearch(value) {
+    clearTimeout(usersSearchTimer);
+    usersSearchTimer = setTimeout(() => {
+        usersView.query.search = value.trim();
+        resetUsersScroll();
+    }, 300);
+}
+
+function setUsersFilter(name, value) {
+    usersView.query[name] = value;
+    resetUsersScroll();
+}
+
+function setUsersSort(sort) {
+    usersView.query.sort = sort;
+    resetUsersScroll();
+}
+
+function toggleUsersOrder() {
+    usersView.query.order = usersView.query.order === 'asc' ? 'desc' : 'asc';
+    const icon = document.querySelector('#users-order i');
+    if (icon) icon.className = usersView.query.order === 'asc' ? 'fas fa-sort-amount-down-alt' : 'fas fa-sort-amount-down';
+    resetUsersScroll();
+}
+
+// Новый запрос к серверу: прокрутка в начало
+function resetUsersScroll() {
+    const container = document.getElementById('users-scroll');
+    if (container) container.scrollTop = 0;
+    loadUsers();
+}
+
+function setupUsersTable() {
+    const container = document.getElementById('users-scroll');
+    if (!container) return;
+    let frame = null;
+    container.addEventListener('scroll', () => {
+        if (frame) return;
+        frame = requestAnimationFrame(() => {
+            frame = null;
+            renderUsersWindow();
+        });
+    });
+    window.addEventListener('resize', () => renderUsersWindow());
+}
+
 function createUserRow(user) {
     const trafficPercent = Math.min(user.traffic_percent || 0, 100);
     const trafficColor = trafficPercent > 80 ? '#dc3545' : '#666';
@@ -393,7 +653,7 @@ function createUserRow(user) {
     const isAdmin = user.role === 'admin';
     
     return `
-        <tr>
+        <tr class="user-row" data-user-id="${user._id}">
             <td>
                 <strong>${user.username}</strong>
                 ${user.email ? `<br><small class="user-email">${user.email}</small>` : ''}
@@ -463,8 +723,8 @@ function createUserRow(user) {
 
 async function loadServicesOverview() {
     try {
-        const response = await fetch(getApiUrl('services.status'));
-        if (!response.ok) return;
+        const response = await fetchWithValidators(getApiUrl('services.status'));
+        if (!response.ok || response.notModified) return;
         
         const data = await response.json();
         
@@ -481,49 +741,197 @@ async function loadServicesOverview() {
 
 // ==================== МОНИТОРИНГ ====================
 
-function startTrafficStream() {
-    if (eventSource) {
-        eventSource.close();
+// ==================== ЖИВЫЕ ОБНОВЛЕНИЯ ====================
+
+const liveRefreshTimers = {};
+
+// Отложенный вызов: пачка событий приводит к одному обновлению
+function scheduleLiveRefresh(key, fn, delay = 500) {
+    if (liveRefreshTimers[key]) return;
+    liveRefreshTimers[key] = setTimeout(() => {
+        delete liveRefreshTimers[key];
+        fn();
+    }, delay);
+}
+
+// Пересчитать вычисляемые поля пользователя после изменения из потока
+function applyUserFields(user, fields) {
+    Object.assign(user, fields);
+    const gb = 1024 ** 3;
+    user.traffic_used_gb = Math.round((user.traffic_used || 0) / gb * 100) / 100;
+    user.traffic_limit_gb = Math.round((user.traffic_limit || 0) / gb * 100) / 100;
+    user.traffic_percent = user.traffic_limit > 0
+        ? Math.round((user.traffic_used || 0) / user.traffic_limit * 1000) / 10
+        : 0;
+    user.is_active = user.enable !== false;
+    if (user.expires_at) {
+        const msLeft = new Date(user.expires_at) - Date.now();
+        user.days_remaining = Math.max(0, Math.floor(msLeft / 86400000));
+    }
+}
+
+// Обработчики тем общего потока: тема -> [{handler, resync}]
+const liveHandlers = {};
+
+// Подписаться на тему /api/live. resync вызывается при (пере)подключении
+// и по событию resync, когда данные нужно перечитать целиком
+function onLive(topic, handler, resync = null) {
+    (liveHandlers[topic] = liveHandlers[topic] || []).push({ handler, resync });
+    if (liveSource) startLiveUpdates();
+}
+
+function resyncLiveTopics() {
+    Object.keys(liveHandlers).forEach(topic => {
+        liveHandlers[topic].forEach(({ resync }, index) => {
+            if (resync) scheduleLiveRefresh(`resync:${topic}:${index}`, resync);
+        });
+    });
+}
+
+function startLiveUpdates() {
+    if (liveSource) {
+        liveSource.close();
     }
     
-    eventSource = new EventSource(getApiUrl('traffic.stream'));
+    // Одно соединение на вкладку: сервер шлет только события выбранных тем
+    const topics = Object.keys(liveHandlers);
+    liveSource = new EventSource(`${getApiUrl('live.stream')}?topics=${topics.join(',')}`);
     
-    eventSource.onopen = function() {
-        const indicator = document.getElementById('live-indicator');
-        const status = document.getElementById('live-status');
-        if (indicator) indicator.style.background = '#28a745';
-        if (status) status.textContent = 'Real-time: Connected';
-    };
+    topics.forEach(topic => {
+        liveSource.addEventListener(topic, function(event) {
+            let data;
+            try {
+                data = JSON.parse(event.data);
+            } catch (error) {
+                console.error('Error parsing live update:', error);
+                return;
+            }
+            liveHandlers[topic].forEach(({ handler }) => {
+                try {
+                    handler(data);
+                } catch (error) {
+                    console.error(`Error processing live ${topic} update:`, error);
+                }
+            });
+        });
+    });
     
-    eventSource.onmessage = function(event) {
+    // Без имени приходят только hello и resync
+    liveSource.onmessage = function(event) {
         try {
             const data = JSON.parse(event.data);
-            
-            if (data.type === 'traffic_update') {
-                liveTrafficData = data.data.history || [];
-                updateTrafficChart();
-                updateLiveTrafficDisplay(data.data.users || []);
-            }
+            if (data.type === 'resync') resyncLiveTopics();
         } catch (error) {
-            console.error('Error processing traffic stream:', error);
+            console.error('Error processing live update:', error);
         }
     };
     
-    eventSource.onerror = function() {
-        const indicator = document.getElementById('live-indicator');
-        const status = document.getElementById('live-status');
-        if (indicator) indicator.style.background = '#dc3545';
-        if (status) status.textContent = 'Real-time: Disconnected';
+    // EventSource переподключается сам; после обрыва данные перечитываются
+    liveSource.onopen = function() {
+        setServerStatusOnline();
+        resyncLiveTopics();
+    };
+    
+    liveSource.onerror = function() {
+        setServerStatusOffline();
         
-        // Попробуем переподключиться через 5 секунд
-        setTimeout(() => {
-            if (eventSource && eventSource.readyState === EventSource.CLOSED) {
-                startTrafficStream();
-            }
-        }, 5000);
+        // Соединение закрыто окончательно (например, 503) — пробуем позже
+        if (liveSource.readyState === EventSource.CLOSED) {
+            const closed = liveSource;
+            setTimeout(() => {
+                if (liveSource === closed) startLiveUpdates();
+            }, 5000);
+        }
     };
 }
 
+// Темы, которые нужны дашборду
+function registerDashboardTopics() {
+    onLive('users', function(data) {
+        switch (data.type) {
+            case 'user_updated': {
+                // Незагруженные строки придут свежими со своей страницей.
+                // Позиция строки при сортировке по изменившемуся полю
+                // уточнится при следующей перезагрузке таблицы
+                const position = usersView.index.get(data.id);
+                if (position !== undefined) {
+                    applyUserFields(usersView.rows[position], data.fields);
+                    patchUserRow(data.id);
+                }
+                break;
+            }
+            case 'user_deleted':
+                removeUserRow(data.id);
+                break;
+            case 'user_added':
+                // Место новой строки зависит от фильтра и сортировки на сервере
+                scheduleLiveRefresh('users', loadUsers, 1000);
+                break;
+        }
+    }, loadUsers);
+    
+    onLive('stats', () => scheduleLiveRefresh('stats', loadStats), loadStats);
+    
+    onLive('traffic', function(data) {
+        if (data.type === 'traffic_snapshot' || data.type === 'traffic_delta') {
+            applyTrafficFrame(data);
+        }
+    });
+    
+    // Тему services (обзор и вкладка служб) ведет services.js
+    
+    onLive('notifications', () => scheduleLiveRefresh('activity', loadActivityLog), loadActivityLog);
+    
+    onLive('jobs', function(update) {
+        // Обновления задачи приходят частями: собираем полное состояние по id
+        const job = Object.assign(jobsState[update.id] || {}, update);
+        jobsState[update.id] = job;
+        window.dispatchEvent(new CustomEvent('job-progress', { detail: job }));
+        if (job.status !== 'running') delete jobsState[update.id];
+        if (job.status === 'done' || job.status === 'failed') {
+            const summary = job.total !== undefined && job.total !== null ? ` (${job.done}/${job.total}, failed: ${job.failed})` : '';
+            showToast(`${job.kind || 'Job'} ${job.status}${summary}`, job.status === 'done' && !job.failed ? 'success' : 'warning');
+        }
+    });
+}
+
+// Применить снимок или дельту потока трафика; повторные и старые кадры пропускаются
+function applyTrafficFrame(frame) {
+    if (frame.type === 'traffic_snapshot') {
+        trafficState = {
+            seq: frame.seq,
+            users: frame.data.users || [],
+            total: frame.data.total,
+        };
+        liveTrafficData = frame.data.history || [];
+        updateTrafficChart();
+        updateLiveTrafficDisplay(trafficState.users);
+        return;
+    }
+    
+    if (!trafficState || frame.seq <= trafficState.seq) return;
+    trafficState.seq = frame.seq;
+    
+    const delta = frame.data;
+    if ((delta.users && delta.users.length) || (delta.removed && delta.removed.length)) {
+        const removed = new Set(delta.removed || []);
+        const changed = new Map((delta.users || []).map(u => [u.user_id, u]));
+        const users = trafficState.users
+            .filter(u => !removed.has(u.user_id) && !changed.has(u.user_id))
+            .concat(Array.from(changed.values()));
+        users.sort((a, b) => (b.updated_at || '').localeCompare(a.updated_at || ''));
+        trafficState.users = users;
+        updateLiveTrafficDisplay(users);
+    }
+    if (delta.total) {
+        trafficState.total = delta.total;
+    }
+    if (delta.history && delta.history.length) {
+        liveTrafficData = liveTrafficData.concat(delta.history).slice(-20);
+        updateTrafficChart();
+    }
+}
+
 function updateTrafficChart() {
     const ctx = document.getElementById('trafficChart');
     if (!ctx) return;
@@ -665,8 +1073,8 @@ function updateLiveTrafficDisplay(users) {
 
 async function loadTrafficHistory() {
     try {
-        const response = await fetch(getApiUrl('traffic.history') + '?days=7');
-        if (!response.ok) return;
+        const response = await fetchWithValidators(getApiUrl('traffic.history') + '?days=7');
+        if (!response.ok || response.notModified) return;
         
         const data = await response.json();
         
@@ -728,8 +1136,8 @@ function updateHistoryChart(history) {
 
 async function loadActivityLog() {
     try {
-        const response = await fetch(getApiUrl('notifications.history') + '?limit=10');
-        if (!response.ok) return;
+        const response = await fetchWithValidators(getApiUrl('notifications.history') + '?limit=10');
+        if (!response.ok || response.notModified) return;
         
         const data = await response.json();
         
@@ -867,6 +1275,9 @@ function switchTab(tabName) {
     
     // Обновляем данные если нужно
     switch (tabName) {
+        case 'users':
+            renderUsersWindow(true);
+            break;
         case 'monitoring':
             updateTrafficChart();
             break;
@@ -1351,6 +1762,8 @@ function showToast(message, type = 'info') {
 // Делаем функции глобальными для использования в HTML
 window.switchTab = switchTab;
 window.loadDashboard = loadDashboard;
+window.bootstrapDashboard = bootstrapDashboard;
+window.onLive = onLive;
 window.openNotifications = openNotifications;
 window.checkNotifications = checkNotifications;
 window.clearNotifications = clearNotifications;
@@ -1373,4 +1786,6 @@ window.toggleAutoBackup = toggleAutoBackup;
 window.toggleAutoReport = toggleAutoReport;
 window.copyTextToClipboard = copyTextToClipboard;
 window.getApiUrl = getApiUrl;
+window.fetchAllUsers = fetchAllUsers;
+window.fetchWithValidators = fetchWithValidators;
 window.usersData = usersData; // Экспортируем глобально
\ No newline at end of file
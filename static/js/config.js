@@ -1,11 +1,6 @@
 // config.js - Конфигурация приложения
 const CONFIG = {
     API_URL: window.location.origin, // Используем текущий origin
-    UPDATE_INTERVALS: {
-        stats: 30000,      // 30 секунд
-        services: 60000,   // 1 минута
-        notifications: 300000 // 5 минут
-    },
     API_ENDPOINTS: {
         health: '/api/health',
         stats: '/api/stats',
@@ -14,7 +9,7 @@ const CONFIG = {
         'services.restart-all': '/api/services/restart-all',
         'services.reload-all': '/api/services/reload-all',
         'services.sync': '/api/services/sync',
-        'traffic.stream': '/api/traffic-stream',
+        'live.stream': '/api/live',
         'traffic.history': '/api/traffic/history',
         'notifications.check': '/api/notifications/check',
         'notifications.history': '/api/notifications/history',
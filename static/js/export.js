@@ -1,112 +1,18 @@
 // export.js - Функции экспорта данных
 
 // Экспортировать все конфигурации
-async function exportAllConfigs() {
+// Архив собирается на сервере одним курсором и скачивается потоком
+function exportAllConfigs(filters = {}) {
     try {
         showToast('Preparing all configurations for export...', 'info');
         
-        // Получить всех пользователей
-        const response = await fetch(getApiUrl('users'));
-        if (!response.ok) {
-            throw new Error('Failed to fetch users');
-        }
-        
-        const data = await response.json();
-        
-        if (!data.success || !data.users) {
-            throw new Error('No users found');
-        }
-        
-        // Создать ZIP архив со всеми конфигурациями
-        const zip = new JSZip();
-        
-        // Добавить README файл
-        zip.file("README.txt", 
-            `Shadowsocks Configurations Export
-Generated: ${new Date().toISOString()}
-Total Users: ${data.users.length}
-
-Instructions:
-1. Each .conf file can be imported into Shadowsocks clients
-2. QR codes are available in the web interface
-3. For bulk import, use the shadowsocks-urls.txt file
-
---- Server Information ---
-Server: ${window.serverIP || 'Not specified'}
-Export Date: ${new Date().toLocaleDateString()}
-=============================================`
-        );
-        
-        // Добавить файл со всеми URL
-        let urlsContent = "# Shadowsocks URLs for all users\n\n";
-        
-        // Для каждого пользователя получить конфигурацию и добавить в архив
-        for (const user of data.users) {
-            try {
-                const configResponse = await fetch(getApiUrl('user.config', user._id) + '/config');
-                if (configResponse.ok) {
-                    const configData = await configResponse.json();
-                    
-                    if (configData.success) {
-                        const config = configData.config;
-                        
-                        // Создать файл конфигурации
-                        const configContent = `# Shadowsocks Configuration for ${user.username}
-# Generated: ${new Date().toISOString()}
-# Expires: ${user.expires_at || 'Never'}
-# Traffic: ${user.traffic_used_gb} / ${user.traffic_limit_gb} GB (${user.traffic_percent}%)
-
-server=${config.server}
-server_port=${config.port}
-password=${config.password}
-method=${config.method}
-timeout=300
-mode=tcp_and_udp
-
-# Quick import URL: ${config.ss_url_with_comment || config.ss_url}
-
-# For Shadowsocks clients supporting SIP008:
-# {
-#   "version": 1,
-#   "servers": [
-#     {
-#       "id": "${user._id}",
-#       "remarks": "${user.username}",
-#       "server": "${config.server}",
-#       "server_port": ${config.port},
-#       "password": "${config.password}",
-#       "method": "${config.method}"
-#     }
-#   ]
-# }`;
-                        
-                        // Добавить файл конфигурации
-                        zip.file(`${user.username}.conf`, configContent);
-                        
-                        // Добавить URL в общий файл
-                        urlsContent += `${user.username}: ${config.ss_url_with_comment || config.ss_url}\n`;
-                    }
-                }
-            } catch (error) {
-                console.error(`Error processing user ${user.username}:`, error);
-            }
-        }
-        
-        // Добавить файл с URL
-        zip.file("shadowsocks-urls.txt", urlsContent);
-        
-        // Создать и скачать ZIP
-        const zipBlob = await zip.generateAsync({type: "blob"});
-        const downloadUrl = URL.createObjectURL(zipBlob);
+        const params = new URLSearchParams(Object.assign({ format: 'zip' }, filters));
         const link = document.createElement('a');
-        link.href = downloadUrl;
+        link.href = `${API_BASE}/api/export/configs?${params}`;
         link.download = `shadowsocks-configs-${new Date().toISOString().slice(0, 10)}.zip`;
         document.body.appendChild(link);
         link.click();
         document.body.removeChild(link);
-        URL.revokeObjectURL(downloadUrl);
-        
-        showToast('All configurations exported successfully!', 'success');
         
     } catch (error) {
         console.error('Error exporting configurations:', error);
@@ -119,12 +25,7 @@ async function exportUsersCSV() {
     try {
         showToast('Exporting users to CSV...', 'info');
         
-        const response = await fetch(getApiUrl('users'));
-        if (!response.ok) {
-            throw new Error('Failed to fetch users');
-        }
-        
-        const data = await response.json();
+        const data = await fetchAllUsers();
         
         if (!data.success || !data.users) {
             throw new Error('No users found');
@@ -298,12 +199,7 @@ async function backupDatabase() {
         showToast('Creating database backup...', 'info');
         
         // Получить всех пользователей
-        const usersResponse = await fetch(getApiUrl('users'));
-        if (!usersResponse.ok) {
-            throw new Error('Failed to fetch users');
-        }
-        
-        const usersData = await usersResponse.json();
+        const usersData = await fetchAllUsers();
         
         // Получить логи
         const logsResponse = await fetch(getApiUrl('notifications.history') + '?limit=1000');
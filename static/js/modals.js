@@ -772,73 +772,63 @@ function showServiceInfoModal(serviceName, username) {
         modals.activeModal = 'serviceInfoModal';
         document.body.style.overflow = 'hidden';
         
-        // Load service status with polling
+        // Статус читается один раз; дальше его обновляют ответы на действия
+        // и события service_state из /api/live
+        serviceModalName = serviceName;
         loadServiceStatus(serviceName);
-        startServiceStatusPolling(serviceName);
         
         // Load service logs
         loadServiceLogs(serviceName);
     }
 }
 
-// Загрузить статус службы с улучшенной информацией
+// Служба, открытая в окне деталей, и ее последнее отображенное состояние
+let serviceModalName = null;
+let serviceModalActive = null;
+
+// Загрузить статус службы (один systemctl show на сервере)
 async function loadServiceStatus(serviceName) {
     try {
-        const response = await fetch(getApiUrl('service.control'), {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json'
-            },
-            body: JSON.stringify({
-                service: serviceName,
-                action: 'status'
-            })
-        });
-        
+        const response = await fetch(`${API_BASE}/api/service/${encodeURIComponent(serviceName)}/state`);
         const data = await response.json();
-        const statusElement = document.getElementById('service-status-indicator');
-        const lastCheckElement = document.getElementById('service-last-check');
-        const uptimeElement = document.getElementById('service-uptime');
-        
-        if (statusElement) {
-            if (data.success) {
-                const status = data.status || {};
-                const isActive = status.active || false;
-                
-                // Обновляем статус
-                const statusDot = statusElement.querySelector('.status-dot');
-                const statusText = statusElement.querySelector('.status-text');
-                
-                statusDot.className = 'status-dot ' + (isActive ? 'active' : 'inactive');
-                statusText.textContent = isActive ? 'Active' : 'Inactive';
-                statusText.className = 'status-text ' + (isActive ? 'active' : 'inactive');
-                
-                // Обновляем время
-                if (lastCheckElement) {
-                    lastCheckElement.textContent = new Date().toLocaleTimeString();
-                }
-                
-                // Обновляем uptime (если доступно)
-                if (uptimeElement && status.uptime) {
-                    uptimeElement.textContent = formatUptime(status.uptime);
-                } else {
-                    uptimeElement.textContent = 'N/A';
-                }
-                
-            } else {
-                statusElement.querySelector('.status-dot').className = 'status-dot error';
-                statusElement.querySelector('.status-text').textContent = 'Error';
-                statusElement.querySelector('.status-text').className = 'status-text error';
-            }
-        }
+        renderServiceState(serviceName, data.success ? data.state : null);
     } catch (error) {
         console.error('Error loading service status:', error);
-        const statusElement = document.getElementById('service-status-indicator');
-        if (statusElement) {
-            statusElement.querySelector('.status-dot').className = 'status-dot error';
-            statusElement.querySelector('.status-text').textContent = 'Connection Error';
-            statusElement.querySelector('.status-text').className = 'status-text error';
-        }
+        renderServiceState(serviceName, null, 'Connection Error');
+    }
+}
+
+// Показать состояние службы в окне деталей (state из /state или ответа control с wait)
+function renderServiceState(serviceName, state, errorText = 'Error') {
+    if (serviceName !== serviceModalName) return;
+    
+    const statusElement = document.getElementById('service-status-indicator');
+    const lastCheckElement = document.getElementById('service-last-check');
+    const uptimeElement = document.getElementById('service-uptime');
+    if (!statusElement) return;
+    
+    const statusDot = statusElement.querySelector('.status-dot');
+    const statusText = statusElement.querySelector('.status-text');
+    
+    if (!state || state.success === false) {
+        statusDot.className = 'status-dot error';
+        statusText.textContent = errorText;
+        statusText.className = 'status-text error';
+        serviceModalActive = null;
+        return;
+    }
+    
+    const isActive = state.active || false;
+    serviceModalActive = isActive;
+    statusDot.className = 'status-dot ' + (isActive ? 'active' : 'inactive');
+    statusText.textContent = isActive ? 'Active' : (state.active_state === 'failed' ? 'Failed' : 'Inactive');
+    statusText.className = 'status-text ' + (isActive ? 'active' : 'inactive');
+    
+    if (lastCheckElement) {
+        lastCheckElement.textContent = new Date().toLocaleTimeString();
+    }
+    if (uptimeElement) {
+        uptimeElement.textContent = state.uptime ? formatUptime(state.uptime) : 'N/A';
     }
 }
 
@@ -853,25 +843,6 @@ function formatUptime(seconds) {
     return `${minutes}m`;
 }
 
-// Запуск периодической проверки статуса службы
-let statusPollingInterval = null;
-function startServiceStatusPolling(serviceName) {
-    // Останавливаем предыдущий интервал
-    if (statusPollingInterval) {
-        clearInterval(statusPollingInterval);
-    }
-    
-    // Запускаем новый интервал
-    statusPollingInterval = setInterval(() => {
-        if (modals.activeModal === 'serviceInfoModal') {
-            loadServiceStatus(serviceName);
-        } else {
-            clearInterval(statusPollingInterval);
-            statusPollingInterval = null;
-        }
-    }, 5000); // Проверка каждые 5 секунд
-}
-
 // Загрузить логи службы (реальная реализация)
 async function loadServiceLogs(serviceName) {
     try {
@@ -930,6 +901,7 @@ async function controlService(serviceName, action) {
     showToast(`${serviceName} ${loadingText}...`, 'info');
     
     try {
+        // wait: ответ приходит, когда служба дошла до нужного состояния
         const response = await fetch(getApiUrl('service.control'), {
             method: 'POST',
             headers: {
@@ -937,24 +909,20 @@ async function controlService(serviceName, action) {
             },
             body: JSON.stringify({
                 service: serviceName,
-                action: action
+                action: action,
+                wait: true
             })
         });
         
         const data = await response.json();
+        if (data.state) {
+            renderServiceState(serviceName, data.state);
+        }
         
         if (data.success) {
             showToast(`Service ${action}ed successfully`, 'success');
-            
-            // Обновляем статус
-            setTimeout(() => loadServiceStatus(serviceName), 1000);
-            
-            // Обновляем обзор служб
-            if (window.loadServicesOverview) {
-                setTimeout(() => window.loadServicesOverview(), 1500);
-            }
         } else {
-            showToast('Error: ' + data.message, 'error');
+            showToast('Error: ' + (data.message || data.error), 'error');
         }
     } catch (error) {
         showToast('Error: ' + error.message, 'error');
@@ -1124,10 +1092,9 @@ function closeModal(modalId) {
     if (modal) {
         modal.style.opacity = '0';
         
-        // Останавливаем polling статуса
-        if (statusPollingInterval) {
-            clearInterval(statusPollingInterval);
-            statusPollingInterval = null;
+        if (modalId === 'serviceInfoModal') {
+            serviceModalName = null;
+            serviceModalActive = null;
         }
         
         setTimeout(() => {
@@ -1153,6 +1120,18 @@ function closeAllModals() {
 document.addEventListener('DOMContentLoaded', function() {
     initModals();
     
+    // Открытое окно службы перечитывает статус, только если снимок служб
+    // показал смену состояния
+    if (typeof window.onLive === 'function') {
+        window.onLive('services', function(data) {
+            if (!serviceModalName) return;
+            const service = (data.user_services || []).find(s => s.service_name === serviceModalName);
+            if (service && service.active !== serviceModalActive) {
+                loadServiceStatus(serviceModalName);
+            }
+        });
+    }
+    
     // Закрытие модальных окон при клике вне
     document.addEventListener('click', function(event) {
         const modalIds = ['addUserModal', 'configModal', 'serviceInfoModal'];
@@ -1177,6 +1156,7 @@ window.closeAllModals = closeAllModals;
 window.copyConfig = copyConfig;
 window.shareConfig = shareConfig;
 window.controlService = controlService;
+window.renderServiceState = renderServiceState;
 window.handleAddUser = handleAddUser;
 window.generateRandomPassword = generateRandomPassword;
 window.togglePasswordVisibility = togglePasswordVisibility;
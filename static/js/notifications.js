@@ -2,21 +2,23 @@
 
 let notifications = [];
 
-// Загрузить уведомления
+// Запись журнала уведомлений -> элемент панели (тип хранится в notification_type)
+function fromLogEntry(entry) {
+    return { ...entry, type: entry.notification_type || entry.type };
+}
+
+// Загрузить последние уведомления из журнала; новые приходят через /api/live
 async function loadNotifications() {
     try {
-        const response = await fetch(getApiUrl('notifications.check'), {
-            method: 'POST'
-        });
-        
-        if (!response.ok) {
+        const response = await fetchWithValidators(getApiUrl('notifications.history') + '?limit=20');
+        if (!response.ok || response.notModified) {
             return;
         }
         
         const data = await response.json();
         
         if (data.success) {
-            notifications = data.notifications || [];
+            notifications = (data.notifications || []).map(fromLogEntry);
             updateNotificationsDisplay();
         }
     } catch (error) {
@@ -24,6 +26,25 @@ async function loadNotifications() {
     }
 }
 
+// Запустить проверку на сервере: найденные уведомления придут событиями
+async function runNotificationsCheck() {
+    try {
+        const response = await fetch(getApiUrl('notifications.check'), {
+            method: 'POST'
+        });
+        if (!response.ok) {
+            return;
+        }
+        
+        const data = await response.json();
+        if (data.success && !data.count) {
+            showToast('No new notifications', 'info');
+        }
+    } catch (error) {
+        console.error('Error checking notifications:', error);
+    }
+}
+
 // Обновить отображение уведомлений
 function updateNotificationsDisplay() {
     const list = document.getElementById('notifications-list');
@@ -179,13 +200,9 @@ function openNotifications() {
     const button = document.getElementById('notifications-btn');
     
     if (panel && button) {
+        // Список уже актуален: его обновляет поток /api/live
         const isVisible = panel.style.display === 'block';
         panel.style.display = isVisible ? 'none' : 'block';
-        
-        if (!isVisible) {
-            // Загрузить уведомления при открытии
-            loadNotifications();
-        }
     }
 }
 
@@ -211,16 +228,21 @@ function clearNotifications() {
 // Проверить уведомления
 function checkNotifications() {
     showToast('Checking for new notifications...', 'info');
-    loadNotifications();
+    runNotificationsCheck();
 }
 
 // Инициализация
 document.addEventListener('DOMContentLoaded', function() {
-    // Проверить уведомления при загрузке
-    loadNotifications();
-    
-    // Автоматическая проверка каждые 5 минут
-    setInterval(loadNotifications, 300000);
+    // Новые уведомления приходят событиями notification из /api/live;
+    // при (пере)подключении потока список перечитывается из журнала
+    if (typeof window.onLive === 'function') {
+        window.onLive('notifications', function(data) {
+            notifications.unshift(fromLogEntry(data.notification));
+            updateNotificationsDisplay();
+        }, loadNotifications);
+    } else {
+        loadNotifications();
+    }
     
     // Обработчик клика вне панели уведомлений
     document.addEventListener('click', function(event) {
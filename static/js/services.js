@@ -2,17 +2,20 @@
 // =============================================
 
 let servicesData = [];
-let servicesPollingInterval = null;
 let lastUpdateTime = null;
 let isUpdating = false; // Флаг для предотвращения множественных обновлений
 
 // Инициализация управления службами
 function initServicesManager() {
     console.log('Initializing Services Manager...');
-    loadServicesStatus();
     
-    // Запуск автоматического обновления
-    startServicesPolling();
+    // Статус служб приходит событиями service_state из /api/live;
+    // при (пере)подключении потока статус перечитывается целиком
+    if (typeof window.onLive === 'function') {
+        window.onLive('services', data => applyServicesData(data.user_services || []), () => loadServicesStatus());
+    } else {
+        loadServicesStatus();
+    }
     
     // Инициализация обработчиков событий
     setupServiceEventHandlers();
@@ -53,10 +56,11 @@ async function loadServicesStatus(forceRefresh = false) {
         // Показать индикатор загрузки
         showServicesLoading(true);
         
-        const url = getApiUrl('services.status');
+        // Принудительное обновление опрашивает systemd, иначе берется фоновый снимок
+        const url = getApiUrl('services.status') + (forceRefresh ? '?fresh=true' : '');
         console.log('Fetching from:', url);
         
-        const response = await fetch(url);
+        const response = await fetchWithValidators(url);
         console.log('Response status:', response.status);
         
         if (!response.ok) {
@@ -68,29 +72,7 @@ async function loadServicesStatus(forceRefresh = false) {
         
         if (data.success) {
             // Данные приходят в поле user_services
-            if (data.user_services && Array.isArray(data.user_services)) {
-                servicesData = data.user_services;
-                window.servicesData = servicesData; // Сохраняем глобально
-                console.log('Services data from user_services:', servicesData);
-            } else {
-                servicesData = [];
-                window.servicesData = [];
-                console.log('No user_services array found');
-            }
-            
-            lastUpdateTime = new Date();
-            
-            // Обновляем отображение в зависимости от текущей вкладки
-            updateServicesDisplayBasedOnTab();
-            
-            // Сохранить в localStorage для офлайн-доступа
-            saveServicesToLocalStorage();
-            
-            // Обновить время последнего обновления
-            updateLastUpdateTime();
-            
-            // Проверяем соответствие пользователей и служб
-            checkUserServiceMatch();
+            applyServicesData(Array.isArray(data.user_services) ? data.user_services : []);
         } else {
             console.error('Failed to load services:', data.message);
             showToast('Failed to load services: ' + data.message, 'error');
@@ -114,6 +96,38 @@ async function loadServicesStatus(forceRefresh = false) {
     }
 }
 
+// Применить новый статус служб (ответ API или событие service_state)
+function applyServicesData(services) {
+    servicesData = services;
+    window.servicesData = servicesData; // Сохраняем глобально
+    lastUpdateTime = new Date();
+    
+    // Обновляем отображение в зависимости от текущей вкладки
+    updateServicesDisplayBasedOnTab();
+    
+    // Сохранить в localStorage для офлайн-доступа
+    saveServicesToLocalStorage();
+    
+    // Обновить время последнего обновления
+    updateLastUpdateTime();
+    
+    // Проверяем соответствие пользователей и служб
+    checkUserServiceMatch();
+}
+
+// Применить состояние одной службы из ответа control (wait) к списку и окну деталей
+function applyServiceState(serviceName, state) {
+    if (!state || state.success === false) return;
+    const service = servicesData.find(s => s.service_name === serviceName);
+    if (service) {
+        Object.assign(service, { active: state.active, enabled: state.enabled, pid: state.pid });
+        applyServicesData(servicesData);
+    }
+    if (typeof window.renderServiceState === 'function') {
+        window.renderServiceState(serviceName, state);
+    }
+}
+
 // Проверка соответствия пользователей и служб
 function checkUserServiceMatch() {
     console.log('Checking user-service match...');
@@ -613,15 +627,16 @@ async function restartServiceByName(serviceName) {
             },
             body: JSON.stringify({
                 service: serviceName,
-                action: 'restart'
+                action: 'restart',
+                wait: true
             })
         });
         
         const data = await response.json();
+        applyServiceState(serviceName, data.state);
         
         if (data.success) {
             showToast(`Service ${serviceName} restarted`, 'success');
-            loadServicesStatus();
         } else {
             showToast('Error: ' + (data.message || data.error), 'error');
         }
@@ -644,19 +659,20 @@ async function controlService(serviceName, action) {
             },
             body: JSON.stringify({
                 service: serviceName,
-                action: action
+                action: action,
+                wait: true
             })
         });
         
         const data = await response.json();
         console.log('Control response:', data);
         
+        // Ответ приходит после достижения состояния: обновляем UI без повторного запроса
+        applyServiceState(serviceName, data.state);
+        
         if (data.success) {
             showToast(`Service ${action}ed successfully`, 'success');
             
-            // Обновляем статус в UI
-            await loadServicesStatus();
-            
             // Если есть функция обновления пользователей, вызываем её
             if (typeof window.loadUsers === 'function') {
                 window.loadUsers();
@@ -1004,27 +1020,6 @@ async function restartAllServices() {
     }
 }
 
-// Управление polling
-function startServicesPolling() {
-    if (servicesPollingInterval) {
-        clearInterval(servicesPollingInterval);
-    }
-    
-    // Обновлять каждые 30 секунд
-    servicesPollingInterval = setInterval(() => {
-        if (document.visibilityState === 'visible') {
-            loadServicesStatus();
-        }
-    }, 30000);
-}
-
-function stopServicesPolling() {
-    if (servicesPollingInterval) {
-        clearInterval(servicesPollingInterval);
-        servicesPollingInterval = null;
-    }
-}
-
 // LocalStorage функции
 function saveServicesToLocalStorage() {
     try {
@@ -1059,8 +1054,7 @@ async function viewServiceConfig(serviceName) {
     try {
         const username = serviceName.replace('shadowsocks-', '').replace('.service', '');
         
-        const usersResponse = await fetch(getApiUrl('users'));
-        const usersData = await usersResponse.json();
+        const usersData = await fetchAllUsers();
         
         if (!usersData.success) {
             throw new Error('Failed to fetch users');
@@ -1088,9 +1082,6 @@ async function viewServiceConfig(serviceName) {
 document.addEventListener('DOMContentLoaded', function() {
     initServicesManager();
     
-    // Обработчик для остановки polling при уходе со страницы
-    window.addEventListener('beforeunload', stopServicesPolling);
-    
     // Обработчик видимости страницы
     document.addEventListener('visibilitychange', () => {
         if (document.visibilityState === 'visible') {